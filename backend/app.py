@@ -1,3 +1,5 @@
+import time
+_import_started = time.perf_counter()
 import os
 import sys
 from flask import Flask, send_from_directory, abort
@@ -7,12 +9,22 @@ from database.db_init import init_databases
 from sections.grades import register_grade_routes
 from sections.departments import register_department_routes
 from sections.users import register_user_routes
+from sections.auth import register_auth_routes
 from sections.documents import register_document_routes
+from sections.chunked_upload import register_chunked_upload_routes
 from sections.chatbot import register_chatbot_routes
+from sections.batch_jobs import register_batch_job_routes
+from sections.retrieval import register_retrieval_routes
 from sections.model_config import register_model_config_routes, load_llm, load_sentence_transformer, get_active_model_config
 from sections.model_management import register_model_management_routes
-from sections.history import register_history_routes
+from sections.history import register_history_routes, ensure_history_schema
+from sections.retention import register_retention_routes
 from sections.document_access import register_document_access_routes
+from sections.health import register_health_routes
+from sections.metrics import register_metrics_routes
+from sections.admission import register_admission_control
+from sections.warmup import register_warmup_routes, record_startup_stage, startup_stage, startup_report, warm_up, mark_ready
+record_startup_stage("imports", time.perf_counter() - _import_started)
 
 # Initialize Flask app
 BASE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
@@ -26,15 +38,30 @@ app.config["MAX_CONTENT_LENGTH"] = MAX_CONTENT_LENGTH
 CORS(app, origins=os.getenv("CORS_ORIGINS", "*").split(","))
 
 # Register routes from all sections
-register_grade_routes(app)
-register_department_routes(app)
-register_user_routes(app)
-register_document_routes(app, load_sentence_transformer)
-register_chatbot_routes(app, load_llm, load_sentence_transformer, get_active_model_config)
-register_model_config_routes(app)
-register_model_management_routes(app)
-register_history_routes(app)
-register_document_access_routes(app)
+with startup_stage("register_routes"):
+    register_admission_control(app)
+    register_grade_routes(app)
+    register_department_routes(app)
+    register_auth_routes(app)
+    register_user_routes(app)
+    register_document_routes(app, load_sentence_transformer)
+    register_chunked_upload_routes(app, load_sentence_transformer)
+    register_chatbot_routes(app, load_llm, load_sentence_transformer, get_active_model_config)
+    register_batch_job_routes(app, load_llm, load_sentence_transformer, get_active_model_config)
+    register_retrieval_routes(app, get_active_model_config)
+    register_model_config_routes(app)
+    register_model_management_routes(app)
+    register_history_routes(app)
+    register_retention_routes(app)
+    register_document_access_routes(app)
+    register_warmup_routes(app)
+    register_health_routes(app)
+    register_metrics_routes(app)
+
+def migrate_databases():
+    """Schema upgrades that need the tables init_databases() creates; route
+    registration already ran them against an existing install"""
+    ensure_history_schema()
 
 @app.route("/uploads/<filename>")
 def uploaded_file(filename):
@@ -44,6 +71,13 @@ def uploaded_file(filename):
     return send_from_directory(app.config["UPLOAD_FOLDER"], filename)
 
 if __name__ == "__main__":
-    init_databases()  # Initialize databases before starting the app
+    with startup_stage("init_databases"):
+        init_databases()  # Initialize databases before starting the app
+        migrate_databases()
+    if os.getenv("WARMUP_ON_START", "true").lower() == "true":
+        warm_up()
+    else:
+        mark_ready()
+    print(f"Startup breakdown: {startup_report()}")
     print("Starting Flask API on http://0.0.0.0:8000")
     app.run(host="0.0.0.0", port=8000, debug=False)
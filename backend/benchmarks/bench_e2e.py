@@ -0,0 +1,250 @@
+"""End-to-end benchmark for /api/chat, /api/search and /api/upload.
+
+    cd backend && python -m benchmarks.bench_e2e --collections 4 --docs 20 --requests 200
+
+Runs the real Flask routes through the test client against throwaway databases
+and Chroma directories. The LLM is a stub with a configurable per-token cost
+unless --gguf points at a (tiny) local model; the embedder is a hashing stub
+unless --embed-model is given. Prints a JSON report (throughput and p50/p95/p99
+per endpoint and per pipeline stage) and writes it to --output for comparison
+across commits.
+"""
+import os
+import io
+import time
+import shutil
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.harness import (
+    install_bench_databases, StubLLM, HashEmbedder, synthetic_text, synthetic_queries,
+    percentiles, peak_rss_mb, git_revision, write_report, make_rng
+)
+
+def build_app(args, work_dir):
+    install_bench_databases(work_dir)
+    from flask import Flask
+    from sections import documents, chatbot, retrieval
+    from sections.auth import register_auth_routes
+    from sections.history import register_history_routes
+
+    chroma_dir = os.path.join(work_dir, "chroma_db")
+    upload_dir = os.path.join(work_dir, "uploads")
+    os.makedirs(chroma_dir, exist_ok=True)
+    os.makedirs(upload_dir, exist_ok=True)
+    documents.CHROMA_BASE_DIR = chroma_dir
+    documents.UPLOAD_FOLDER = upload_dir
+    chatbot.CHROMA_BASE_DIR = chroma_dir
+
+    if args.embed_model:
+        from sentence_transformers import SentenceTransformer
+        embedder = SentenceTransformer(args.embed_model)
+    else:
+        embedder = HashEmbedder()
+        # Hash embeddings carry no meaning, so no score threshold fits them: keep
+        # every retrieved chunk so each request exercises the generation path
+        retrieval.EMBED_CALIBRATION["hash"] = {"min_score": 0.0, "relative_floor": 0.0}
+
+    if args.gguf:
+        from ctransformers import AutoModelForCausalLM
+        llm = AutoModelForCausalLM.from_pretrained(
+            args.gguf, model_type=args.model_type, gpu_layers=0,
+            threads=args.threads, context_length=args.context_tokens
+        )
+    else:
+        llm = StubLLM(seconds_per_token=args.stub_token_seconds, default_new_tokens=args.max_new_tokens)
+
+    config = {
+        "model_path": args.gguf or "stub",
+        "embed_model_path": args.embed_model or "hash",
+        "chroma_db_base_path": chroma_dir,
+        "max_context_tokens": args.context_tokens,
+        "max_new_tokens": args.max_new_tokens,
+    }
+
+    app = Flask(__name__)
+    app.secret_key = "benchmark"
+    app.config["UPLOAD_FOLDER"] = upload_dir
+    register_auth_routes(app)
+    register_history_routes(app)
+    documents.register_document_routes(app, lambda: embedder)
+    chatbot.register_chatbot_routes(app, lambda **kwargs: llm, lambda: embedder, lambda: config)
+    return app
+
+def seed_organisation(db, args):
+    """Departments, grades, one admin and a staff user per department"""
+    import bcrypt
+    password_hash = bcrypt.hashpw(b"benchmark", bcrypt.gensalt(4)).decode("utf-8")
+    with db.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT INTO grades (name, level) VALUES ('G1', 1)")
+        grade_id = cursor.lastrowid
+        cursor.execute(
+            "INSERT INTO users (username, password_hash, role, grade_id) VALUES ('bench_admin', ?, 'admin', ?)",
+            (password_hash, grade_id)
+        )
+        admin_id = cursor.lastrowid
+        staff_ids = []
+        for i in range(args.departments):
+            cursor.execute("INSERT INTO departments (name) VALUES (?)", (f"bench_dept_{i}",))
+            department_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO users (username, password_hash, role, department_id, grade_id) VALUES (?, ?, 'staff', ?, ?)",
+                (f"bench_staff_{i}", password_hash, department_id, grade_id)
+            )
+            staff_ids.append((cursor.lastrowid, department_id))
+        conn.commit()
+    return admin_id, staff_ids
+
+def upload_collection(client, admin_id, name, rng, args):
+    data = {"db_name": name, "user_id": str(admin_id)}
+    data["files"] = [
+        (io.BytesIO(synthetic_text(rng, args.words_per_doc).encode("utf-8")), f"{name}_doc_{i}.txt")
+        for i in range(args.docs)
+    ]
+    started = time.perf_counter()
+    response = client.post("/api/upload", data=data, content_type="multipart/form-data")
+    return time.perf_counter() - started, response
+
+def grant_access(db, staff_ids):
+    with db.get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM document_collections ORDER BY id")
+        collection_ids = [row[0] for row in cursor.fetchall()]
+        for i, (_, department_id) in enumerate(staff_ids):
+            for collection_id in collection_ids[i % len(collection_ids)::max(1, len(staff_ids))] or collection_ids[:1]:
+                cursor.execute(
+                    "INSERT INTO document_access (document_collection_id, department_id, access_type) VALUES (?, ?, 'department')",
+                    (collection_id, department_id)
+                )
+        conn.commit()
+        cursor.execute(
+            "SELECT da.department_id, dc.id, dc.name, dc.chroma_db_path FROM document_access da "
+            "JOIN document_collections dc ON dc.id = da.document_collection_id"
+        )
+        return [dict(row) for row in cursor.fetchall()]
+
+def run_load(app, make_request, count, concurrency):
+    """Fire count requests across concurrency threads; returns per-request samples"""
+    def worker(indexes):
+        client = app.test_client()
+        samples = []
+        for i in indexes:
+            path, body = make_request(i)
+            started = time.perf_counter()
+            response = client.post(path, json=body)
+            elapsed = time.perf_counter() - started
+            payload = response.get_json(silent=True) or {}
+            samples.append({
+                "status": response.status_code,
+                "seconds": elapsed,
+                "stages_ms": (payload.get("timings") or {}).get("stages_ms", {}),
+            })
+        return samples
+
+    shards = [list(range(i, count, concurrency)) for i in range(concurrency)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = [s for shard in pool.map(worker, shards) for s in shard]
+    return results, time.perf_counter() - started
+
+def summarize(samples, wall_seconds):
+    ok = [s for s in samples if s["status"] == 200]
+    stage_names = sorted({name for s in ok for name in s["stages_ms"]})
+    return {
+        "requests": len(samples),
+        "errors": len(samples) - len(ok),
+        "error_statuses": sorted({s["status"] for s in samples if s["status"] != 200}),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(ok) / wall_seconds, 3) if wall_seconds else None,
+        "latency_ms": percentiles([s["seconds"] * 1000 for s in ok]),
+        "stages_ms": {
+            name: percentiles([s["stages_ms"][name] for s in ok if name in s["stages_ms"]])
+            for name in stage_names
+        },
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end chat/search/upload benchmark")
+    parser.add_argument("--collections", type=int, default=4)
+    parser.add_argument("--docs", type=int, default=20, help="Documents per collection")
+    parser.add_argument("--words-per-doc", type=int, default=1500)
+    parser.add_argument("--departments", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--endpoints", default="upload,search,chat")
+    parser.add_argument("--gguf", help="Local GGUF model instead of the stub LLM")
+    parser.add_argument("--model-type", default="llama")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--embed-model", help="sentence-transformers model path instead of the hashing stub")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--context-tokens", type=int, default=2048)
+    parser.add_argument("--stub-token-seconds", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary work directory")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    rng = make_rng(args.seed)
+    work_dir = tempfile.mkdtemp(prefix="pricol_bench_")
+    try:
+        app = build_app(args, work_dir)
+        import database.db_init as db
+        admin_id, staff_ids = seed_organisation(db, args)
+        client = app.test_client()
+
+        upload_samples = []
+        started = time.perf_counter()
+        for c in range(args.collections):
+            seconds, response = upload_collection(client, admin_id, f"bench_collection_{c}", rng, args)
+            upload_samples.append({"status": response.status_code, "seconds": seconds, "stages_ms": {}})
+        upload_wall = time.perf_counter() - started
+        access = grant_access(db, staff_ids)
+        staff_by_department = {department_id: user_id for user_id, department_id in staff_ids}
+        queries = synthetic_queries(rng, args.requests)
+
+        report = {
+            "revision": git_revision(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "keep")},
+            "results": {},
+        }
+        if "upload" in endpoints:
+            report["results"]["upload"] = summarize(upload_samples, upload_wall)
+            report["results"]["upload"]["docs_per_second"] = round(args.collections * args.docs / upload_wall, 3)
+
+        def chat_request(i):
+            grant = access[i % len(access)]
+            return "/api/chat", {
+                "query": queries[i],
+                "user_id": staff_by_department[grant["department_id"]],
+                "collection_id": grant["id"],
+                "trace": True,
+            }
+
+        def search_request(i):
+            grant = access[i % len(access)]
+            db_dir = os.path.basename(grant["chroma_db_path"])
+            return "/api/search", {
+                "query": queries[i],
+                "user_id": staff_by_department[grant["department_id"]],
+                "db_names": [f"{db_dir}/{grant['name']}"],
+                "trace": True,
+            }
+
+        for name, make_request in (("search", search_request), ("chat", chat_request)):
+            if name in endpoints:
+                samples, wall = run_load(app, make_request, args.requests, args.concurrency)
+                report["results"][name] = summarize(samples, wall)
+
+        report["peak_rss_mb"] = peak_rss_mb()
+        write_report(report, args.output)
+    finally:
+        if args.keep:
+            print(f"Work directory kept at {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
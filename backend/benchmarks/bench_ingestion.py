@@ -0,0 +1,144 @@
+"""Micro-benchmarks for the ingestion stages behind /api/upload.
+
+    cd backend && python -m benchmarks.bench_ingestion --files 20 --pages 10
+    cd backend && python -m benchmarks.bench_ingestion --embed-model sentence-transformers/all-MiniLM-L6-v2
+
+Generates a PDF, DOCX and TXT corpus with the same text, then times each stage in
+isolation: extraction per format (pages/sec, MB/sec), chunk_text (chunks/sec,
+MB/sec) and model.encode across --batch-sizes (chunks/sec). Peak RSS is sampled
+after every stage; it is a high-water mark, so read it as "growth so far".
+Without --embed-model the hashing stub is used and batch size has no effect.
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from benchmarks.harness import (
+    install_bench_databases, HashEmbedder, synthetic_text, write_txt, write_docx, write_pdf,
+    percentiles, peak_rss_mb, git_revision, write_report, make_rng
+)
+
+def build_corpus(work_dir, rng, args):
+    """Returns {format: [paths]}; every format carries the same pages of text"""
+    corpus = {"pdf": [], "docx": [], "txt": []}
+    for i in range(args.files):
+        pages = [synthetic_text(rng, args.words_per_page) for _ in range(args.pages)]
+        for fmt, writer in (("pdf", write_pdf), ("docx", write_docx), ("txt", write_txt)):
+            path = os.path.join(work_dir, f"doc_{i}.{fmt}")
+            writer(path, pages)
+            corpus[fmt].append(path)
+    return corpus
+
+def bench_extraction(readers, corpus):
+    results, texts = {}, []
+    for fmt, paths in corpus.items():
+        size = sum(os.path.getsize(p) for p in paths)
+        per_file, pages = [], 0
+        started = time.perf_counter()
+        for path in paths:
+            t0 = time.perf_counter()
+            extracted = readers[fmt](path)
+            per_file.append((time.perf_counter() - t0) * 1000)
+            pages += len(extracted)
+            if fmt == "txt":
+                texts.extend(extracted)
+        seconds = time.perf_counter() - started
+        results[fmt] = {
+            "files": len(paths),
+            "pages": pages,
+            "megabytes": round(size / 1e6, 3),
+            "seconds": round(seconds, 4),
+            "pages_per_second": round(pages / seconds, 2) if seconds else None,
+            "mb_per_second": round(size / 1e6 / seconds, 3) if seconds else None,
+            "file_ms": percentiles(per_file),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return results, texts
+
+def bench_chunking(chunk_text, texts, chunk_size, overlap):
+    size = sum(len(t.encode("utf-8")) for t in texts)
+    chunks = []
+    started = time.perf_counter()
+    for text in texts:
+        chunks.extend(chunk_text(text, chunk_size, overlap))
+    seconds = time.perf_counter() - started
+    return chunks, {
+        "chunk_size": chunk_size,
+        "overlap": overlap,
+        "chunks": len(chunks),
+        "megabytes": round(size / 1e6, 3),
+        "seconds": round(seconds, 4),
+        "chunks_per_second": round(len(chunks) / seconds, 2) if seconds else None,
+        "mb_per_second": round(size / 1e6 / seconds, 3) if seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+def bench_embedding(model, chunks, batch_sizes):
+    # One untimed call so lazy initialisation is not charged to the first batch size
+    model.encode(chunks[:1], convert_to_numpy=True)
+    results = {}
+    for batch_size in batch_sizes:
+        started = time.perf_counter()
+        model.encode(chunks, batch_size=batch_size, convert_to_numpy=True, show_progress_bar=False)
+        seconds = time.perf_counter() - started
+        results[str(batch_size)] = {
+            "chunks": len(chunks),
+            "seconds": round(seconds, 4),
+            "chunks_per_second": round(len(chunks) / seconds, 2) if seconds else None,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion stage micro-benchmarks")
+    parser.add_argument("--files", type=int, default=10, help="Files per format")
+    parser.add_argument("--pages", type=int, default=10, help="Pages per file")
+    parser.add_argument("--words-per-page", type=int, default=400)
+    parser.add_argument("--formats", default="pdf,docx,txt")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Defaults to documents.CHUNK_SIZE")
+    parser.add_argument("--chunk-overlap", type=int, default=None, help="Defaults to documents.CHUNK_OVERLAP")
+    parser.add_argument("--batch-sizes", default="8,16,32,64,128")
+    parser.add_argument("--embed-model", help="sentence-transformers model path instead of the hashing stub")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="pricol_ingest_bench_")
+    try:
+        install_bench_databases(work_dir)
+        from sections import documents
+        readers = {"pdf": documents.read_pdf_text, "docx": documents.read_docx, "txt": documents.read_txt}
+        formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+        chunk_size = args.chunk_size or documents.CHUNK_SIZE
+        overlap = args.chunk_overlap if args.chunk_overlap is not None else documents.CHUNK_OVERLAP
+
+        rng = make_rng(args.seed)
+        corpus = build_corpus(work_dir, rng, args)
+        corpus = {fmt: paths for fmt, paths in corpus.items() if fmt in formats or fmt == "txt"}
+
+        report = {
+            "revision": git_revision(),
+            "config": {k: v for k, v in vars(args).items() if k != "output"},
+            "baseline_rss_mb": peak_rss_mb(),
+        }
+        extraction, texts = bench_extraction(readers, corpus)
+        # txt is always extracted since its output feeds the chunking stage
+        report["extraction"] = {fmt: r for fmt, r in extraction.items() if fmt in formats}
+        chunks, report["chunking"] = bench_chunking(documents.chunk_text, texts, chunk_size, overlap)
+
+        if args.embed_model:
+            from sentence_transformers import SentenceTransformer
+            model = SentenceTransformer(args.embed_model)
+        else:
+            model = HashEmbedder()
+        batch_sizes = [int(b) for b in args.batch_sizes.split(",") if b.strip()]
+        report["embedding"] = bench_embedding(model, chunks, batch_sizes) if chunks else {}
+        report["peak_rss_mb"] = peak_rss_mb()
+        write_report(report, args.output)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
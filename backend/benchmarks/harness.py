@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import types
+import random
+import zipfile
+import hashlib
+import sqlite3
+import subprocess
+from contextlib import contextmanager
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+WORDS = (
+    "leave policy employee manager approval salary grade department travel allowance "
+    "reimbursement attendance shift overtime holiday notice period probation appraisal "
+    "training safety insurance medical claim transfer promotion resignation payroll "
+    "benefit canteen uniform badge security contract vendor audit compliance"
+).split()
+
+BENCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS departments (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, description TEXT, is_active BOOLEAN DEFAULT TRUE);
+CREATE TABLE IF NOT EXISTS grades (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, level INTEGER NOT NULL, description TEXT, is_active BOOLEAN DEFAULT TRUE);
+CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, role TEXT NOT NULL DEFAULT 'staff', department_id INTEGER, grade_id INTEGER, is_active BOOLEAN DEFAULT TRUE);
+CREATE TABLE IF NOT EXISTS document_collections (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT UNIQUE NOT NULL, description TEXT, chroma_db_path TEXT NOT NULL, created_by INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS document_access (id INTEGER PRIMARY KEY AUTOINCREMENT, document_collection_id INTEGER NOT NULL, department_id INTEGER, grade_id INTEGER, user_id INTEGER, access_type TEXT NOT NULL, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+CREATE TABLE IF NOT EXISTS model_configurations (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, model_path TEXT NOT NULL, embed_model_path TEXT NOT NULL, chroma_db_base_path TEXT NOT NULL, max_context_tokens INTEGER NOT NULL, max_new_tokens INTEGER NOT NULL, threads INTEGER DEFAULT 8, temperature REAL DEFAULT 0.7, prompt TEXT, model_type TEXT DEFAULT 'gguf', is_active BOOLEAN DEFAULT FALSE, created_by INTEGER, created_at DATETIME DEFAULT CURRENT_TIMESTAMP);
+"""
+
+BENCH_HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, user_message TEXT NOT NULL, ai_response TEXT NOT NULL, document_collection_id INTEGER, document_collection_name TEXT, source_documents TEXT, model_id TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, is_deleted_by_user BOOLEAN DEFAULT FALSE, deleted_at DATETIME);
+CREATE TABLE IF NOT EXISTS admin_history (id INTEGER PRIMARY KEY AUTOINCREMENT, admin_id INTEGER, action_type TEXT NOT NULL, action_details TEXT, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP);
+"""
+
+def install_bench_databases(work_dir):
+    """Point database.db_init at throwaway SQLite files under work_dir.
+
+    Must run before any sections module is imported, since they bind the
+    connection helpers at import time. Benchmarks never touch the real databases.
+    """
+    users_db = os.path.join(work_dir, "users.db")
+    history_db = os.path.join(work_dir, "history.db")
+
+    @contextmanager
+    def _connect(path):
+        conn = sqlite3.connect(path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def init_databases():
+        with _connect(users_db) as conn:
+            conn.executescript(BENCH_SCHEMA)
+        with _connect(history_db) as conn:
+            conn.executescript(BENCH_HISTORY_SCHEMA)
+
+    def log_admin_action(admin_id, action_type, action_details):
+        with _connect(history_db) as conn:
+            conn.execute(
+                "INSERT INTO admin_history (admin_id, action_type, action_details) VALUES (?, ?, ?)",
+                (admin_id, action_type, json.dumps(action_details))
+            )
+            conn.commit()
+
+    import bcrypt
+    module = types.ModuleType("database.db_init")
+    module.init_databases = init_databases
+    module.get_db_connection = lambda: _connect(users_db)
+    module.get_history_db_connection = lambda: _connect(history_db)
+    module.log_admin_action = log_admin_action
+    module.hash_password = lambda p: bcrypt.hashpw(p.encode("utf-8"), bcrypt.gensalt(4)).decode("utf-8")
+    module.verify_password = lambda p, h: bcrypt.checkpw(p.encode("utf-8"), h.encode("utf-8") if isinstance(h, str) else h)
+    package = sys.modules.get("database") or types.ModuleType("database")
+    package.db_init = module
+    sys.modules["database"] = package
+    sys.modules["database.db_init"] = module
+    install_document_access(module.get_db_connection)
+    init_databases()
+    return module
+
+def install_document_access(get_db_connection):
+    """Stand in for sections.document_access (imported by the chat routes) when
+    the tree does not ship it; same query as the real access lookup"""
+    try:
+        import sections.document_access  # noqa: F401
+        return
+    except ImportError:
+        pass
+
+    def get_user_access_documents(user_id, department_id, grade_id):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT DISTINCT dc.* FROM document_collections dc "
+                "LEFT JOIN document_access da ON dc.id = da.document_collection_id "
+                "WHERE da.user_id = ? OR da.department_id = ? OR da.grade_id = ?",
+                (user_id, department_id, grade_id)
+            )
+            return [dict(zip([col[0] for col in cursor.description], row)) for row in cursor.fetchall()]
+
+    module = types.ModuleType("sections.document_access")
+    module.get_user_access_documents = get_user_access_documents
+    sys.modules["sections.document_access"] = module
+
+class StubLLM:
+    """Stands in for the ctransformers model: emits max_new_tokens words at a fixed
+    per-token cost so the rest of the pipeline can be measured in isolation."""
+
+    def __init__(self, seconds_per_token=0.0, default_new_tokens=64):
+        self.seconds_per_token = seconds_per_token
+        self.default_new_tokens = default_new_tokens
+
+    def tokenize(self, text):
+        return text.split()
+
+    def __call__(self, prompt, max_new_tokens=None, stop=None, **kwargs):
+        n = max_new_tokens or self.default_new_tokens
+        if self.seconds_per_token:
+            time.sleep(self.seconds_per_token * n)
+        return " ".join(WORDS[i % len(WORDS)] for i in range(n))
+
+class HashEmbedder:
+    """Deterministic bag-of-words hashing embedder with the sentence-transformers
+    encode() signature, for runs without the MiniLM weights."""
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+    def encode(self, texts, convert_to_numpy=True, batch_size=32, show_progress_bar=False, **kwargs):
+        import numpy as np
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                h = int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16)
+                out[row, h % self.dim] += 1.0 if h & 1 else -1.0
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return out / norms
+
+def synthetic_text(rng, words):
+    sentences = []
+    remaining = words
+    while remaining > 0:
+        n = min(remaining, rng.randint(8, 20))
+        sentences.append(" ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + ".")
+        remaining -= n
+    paragraphs = [" ".join(sentences[i:i + 5]) for i in range(0, len(sentences), 5)]
+    return "\n\n".join(paragraphs)
+
+def write_txt(path, paragraphs):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n".join(paragraphs))
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '</Types>'
+)
+DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>'
+)
+
+def write_docx(path, paragraphs):
+    """Smallest .docx that Word and docx2txt accept: one w:p per paragraph"""
+    from xml.sax.saxutils import escape
+    body = "".join(f"<w:p><w:r><w:t>{escape(p)}</w:t></w:r></w:p>" for p in paragraphs)
+    document = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{body}</w:body></w:document>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr("[Content_Types].xml", DOCX_CONTENT_TYPES)
+        z.writestr("_rels/.rels", DOCX_RELS)
+        z.writestr("word/document.xml", document)
+
+def write_pdf(path, pages, line_chars=90):
+    """Text-only PDF with one page per entry in pages, wrapped at line_chars"""
+    def pdf_string(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+    objects = [None, None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for text in pages:
+        lines, line = [], ""
+        for word in text.split():
+            if line and len(line) + len(word) + 1 > line_chars:
+                lines.append(line)
+                line = word
+            else:
+                line = f"{line} {word}" if line else word
+        lines.append(line)
+        ops = ["BT /F1 10 Tf 12 TL 40 800 Td"] + [f"({pdf_string(l)}) Tj T*" for l in lines[:64]] + ["ET"]
+        stream = "\n".join(ops).encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    objects[0] = b"<< /Type /Catalog /Pages 2 0 R >>"
+    kids = " ".join(f"{i} 0 R" for i in page_ids).encode()
+    objects[1] = b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_ids)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+def synthetic_queries(rng, count):
+    return [f"What is the {rng.choice(WORDS)} {rng.choice(WORDS)} policy for {rng.choice(WORDS)}?" for _ in range(count)]
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    ordered = sorted(values)
+
+    def pick(q):
+        index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+        return round(ordered[index], 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99), "mean": round(sum(ordered) / len(ordered), 3)}
+
+def peak_rss_mb():
+    try:
+        import resource
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    except ImportError:
+        return None
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def write_report(report, output):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+def make_rng(seed):
+    return random.Random(seed)
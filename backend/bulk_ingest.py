@@ -0,0 +1,245 @@
+"""Offline bulk ingestion for seeding a deployment.
+
+    python bulk_ingest.py /data/archive                  # one subdirectory per collection
+    python bulk_ingest.py /data/archive --workers 16 --only "HR Policies" --only Safety
+
+Every immediate subdirectory of the root becomes a collection named after it
+(created, with its document_collections row, if it does not exist); supported
+files anywhere below it are ingested with the same extraction, chunking and
+metadata rules as /api/upload. Extraction and chunking run in a process pool
+across all cores; embedding and Chroma writes stay in this process, batched, so
+the embedder is loaded once. A file's source name is its path relative to the
+collection directory made safe with secure_filename ("forms/leave.pdf" becomes
+"forms_leave.pdf"), so same-named files in different subdirectories are kept
+apart; names secure_filename reduces to nothing (e.g. "报告.pdf") get a stem
+derived from the path hash. Each collection is committed every --commit-chunks
+chunks and at the end, and files whose source name is already in the target
+collection are skipped, so an interrupted run can be restarted and redoes at
+most the files since the last commit.
+
+Run it while the API is stopped, or at least not uploading to the same collections.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from werkzeug.utils import secure_filename
+from database.db_init import init_databases, get_db_connection, log_admin_action
+from sections.documents import (
+    READERS, CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, allowed_file, get_chunker, chunk_metadatas, resolve_collection_path
+)
+from sections.chunker import Chunker
+from sections.vector_store import open_store
+from sections.model_config import get_active_model_config, load_sentence_transformer
+
+BASE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+UPLOAD_FOLDER = os.path.join(BASE_DIR, "uploads")
+EMBED_BATCH_CHUNKS = 512
+COMMIT_CHUNKS = 20000
+
+_worker_chunker = None
+
+def init_worker(embed_model_path):
+    global _worker_chunker
+    if CHUNK_SIZE_TOKENS:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(embed_model_path)
+        _worker_chunker = Chunker(CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, tokenizer=tokenizer)
+    else:
+        _worker_chunker = get_chunker()
+
+def extract_and_chunk(collection_name, filename, path):
+    """Runs in a pool worker; returns everything the parent needs to embed and store"""
+    started = time.perf_counter()
+    ext = path.rsplit(".", 1)[1].lower()
+    pages = READERS[ext](path)
+    chunks = _worker_chunker.split_pages(pages)
+    return {
+        "collection": collection_name,
+        "filename": filename,
+        "path": path,
+        "bytes": os.path.getsize(path),
+        "pages": len(pages),
+        "texts": [chunk["text"] for chunk in chunks],
+        "metadatas": chunk_metadatas(filename, chunks, collection_name),
+        "seconds": time.perf_counter() - started,
+    }
+
+def source_name(relative_path, taken):
+    """Unique source filename for a file below a collection directory"""
+    # The extension comes from the original name: secure_filename drops non-ASCII
+    # characters, which can leave nothing but "pdf" of "报告.pdf"
+    stem, ext = relative_path.rsplit(".", 1)
+    stem = secure_filename(stem)
+    digest = hashlib.sha1(relative_path.encode("utf-8")).hexdigest()[:8]
+    name = f"{stem or digest}.{ext}"
+    if name in taken:
+        # e.g. "a/b_c.pdf" and "a_b/c.pdf"; the path hash keeps reruns stable
+        name = f"{stem or 'file'}_{digest}.{ext}"
+    taken.add(name)
+    return name
+
+def discover(root, only=None):
+    """{collection name: [(source filename, path)]} for each subdirectory of root"""
+    plan = {}
+    for entry in sorted(os.listdir(root)):
+        directory = os.path.join(root, entry)
+        if not os.path.isdir(directory) or entry.startswith(".") or (only and entry not in only):
+            continue
+        files, taken = [], set()
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if allowed_file(name):
+                    path = os.path.join(dirpath, name)
+                    files.append((source_name(os.path.relpath(path, directory), taken), path))
+        if files:
+            plan[entry] = files
+    return plan
+
+def resolve_admin(username=None):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        if username:
+            cursor.execute("SELECT id FROM users WHERE username = ? AND role = 'admin'", (username,))
+        else:
+            cursor.execute("SELECT id FROM users WHERE role = 'admin' ORDER BY id LIMIT 1")
+        row = cursor.fetchone()
+    if not row:
+        sys.exit(f"Admin user '{username}' not found" if username else "No admin user found to own the collections")
+    return row[0]
+
+class CollectionWriter:
+    """Buffers chunks for one collection and embeds/stores them in batches"""
+
+    def __init__(self, store, model, batch_chunks, commit_chunks, stats):
+        self.store = store
+        self.model = model
+        self.batch_chunks = batch_chunks
+        self.commit_chunks = commit_chunks
+        self.stats = stats
+        self.texts = []
+        self.metadatas = []
+        self.uncommitted = 0
+
+    def add(self, texts, metadatas):
+        self.texts.extend(texts)
+        self.metadatas.extend(metadatas)
+        if len(self.texts) >= self.batch_chunks:
+            self.flush()
+
+    def flush(self):
+        if not self.texts:
+            return
+        started = time.perf_counter()
+        embeddings = self.model.encode(self.texts, convert_to_numpy=True, show_progress_bar=False)
+        self.stats["embed_seconds"] += time.perf_counter() - started
+        started = time.perf_counter()
+        self.store.add([str(uuid.uuid4()) for _ in self.texts], embeddings, self.texts, self.metadatas)
+        self.stats["store_seconds"] += time.perf_counter() - started
+        self.stats["chunks"] += len(self.texts)
+        self.uncommitted += len(self.texts)
+        self.texts, self.metadatas = [], []
+        # A file's chunks are buffered together, so every file added so far is complete
+        if self.uncommitted >= self.commit_chunks:
+            self.commit()
+
+    def commit(self):
+        if not self.uncommitted:
+            return
+        started = time.perf_counter()
+        self.store.commit()
+        self.stats["store_seconds"] += time.perf_counter() - started
+        self.uncommitted = 0
+
+def run(args):
+    init_databases()
+    plan = discover(args.root, set(args.only) if args.only else None)
+    if not plan:
+        sys.exit(f"No collection subdirectories with supported files under {args.root}")
+    admin_id = resolve_admin(args.admin)
+    model = load_sentence_transformer()
+    stats = {"files": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0, "bytes": 0,
+             "extract_chunk_cpu_seconds": 0.0, "embed_seconds": 0.0, "store_seconds": 0.0}
+
+    writers, jobs = {}, []
+    for name, files in plan.items():
+        chroma_db_path = resolve_collection_path(name, admin_id)
+        os.makedirs(chroma_db_path, exist_ok=True)
+        store = open_store(chroma_db_path, name, create=True)
+        done = set(store.sources())
+        writers[name] = CollectionWriter(store, model, args.batch_chunks, args.commit_chunks, stats)
+        for filename, path in files:
+            if filename in done:
+                stats["skipped"] += 1
+            else:
+                jobs.append((name, filename, path))
+    print(f"Ingesting {len(jobs)} files into {len(plan)} collections with {args.workers} workers "
+          f"({stats['skipped']} already present)")
+
+    ingested = {name: [] for name in plan}
+    started = time.perf_counter()
+    embed_model_path = get_active_model_config()['embed_model_path']
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(embed_model_path,)) as pool:
+        futures = [pool.submit(extract_and_chunk, *job) for job in jobs]
+        for i, future in enumerate(as_completed(futures), start=1):
+            try:
+                result = future.result()
+            except Exception as e:
+                stats["failed"] += 1
+                print(f"Failed: {e}")
+                continue
+            stats["files"] += 1
+            stats["pages"] += result["pages"]
+            stats["bytes"] += result["bytes"]
+            stats["extract_chunk_cpu_seconds"] += result["seconds"]
+            if result["texts"]:
+                writers[result["collection"]].add(result["texts"], result["metadatas"])
+                ingested[result["collection"]].append(result["filename"])
+                if not args.no_copy:
+                    # Same layout as upload(), so the file download and delete routes find it
+                    shutil.copyfile(result["path"], os.path.join(UPLOAD_FOLDER, f"{uuid.uuid4().hex}_{result['filename']}"))
+            if i % 100 == 0:
+                print(f"  {i}/{len(jobs)} files, {stats['chunks']} chunks stored")
+    for writer in writers.values():
+        writer.flush()
+        writer.commit()
+    wall = time.perf_counter() - started
+
+    for name, filenames in ingested.items():
+        if filenames:
+            log_admin_action(admin_id, "upload_document", {"collection_name": name, "files": filenames, "via": "bulk_ingest"})
+
+    stats.update({
+        "collections": len(plan),
+        "workers": args.workers,
+        "wall_seconds": round(wall, 2),
+        "files_per_second": round(stats["files"] / wall, 2) if wall else None,
+        "chunks_per_second": round(stats["chunks"] / wall, 2) if wall else None,
+        "mb_per_second": round(stats["bytes"] / 1e6 / wall, 3) if wall else None,
+    })
+    for key in ("extract_chunk_cpu_seconds", "embed_seconds", "store_seconds"):
+        stats[key] = round(stats[key], 2)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk-ingest a directory tree, one subdirectory per collection")
+    parser.add_argument("root", help="Directory containing one subdirectory per collection")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Extraction/chunking processes")
+    parser.add_argument("--only", action="append", help="Only ingest this collection (repeatable)")
+    parser.add_argument("--admin", help="Username of the admin recorded as creator (default: first admin)")
+    parser.add_argument("--batch-chunks", type=int, default=EMBED_BATCH_CHUNKS, help="Chunks per embed/store batch")
+    parser.add_argument("--commit-chunks", type=int, default=COMMIT_CHUNKS,
+                        help="Commit a collection after this many stored chunks, so a restart resumes from there")
+    parser.add_argument("--no-copy", action="store_true", help="Do not copy source files into the uploads folder")
+    args = parser.parse_args()
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    print(json.dumps(run(args), indent=2))
+
+if __name__ == "__main__":
+    main()
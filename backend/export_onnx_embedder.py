@@ -0,0 +1,80 @@
+"""Export the embedding model to ONNX for EMBED_BACKEND=onnx.
+
+    python export_onnx_embedder.py                           # the active model's embed_model_path
+    python export_onnx_embedder.py models/all-MiniLM-L6-v2 --check
+
+Writes <model dir>/onnx/model.onnx (float32) and, by int8 dynamic quantization of
+its weights, <model dir>/onnx/model_qint8.onnx, which is what the onnx backend
+loads by default (EMBED_ONNX_FILE). Needs torch and transformers, so run it once
+wherever the full stack is installed; the servers then only need onnxruntime.
+--check embeds a few sentences with both backends and reports the worst cosine
+between them, to confirm existing collections can be queried with the export.
+"""
+import os
+import json
+import argparse
+from sections.model_config import get_active_model_config
+
+ONNX_OPSET = 14
+CHECK_SENTENCES = [
+    "How many days of casual leave can an employee take in a year?",
+    "Travel reimbursement requires original receipts.",
+    "What is the notice period for resignation?",
+]
+
+def export(model_dir, output_dir):
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_dir)
+    model = AutoModel.from_pretrained(model_dir).eval()
+    sample = tokenizer(["warm-up"], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    os.makedirs(output_dir, exist_ok=True)
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[name] for name in input_names), fp32_path,
+            input_names=input_names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes, opset_version=ONNX_OPSET
+        )
+
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    int8_path = os.path.join(output_dir, "model_qint8.onnx")
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return fp32_path, int8_path
+
+def check(model_dir, onnx_path):
+    import numpy as np
+    from sentence_transformers import SentenceTransformer
+    from sections.onnx_embedder import OnnxEmbedder
+    reference = SentenceTransformer(model_dir).encode(CHECK_SENTENCES, convert_to_numpy=True)
+    exported = OnnxEmbedder(model_dir, onnx_path).encode(CHECK_SENTENCES)
+    cosines = (reference * exported).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(exported, axis=1)
+    )
+    return float(cosines.min())
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the embedding model to int8 ONNX")
+    parser.add_argument("model_dir", nargs="?", help="sentence-transformers model directory (default: active embed_model_path)")
+    parser.add_argument("--output", help="Output directory (default: <model_dir>/onnx)")
+    parser.add_argument("--check", action="store_true", help="Compare embeddings against sentence-transformers")
+    args = parser.parse_args()
+    model_dir = args.model_dir or get_active_model_config()['embed_model_path']
+    fp32_path, int8_path = export(model_dir, args.output or os.path.join(model_dir, "onnx"))
+    report = {
+        "model_dir": model_dir,
+        "fp32": fp32_path,
+        "int8": int8_path,
+        "fp32_mb": round(os.path.getsize(fp32_path) / 1e6, 1),
+        "int8_mb": round(os.path.getsize(int8_path) / 1e6, 1),
+    }
+    if args.check:
+        report["min_cosine_vs_torch"] = round(check(model_dir, int8_path), 4)
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import os
+import re
+import math
+import atexit
+import time
+import tempfile
+import threading
+from flask import g, jsonify, request
+from sections.metrics import Counter
+from sections.file_lock import pid_alive, process_start
+from sections.llm_scheduler import scheduler, PRIORITY_INTERACTIVE
+
+# Requests on the chat, search and upload paths get a priority class. Interactive
+# requests (staff chat and search) are admitted unless this process's LLM queue
+# is already so deep that they would time out anyway; that only happens in
+# threaded workers (the "all" pool), as a sync inference worker takes one request
+# at a time and the rest wait in gunicorn's listen backlog. Bulk requests
+# (uploads, batch search, batch jobs) run at most ADMISSION_BULK_SLOTS at a time
+# per process and only while no interactive request is in flight in any process
+# and the CPU is not saturated; they wait up to ADMISSION_QUEUE_SECONDS for that,
+# then get 429 with Retry-After. Admitted ingestion still yields between
+# embedding batches (yield_to_interactive), and the batch job runner between items.
+# A client may ask for a lower class with "X-Priority: bulk", never a higher one.
+#
+# Every process publishes its interactive in-flight count as a file named after
+# its pid in ADMISSION_STATE_DIR, shared by all pools on the host, so the bulk
+# pool sees chats running in the inference workers. A process removes its file at
+# exit; files of dead pids, or of pids since reused by another process, are ignored.
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITY_ORDER = (INTERACTIVE, BULK)
+
+ADMISSION_MAX_LLM_QUEUE = int(os.getenv("ADMISSION_MAX_LLM_QUEUE", "8"))
+ADMISSION_BULK_SLOTS = int(os.getenv("ADMISSION_BULK_SLOTS", "1"))
+ADMISSION_QUEUE_SECONDS = float(os.getenv("ADMISSION_QUEUE_SECONDS", "2"))
+# 1-minute load average per core above which bulk work is shed; a generation
+# alone keeps it near 1.0, so this only trips when cores are oversubscribed
+ADMISSION_MAX_LOAD = float(os.getenv("ADMISSION_MAX_LOAD", "1.5"))
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))
+INTERACTIVE_YIELD_SECONDS = float(os.getenv("INTERACTIVE_YIELD_SECONDS", "30"))
+ADMISSION_POLL_SECONDS = 0.05
+ADMISSION_STATE_DIR = os.getenv("ADMISSION_STATE_DIR", os.path.join(tempfile.gettempdir(), "pricol-admission"))
+
+# (method, path pattern, class); the first match wins
+ROUTE_CLASSES = [
+    ("POST", re.compile(r"^/api/search/batch$"), BULK),
+    ("POST", re.compile(r"^/api/chat/batch$"), BULK),
+    ("POST", re.compile(r"^/api/upload$"), BULK),
+    ("POST", re.compile(r"^/api/upload/sessions/[^/]+/complete$"), BULK),
+    ("POST", re.compile(r"^/api/chat$"), INTERACTIVE),
+    ("POST", re.compile(r"^/api/search$"), INTERACTIVE),
+]
+
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests refused with 429 by priority class and reason")
+
+_bulk_slots = threading.BoundedSemaphore(max(1, ADMISSION_BULK_SLOTS))
+_in_flight = {name: 0 for name in PRIORITY_ORDER}
+_in_flight_lock = threading.Lock()
+_published_pid = None
+_published_start = None
+
+def request_class(method, path, requested=None):
+    """Priority class of a request, or None for paths without admission control"""
+    for route_method, pattern, name in ROUTE_CLASSES:
+        if method == route_method and pattern.match(path):
+            if requested in PRIORITY_ORDER and PRIORITY_ORDER.index(requested) > PRIORITY_ORDER.index(name):
+                return requested
+            return name
+    return None
+
+def cpu_load():
+    """1-minute load average per core; None where the OS does not report it"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+def cpu_saturated():
+    load = cpu_load()
+    return load is not None and load > ADMISSION_MAX_LOAD
+
+def _state_path(pid):
+    return os.path.join(ADMISSION_STATE_DIR, str(pid))
+
+def _remove_state():
+    try:
+        os.remove(_state_path(os.getpid()))
+    except OSError:
+        pass
+
+def _publish_interactive(count):
+    """Record this process's interactive in-flight count, with its start time,
+    for the other processes"""
+    global _published_pid, _published_start
+    pid = os.getpid()
+    if _published_pid != pid:
+        # Forked workers inherit these, so each process registers its own cleanup
+        _published_pid, _published_start = pid, process_start(pid)
+        atexit.register(_remove_state)
+    start = _published_start
+    try:
+        os.makedirs(ADMISSION_STATE_DIR, exist_ok=True)
+        path = _state_path(pid)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(f"{count} {start}" if start is not None else str(count))
+        os.replace(tmp, path)
+    except OSError:
+        pass
+
+def interactive_in_flight():
+    """Interactive requests being served by any live process on this host"""
+    total = 0
+    try:
+        names = os.listdir(ADMISSION_STATE_DIR)
+    except OSError:
+        names = []
+    for name in names:
+        if not name.isdigit() or int(name) == os.getpid() or not pid_alive(int(name)):
+            continue
+        try:
+            with open(_state_path(name)) as f:
+                fields = f.read().split()
+            count = int(fields[0]) if fields else 0
+            if len(fields) > 1 and process_start(int(name)) not in (None, int(fields[1])):
+                continue  # written by an earlier process with the same pid
+            total += count
+        except (OSError, ValueError):
+            continue
+    with _in_flight_lock:
+        return total + _in_flight[INTERACTIVE]
+
+def interactive_busy():
+    return (
+        scheduler.depth(PRIORITY_INTERACTIVE) > 0
+        or scheduler.running() == "interactive"
+        or interactive_in_flight() > 0
+    )
+
+def bulk_blocker():
+    """Why bulk work should not start right now, or None"""
+    if interactive_busy():
+        return "interactive_queue"
+    if cpu_saturated():
+        return "cpu"
+    return None
+
+def interactive_retry_after():
+    """Seconds until the current interactive LLM queue should have drained"""
+    depth = scheduler.depth(PRIORITY_INTERACTIVE) + 1
+    return max(1, math.ceil(depth * (scheduler.average_run_seconds or ADMISSION_RETRY_AFTER)))
+
+def yield_to_interactive(max_wait=INTERACTIVE_YIELD_SECONDS):
+    """Called by bulk work between batches: pause while interactive generations
+    are queued, for at most max_wait seconds"""
+    deadline = time.monotonic() + max_wait
+    while interactive_busy() and time.monotonic() < deadline:
+        time.sleep(ADMISSION_POLL_SECONDS)
+
+def in_flight():
+    with _in_flight_lock:
+        return dict(_in_flight)
+
+def too_busy(priority_class, reason, retry_after):
+    ADMISSION_REJECTED.inc(priority=priority_class, reason=reason)
+    response = jsonify({
+        "error": "Server is busy, retry later",
+        "priority": priority_class,
+        "reason": reason,
+        "retry_after": retry_after,
+    })
+    response.headers["Retry-After"] = str(retry_after)
+    return response, 429
+
+def admit(priority_class):
+    """None when admitted, else a 429 response"""
+    if priority_class == INTERACTIVE:
+        if scheduler.depth(PRIORITY_INTERACTIVE) >= ADMISSION_MAX_LLM_QUEUE:
+            return too_busy(priority_class, "llm_queue", interactive_retry_after())
+        return None
+
+    deadline = time.monotonic() + ADMISSION_QUEUE_SECONDS
+    if not _bulk_slots.acquire(timeout=ADMISSION_QUEUE_SECONDS):
+        return too_busy(priority_class, "bulk_slots", ADMISSION_RETRY_AFTER)
+    reason = bulk_blocker()
+    while reason and time.monotonic() < deadline:
+        time.sleep(ADMISSION_POLL_SECONDS)
+        reason = bulk_blocker()
+    if reason:
+        _bulk_slots.release()
+        return too_busy(priority_class, reason, ADMISSION_RETRY_AFTER)
+    g.bulk_slot = True
+    return None
+
+def bulk_in_flight():
+    return in_flight()[BULK]
+
+def register_admission_control(app):
+    @app.before_request
+    def admission_control():
+        priority_class = request_class(request.method, request.path, request.headers.get("X-Priority"))
+        if priority_class is None:
+            return None
+        rejection = admit(priority_class)
+        if rejection is not None:
+            return rejection
+        g.priority_class = priority_class
+        with _in_flight_lock:
+            _in_flight[priority_class] += 1
+            if priority_class == INTERACTIVE:
+                _publish_interactive(_in_flight[INTERACTIVE])
+        return None
+
+    @app.teardown_request
+    def release_admission(exc=None):
+        priority_class = g.pop("priority_class", None)
+        if priority_class is None:
+            return
+        with _in_flight_lock:
+            _in_flight[priority_class] -= 1
+            if priority_class == INTERACTIVE:
+                _publish_interactive(_in_flight[INTERACTIVE])
+        if g.pop("bulk_slot", False):
+            _bulk_slots.release()
@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from flask import jsonify, request, abort
+from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
+from database.db_init import get_db_connection, verify_password
+
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "1800"))
+SESSION_SALT = "pricol-session"
+# bcrypt releases the GIL, so without a cap a login burst can occupy every core
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "64"))
+BCRYPT_TIMEOUT_SECONDS = float(os.getenv("BCRYPT_TIMEOUT_SECONDS", "10"))
+
+_serializer = None
+_bcrypt_pool = ThreadPoolExecutor(max_workers=BCRYPT_WORKERS, thread_name_prefix="bcrypt")
+_bcrypt_slots = threading.BoundedSemaphore(BCRYPT_MAX_PENDING)
+_bcrypt_pending = 0
+_bcrypt_pending_lock = threading.Lock()
+
+def init_session_signer(secret_key):
+    global _serializer
+    _serializer = URLSafeTimedSerializer(secret_key, salt=SESSION_SALT)
+
+def issue_session_token(user):
+    """Sign the identity claims that routes need so they can skip the users lookup"""
+    return _serializer.dumps({
+        "id": user["id"],
+        "username": user.get("username"),
+        "role": user["role"],
+        "department_id": user.get("department_id"),
+        "grade_id": user.get("grade_id"),
+    })
+
+def verify_session_token(token):
+    """Return the token claims, or None if the token is forged or older than the TTL"""
+    try:
+        return _serializer.loads(token, max_age=SESSION_TTL_SECONDS)
+    except (SignatureExpired, BadSignature):
+        return None
+
+def bcrypt_queue_depth():
+    return _bcrypt_pending
+
+def _release_bcrypt_slot(future):
+    global _bcrypt_pending
+    with _bcrypt_pending_lock:
+        _bcrypt_pending -= 1
+    _bcrypt_slots.release()
+
+def check_password(password, password_hash):
+    """Run bcrypt on the bounded pool; returns None when the pool is saturated or
+    the check does not finish within BCRYPT_TIMEOUT_SECONDS"""
+    global _bcrypt_pending
+    if not _bcrypt_slots.acquire(blocking=False):
+        return None
+    with _bcrypt_pending_lock:
+        _bcrypt_pending += 1
+    try:
+        future = _bcrypt_pool.submit(verify_password, password, password_hash)
+    except BaseException:
+        with _bcrypt_pending_lock:
+            _bcrypt_pending -= 1
+        _bcrypt_slots.release()
+        raise
+    # The slot is held until bcrypt finishes, not until this caller stops
+    # waiting, so timed-out checks still count against BCRYPT_MAX_PENDING
+    future.add_done_callback(_release_bcrypt_slot)
+    try:
+        return future.result(timeout=BCRYPT_TIMEOUT_SECONDS)
+    except FutureTimeoutError:
+        return None
+
+def load_identity(user_id):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, username, role, department_id, grade_id FROM users WHERE id = ? AND is_active = TRUE",
+            (user_id,)
+        )
+        row = cursor.fetchone()
+        return dict(zip([col[0] for col in cursor.description], row)) if row else None
+
+def get_request_identity(user_id=None):
+    """Resolve the caller from a Bearer session token, falling back to a users lookup
+    for clients that still send a raw user_id. Aborts with 401 on a bad token."""
+    auth_header = request.headers.get("Authorization", "")
+    if auth_header.startswith("Bearer "):
+        claims = verify_session_token(auth_header[len("Bearer "):].strip())
+        if claims is None:
+            abort(401, description="Invalid or expired session token")
+        return claims
+    try:
+        user_id = int(user_id) if user_id else None
+    except (TypeError, ValueError):
+        return None
+    return load_identity(user_id) if user_id else None
+
+def register_auth_routes(app):
+    init_session_signer(app.secret_key)
+
+    @app.errorhandler(401)
+    def unauthorized(e):
+        return jsonify({"error": e.description}), 401
+
+    @app.route("/api/session/refresh", methods=["POST"])
+    def refresh_session():
+        """Re-issue a token, re-reading the user so role changes apply within one TTL"""
+        identity = get_request_identity()
+        if not identity:
+            return jsonify({"error": "Session token required"}), 401
+        try:
+            user = load_identity(identity["id"])
+            if not user:
+                return jsonify({"error": "User not found or inactive"}), 401
+            return jsonify({"token": issue_session_token(user), "expires_in": SESSION_TTL_SECONDS})
+        except Exception as e:
+            return jsonify({"error": f"Database error: {str(e)}"}), 500
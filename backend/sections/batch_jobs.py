@@ -0,0 +1,429 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from flask import jsonify, request
+from database.db_init import get_db_connection, get_history_db_connection, log_admin_action
+from sections.auth import get_request_identity
+from sections.chatbot import build_chat_prompt
+from sections.model_config import count_tokens
+from sections.vector_store import open_store
+from sections.llm_scheduler import scheduler, PRIORITY_BATCH
+from sections.admission import yield_to_interactive
+from sections.generation import REFUSAL_ANSWER, token_budget, generation_kwargs, finish_answer
+from sections.retrieval import retrieval_settings, select_chunks, pick
+
+logger = logging.getLogger(__name__)
+
+# Offline answer generation for lists of (query, collection) pairs, e.g. the FAQ
+# set after a policy change. Items are stored in the history database and
+# processed by a runner thread in the bulk pool (or the single "all" pool; see
+# BATCH_RUNNER_POOLS): retrieval for BATCH_RETRIEVAL_SIZE items at a time (one
+# encode call, one multi-embedding query per collection), then generation item
+# by item at batch priority on the LLM scheduler. Inference workers never run
+# jobs, so interactive chats do not wait behind batch generations. A lease row
+# makes one worker at a time the runner; a crashed runner's lease expires and
+# its in-flight items are picked up again, so jobs survive restarts.
+BATCH_RETRIEVAL_SIZE = int(os.getenv("BATCH_RETRIEVAL_SIZE", "32"))
+BATCH_LEASE_SECONDS = int(os.getenv("BATCH_LEASE_SECONDS", "900"))
+BATCH_POLL_SECONDS = int(os.getenv("BATCH_POLL_SECONDS", "5"))
+MAX_BATCH_JOB_ITEMS = int(os.getenv("MAX_BATCH_JOB_ITEMS", "5000"))
+# Pools (serve.py --pool, exported as PRICOL_POOL) whose workers run jobs; a
+# process started without serve.py (python app.py) counts as "all"
+BATCH_RUNNER_POOLS = set(os.getenv("BATCH_RUNNER_POOLS", "bulk,all").split(","))
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+BATCH_JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS batch_jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_by INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    total INTEGER NOT NULL,
+    completed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    max_new_tokens INTEGER,
+    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+    finished_at DATETIME
+);
+CREATE TABLE IF NOT EXISTS batch_job_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    query TEXT NOT NULL,
+    collection_id INTEGER NOT NULL,
+    file_name TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    answer TEXT,
+    source_documents TEXT,
+    error TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    finished_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_batch_job_items_status ON batch_job_items(status, job_id, position);
+CREATE INDEX IF NOT EXISTS idx_batch_job_items_job ON batch_job_items(job_id, position);
+CREATE TABLE IF NOT EXISTS batch_job_lease (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    owner TEXT,
+    expires_at REAL NOT NULL DEFAULT 0
+);
+"""
+
+ITEM_FIELDS = ["id", "position", "query", "collection_id", "file_name", "status", "answer",
+               "source_documents", "error", "prompt_tokens", "completion_tokens", "finished_at"]
+
+def ensure_batch_job_tables():
+    with get_history_db_connection() as conn:
+        conn.executescript(BATCH_JOB_SCHEMA)
+        conn.commit()
+
+def acquire_lease(owner, now=None):
+    """Take or renew the runner lease; True while this owner holds it"""
+    now = now or time.time()
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO batch_job_lease (id, owner, expires_at) VALUES (1, NULL, 0)")
+        cursor.execute(
+            "UPDATE batch_job_lease SET owner = ?, expires_at = ? WHERE id = 1 AND (owner = ? OR owner IS NULL OR expires_at < ?)",
+            (owner, now + BATCH_LEASE_SECONDS, owner, now)
+        )
+        conn.commit()
+        return cursor.rowcount == 1
+
+def release_lease(owner):
+    """Give the lease up while idle so any worker can pick up the next job at once"""
+    with get_history_db_connection() as conn:
+        conn.execute("UPDATE batch_job_lease SET owner = NULL, expires_at = 0 WHERE id = 1 AND owner = ?", (owner,))
+        conn.commit()
+
+def claim_items(owner, limit, reclaim=False, now=None):
+    """Mark the next pending items of live jobs as running and return them.
+    With reclaim, first requeue the items a previous lease holder left running."""
+    now = now or time.time()
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        if reclaim:
+            # Only the lease holder runs items, so anything 'running' when the
+            # lease changes hands was abandoned by a holder that died or lost it
+            cursor.execute(
+                "UPDATE batch_job_items SET status = 'pending' WHERE status = 'running' AND EXISTS "
+                "(SELECT 1 FROM batch_job_lease WHERE id = 1 AND owner = ? AND expires_at > ?)",
+                (owner, now)
+            )
+        cursor.execute(
+            "SELECT i.id, i.job_id, i.query, i.collection_id, i.file_name, j.max_new_tokens "
+            "FROM batch_job_items i JOIN batch_jobs j ON j.id = i.job_id "
+            "WHERE i.status = 'pending' AND j.status IN ('pending', 'running') "
+            "ORDER BY i.job_id, i.position LIMIT ?",
+            (limit,)
+        )
+        items = [dict(zip([col[0] for col in cursor.description], row)) for row in cursor.fetchall()]
+        if items:
+            cursor.execute(
+                f"UPDATE batch_job_items SET status = 'running' WHERE id IN ({', '.join('?' * len(items))})",
+                [item['id'] for item in items]
+            )
+            cursor.execute(
+                f"UPDATE batch_jobs SET status = 'running' WHERE status = 'pending' AND id IN "
+                f"({', '.join('?' * len({item['job_id'] for item in items}))})",
+                sorted({item['job_id'] for item in items})
+            )
+        conn.commit()
+    return items
+
+def cancel_item(item):
+    with get_history_db_connection() as conn:
+        conn.execute(
+            "UPDATE batch_job_items SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP WHERE id = ? AND status = 'running'",
+            (item['id'],)
+        )
+        conn.commit()
+
+def finish_item(item, answer=None, source_documents=None, error=None, prompt_tokens=None, completion_tokens=None):
+    counter = "failed" if error else "completed"
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE batch_job_items SET status = ?, answer = ?, source_documents = ?, error = ?, "
+            "prompt_tokens = ?, completion_tokens = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            ("failed" if error else "done", answer, json.dumps(source_documents) if source_documents is not None else None,
+             error, prompt_tokens, completion_tokens, item['id'])
+        )
+        cursor.execute(f"UPDATE batch_jobs SET {counter} = {counter} + 1 WHERE id = ?", (item['job_id'],))
+        cursor.execute(
+            "UPDATE batch_jobs SET status = 'done', finished_at = CURRENT_TIMESTAMP "
+            "WHERE id = ? AND status = 'running' AND completed + failed >= total",
+            (item['job_id'],)
+        )
+        conn.commit()
+
+def load_collections(collection_ids):
+    if not collection_ids:
+        return {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"SELECT * FROM document_collections WHERE id IN ({', '.join('?' * len(collection_ids))})",
+            list(collection_ids)
+        )
+        columns = [col[0] for col in cursor.description]
+        return {row["id"]: row for row in (dict(zip(columns, values)) for values in cursor.fetchall())}
+
+def job_status(job_id):
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM batch_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        return dict(zip([col[0] for col in cursor.description], row)) if row else None
+
+class BatchJobRunner:
+    def __init__(self, load_llm, load_sentence_transformer, get_active_model_config):
+        self.load_llm = load_llm
+        self.load_sentence_transformer = load_sentence_transformer
+        self.get_active_model_config = get_active_model_config
+        self.owner = None
+        self.holding = False
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the runner thread in this process (again after a fork)"""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+                self.holding = False
+                self._thread = threading.Thread(target=self._run, name="batch-jobs", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                worked = self.run_once()
+            except Exception:
+                logger.exception("Batch job round failed")
+                worked = False
+            if not worked:
+                self._wake.wait(BATCH_POLL_SECONDS)
+                self._wake.clear()
+
+    def run_once(self):
+        """Retrieve and answer one round of items; False when there was nothing to do"""
+        if not acquire_lease(self.owner):
+            self.holding = False
+            return False
+        # This holder finishes every item it claims, so only a new holder has anything to requeue
+        taken_over, self.holding = not self.holding, True
+        items = claim_items(self.owner, BATCH_RETRIEVAL_SIZE, reclaim=taken_over)
+        if not items:
+            release_lease(self.owner)
+            self.holding = False
+            return False
+        yield_to_interactive()
+        retrieved = self.retrieve(items)
+        config = self.get_active_model_config()
+        llm = self.load_llm()
+        for item in items:
+            if not acquire_lease(self.owner):
+                # Another worker took over; it resets and reruns what is left
+                self.holding = False
+                return True
+            if job_status(item['job_id'])['status'] == 'cancelled':
+                cancel_item(item)
+                continue
+            if item['id'] not in retrieved:
+                continue
+            documents, metadatas, error = retrieved[item['id']]
+            if error:
+                finish_item(item, error=error)
+                continue
+            if not documents:
+                finish_item(item, REFUSAL_ANSWER, [], None, 0, 0)
+                continue
+            try:
+                prompt, source_documents = build_chat_prompt(item['query'], documents, metadatas, config['max_context_tokens'])
+                # A budget set on the job wins over the per-query-class one
+                max_new_tokens = item['max_new_tokens'] or token_budget(item['query'], config['max_new_tokens'])
+                answer = finish_answer(scheduler.generate(llm, prompt, PRIORITY_BATCH, **generation_kwargs(max_new_tokens)))
+                finish_item(item, answer, source_documents, None, count_tokens(llm, prompt), count_tokens(llm, answer))
+            except Exception as e:
+                logger.error(f"Batch item {item['id']} failed: {str(e)}")
+                finish_item(item, error=str(e))
+        return True
+
+    def retrieve(self, items):
+        """{item id: (documents, metadatas, error)}, only the selected chunks, with one encode call for the
+        round and one query per (collection, file)"""
+        collections = load_collections({item['collection_id'] for item in items})
+        model = self.load_sentence_transformer()
+        embed_model_path = self.get_active_model_config()['embed_model_path']
+        embeddings = model.encode([item['query'] for item in items], convert_to_numpy=True)
+        groups = {}
+        for item, embedding in zip(items, embeddings):
+            groups.setdefault((item['collection_id'], item['file_name']), []).append((item, embedding.tolist()))
+
+        retrieved = {}
+        for (collection_id, file_name), members in groups.items():
+            collection = collections.get(collection_id)
+            try:
+                if collection is None:
+                    raise ValueError(f"Collection {collection_id} no longer exists")
+                store = open_store(collection['chroma_db_path'], collection['name'])
+                settings = retrieval_settings(embed_model_path, collection, "chat")
+                query_params = {
+                    "query_embeddings": [embedding for _, embedding in members],
+                    "n_results": settings["max_k"],
+                    "include": ["documents", "metadatas", "distances"]
+                }
+                if file_name:
+                    query_params["where"] = {"source": file_name}
+                results = store.query(**query_params)
+            except Exception as e:
+                for item, _ in members:
+                    retrieved[item['id']] = ([], [], f"Retrieval error: {str(e)}")
+                continue
+            for (item, _), documents, metadatas, distances in zip(
+                members, results.get("documents", []), results.get("metadatas", []), results.get("distances", [])
+            ):
+                selected = select_chunks(distances, settings)
+                retrieved[item['id']] = (pick(documents, selected), pick(metadatas, selected), None)
+        return retrieved
+
+def register_batch_job_routes(app, load_llm, load_sentence_transformer, get_active_model_config):
+    ensure_batch_job_tables()
+    runner = BatchJobRunner(load_llm, load_sentence_transformer, get_active_model_config)
+
+    @app.before_request
+    def start_batch_runner():
+        # Any request (health probes included) starts the runner in its pool;
+        # inference workers and the admin pool never run jobs
+        if os.getenv("PRICOL_POOL", "all") in BATCH_RUNNER_POOLS:
+            runner.ensure_started()
+
+    def require_admin(user):
+        if not user:
+            return jsonify({"error": "User ID required"}), 400
+        if user['role'] != 'admin':
+            return jsonify({"error": "Only admins can run batch jobs"}), 403
+        return None
+
+    @app.route("/api/chat/batch", methods=["POST"])
+    def create_batch_job():
+        """Queue answers for many questions. Body: user_id, items (each
+        {"query", "collection_id", "file_name"?}) and optional max_new_tokens."""
+        data = request.get_json(silent=True) or {}
+        user = get_request_identity(data.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        items = data.get("items") or []
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "items must be a non-empty list"}), 400
+        if len(items) > MAX_BATCH_JOB_ITEMS:
+            return jsonify({"error": f"At most {MAX_BATCH_JOB_ITEMS} items per job"}), 400
+        max_new_tokens = data.get("max_new_tokens")
+        if max_new_tokens is not None and (not isinstance(max_new_tokens, int) or max_new_tokens < 1):
+            return jsonify({"error": "max_new_tokens must be a positive integer"}), 400
+
+        rows = []
+        for position, item in enumerate(items):
+            query = (item.get("query") or "").strip() if isinstance(item, dict) else ""
+            try:
+                collection_id = int(item.get("collection_id"))
+            except (AttributeError, TypeError, ValueError):
+                collection_id = None
+            if not query or collection_id is None:
+                return jsonify({"error": f"Item {position} needs query and collection_id"}), 400
+            file_name = item.get("file_name")
+            if file_name is not None and not isinstance(file_name, str):
+                return jsonify({"error": f"Item {position}: file_name must be a string"}), 400
+            rows.append((position, query, collection_id, file_name or None))
+        missing = {row[2] for row in rows} - set(load_collections({row[2] for row in rows}))
+        if missing:
+            return jsonify({"error": f"Collections not found: {sorted(missing)}"}), 404
+
+        with get_history_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO batch_jobs (created_by, total, max_new_tokens) VALUES (?, ?, ?)",
+                (user['id'], len(rows), max_new_tokens)
+            )
+            job_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO batch_job_items (job_id, position, query, collection_id, file_name) VALUES (?, ?, ?, ?, ?)",
+                [(job_id,) + row for row in rows]
+            )
+            conn.commit()
+        log_admin_action(user['id'], "create_batch_job", {"job_id": job_id, "items": len(rows)})
+        runner.wake()
+        return jsonify(job_status(job_id)), 202
+
+    @app.route("/api/chat/batch/<int:job_id>", methods=["GET"])
+    def get_batch_job(job_id):
+        """Job progress plus a page of its items in submission order (offset, limit, status)"""
+        user = get_request_identity(request.args.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        job = job_status(job_id)
+        if job is None:
+            return jsonify({"error": "Batch job not found"}), 404
+        offset = max(request.args.get("offset", 0, type=int), 0)
+        limit = min(max(request.args.get("limit", DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+        conditions, params = ["job_id = ?"], [job_id]
+        if request.args.get("status"):
+            conditions.append("status = ?")
+            params.append(request.args.get("status"))
+        with get_history_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT {', '.join(ITEM_FIELDS)} FROM batch_job_items WHERE {' AND '.join(conditions)} "
+                f"ORDER BY position LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            )
+            job["items"] = [dict(zip(ITEM_FIELDS, row)) for row in cursor.fetchall()]
+        for item in job["items"]:
+            if item["source_documents"]:
+                item["source_documents"] = json.loads(item["source_documents"])
+        return jsonify(job)
+
+    @app.route("/api/chat/batch/<int:job_id>/cancel", methods=["POST"])
+    def cancel_batch_job(job_id):
+        """Stop a job; items already answered are kept"""
+        data = request.get_json(silent=True) or {}
+        user = get_request_identity(data.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        with get_history_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE batch_jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                "WHERE id = ? AND status IN ('pending', 'running')",
+                (job_id,)
+            )
+            if cursor.rowcount:
+                # Items the runner has claimed are marked when it reaches them
+                cursor.execute(
+                    "UPDATE batch_job_items SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP "
+                    "WHERE job_id = ? AND status = 'pending'",
+                    (job_id,)
+                )
+            conn.commit()
+        job = job_status(job_id)
+        if job is None:
+            return jsonify({"error": "Batch job not found"}), 404
+        return jsonify(job)
+
+    return runner
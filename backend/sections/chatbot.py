@@ -3,24 +3,36 @@ import sys
 import time
 import uuid
 import json
+from concurrent.futures import ThreadPoolExecutor
 from flask import jsonify, request
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from sentence_transformers import SentenceTransformer
-import chromadb
 from database.db_init import get_db_connection, get_history_db_connection
 from sections.document_access import get_user_access_documents
-from sections.model_config import DEFAULT_PROMPT_TEMPLATE, MODEL_PATH, EMBED_MODEL, CHROMA_BASE_DIR
+from sections.auth import get_request_identity
+from sections.model_config import DEFAULT_PROMPT_TEMPLATE, MODEL_PATH, EMBED_MODEL, CHROMA_BASE_DIR, count_tokens
+from sections.metrics import StageTimer, RETRIEVED_CHUNKS, FAST_REFUSALS, observe_generation
+from sections.vector_store import open_store
+from sections.llm_scheduler import scheduler
+from sections.generation import (
+    REFUSAL_ANSWER, classify_query, token_budget, generation_kwargs, finish_answer
+)
+from sections.retrieval import ENDPOINT_MAX_K, retrieval_settings, select_chunks, pick, distance_score, load_collections_by_name
+
+# Return stage timings on every request, not only when the client asks with "trace": true
+TRACE_ALL = os.getenv("TRACE_ALL", "false").lower() == "true"
+
+# Upper bound on queries per /api/search/batch request
+MAX_BATCH_QUERIES = int(os.getenv("MAX_BATCH_QUERIES", "1000"))
+
+# Query embeddings run here, overlapping the identity and ACL lookups
+QUERY_EMBED_WORKERS = int(os.getenv("QUERY_EMBED_WORKERS", "2"))
+_embed_pool = ThreadPoolExecutor(max_workers=QUERY_EMBED_WORKERS, thread_name_prefix="query-embed")
 
 # Store model configurations in memory (or use a database in production)
 MODEL_CONFIGS = {}
 
-prompt_template = PromptTemplate(
-    input_variables=["query", "context"],
-    template=DEFAULT_PROMPT_TEMPLATE
-)
+# Formatted with str.format and passed straight to the ctransformers model, so the
+# chat path does not need LangChain's prompt/chain machinery at all
+prompt_template = DEFAULT_PROMPT_TEMPLATE
 
 def truncate_context(text, max_tokens=2048):
     max_chars = max_tokens * 4
@@ -28,6 +40,63 @@ def truncate_context(text, max_tokens=2048):
         return text[-max_chars:]
     return text
 
+def split_db_name(db_name):
+    """(db_dir, collection name, file name or None) from "db_dir/collection[/file]" """
+    parts = db_name.split("/")
+    if len(parts) > 2:
+        return parts[0], parts[1], "/".join(parts[2:])
+    return parts[0], parts[1], None
+
+def db_names_error(db_names):
+    """Why db_names is not a list of "db_dir/collection[/file]" strings, or None"""
+    if not isinstance(db_names, list):
+        return "db_names must be a list"
+    for db_name in db_names:
+        if not isinstance(db_name, str):
+            return "Each database name must be a string"
+        parts = db_name.split("/")
+        if len(parts) < 2 or not parts[0] or not parts[1] or parts[0] in (".", ".."):
+            return f"Invalid database name '{db_name}'; expected db_dir/collection[/file]"
+    return None
+
+def build_chat_prompt(query, documents, metadatas, max_ctx):
+    """(prompt, source_documents) for retrieved chunks, fitted to a max_ctx-token window"""
+    source_documents = [
+        {"content": content[:200] + "..." if len(content) > 200 else content, "metadata": metadata}
+        for content, metadata in zip(documents, metadatas)
+    ]
+    context = truncate_context("\n\n".join(documents), max_tokens=max_ctx // 2)
+    prompt = prompt_template.format(query=query, context=context)
+    return truncate_context(prompt, max_tokens=max_ctx - 100), source_documents
+
+def embed_query_async(load_sentence_transformer, query, timer):
+    """Start embedding the query on the embed pool; the future yields a list.
+    Its duration is recorded as a background stage that overlaps the others."""
+    def run():
+        started = time.perf_counter()
+        try:
+            return load_sentence_transformer().encode([query], convert_to_numpy=True)[0].tolist()
+        finally:
+            timer.record("embed_query", time.perf_counter() - started, background=True)
+    return _embed_pool.submit(run)
+
+def resolve_chat_target(user, collection_id):
+    """(collection, None) the user may chat with, or (None, error response)"""
+    accessible_collections = get_user_access_documents(user['id'], user['department_id'], user['grade_id'])
+    if not accessible_collections:
+        return None, (jsonify({"error": "No accessible documents found"}), 403)
+    if not collection_id:
+        return accessible_collections[0], None
+    for c in accessible_collections:
+        if c['id'] == collection_id:
+            return c, None
+    # Only a refusal needs the extra lookup, to tell a missing collection from a forbidden one
+    with get_db_connection() as conn:
+        exists = conn.execute("SELECT 1 FROM document_collections WHERE id = ?", (collection_id,)).fetchone()
+    if not exists:
+        return None, (jsonify({"error": "Collection not found"}), 404)
+    return None, (jsonify({"error": "Access denied to requested collection"}), 403)
+
 def get_all_collections_and_files():
     # Placeholder: Implement or import the actual function
     return []  # Replace with actual implementation
@@ -83,84 +152,219 @@ def register_chatbot_routes(app, load_llm, load_sentence_transformer, get_active
         data = request.get_json(force=True)
         db_names = data.get("db_names", [])
         query = data.get("query", "").strip()
-        user_id = data.get("user_id", type=int)
         model_id = data.get("model_id")  # Optional model_id to select specific model
-        
-        if not query or not user_id:
+        trace = bool(data.get("trace")) or TRACE_ALL
+        if not query:
             return jsonify({"error": "Query and user ID required"}), 400
+
+        user = get_request_identity(data.get("user_id"))
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        user_id = user['id']
         if not db_names:
             return jsonify({"error": "At least one database name required"}), 400
+        error = db_names_error(db_names)
+        if error:
+            return jsonify({"error": error}), 400
         if model_id and model_id not in MODEL_CONFIGS:
             return jsonify({"error": "Invalid model ID"}), 400
 
+        # The embedding depends only on the query: compute it during the ACL lookups
+        timer = StageTimer("search")
+        embedding = embed_query_async(load_sentence_transformer, query, timer)
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT department_id, grade_id, role FROM users WHERE id = ?", (user_id,))
-                user_row = cursor.fetchone()
-                if not user_row:
-                    return jsonify({"error": "User not found"}), 404
-                user = dict(zip([col[0] for col in cursor.description], user_row))
+            with timer.stage("acl"):
                 accessible_collections = get_user_access_documents(user_id, user['department_id'], user['grade_id'])
                 accessible_collection_names = [coll['name'] for coll in accessible_collections]
+                collections_by_name = load_collections_by_name({split_db_name(db_name)[1] for db_name in db_names})
+            embed_model_path = get_active_model_config()['embed_model_path']
 
             hits = []
-            model = load_sentence_transformer()
-            q_emb = model.encode([query], convert_to_numpy=True)[0].tolist()
+            max_k = 0
+            with timer.stage("embed_wait"):
+                q_emb = embedding.result()
 
             for db_name in db_names:
-                parts = db_name.split("/")
-                if len(parts) > 2:
-                    db_dir, coll_name, file_name = parts[0], parts[1], "/".join(parts[2:])
-                else:
-                    db_dir, coll_name, file_name = parts[0], parts[1], None
+                db_dir, coll_name, file_name = split_db_name(db_name)
 
                 if coll_name not in accessible_collection_names and user['role'] != 'admin':
                     return jsonify({"error": f"Access denied to collection: {coll_name}"}), 403
 
                 dir_path = os.path.join(CHROMA_BASE_DIR, db_dir)
                 try:
-                    client = chromadb.PersistentClient(path=dir_path)
-                    collection = client.get_collection(name=coll_name)
+                    store = open_store(dir_path, coll_name)
                 except Exception as e:
                     return jsonify({"error": f"Database or collection not found: {db_name}"}), 404
 
+                settings = retrieval_settings(embed_model_path, collections_by_name.get(coll_name), "search")
+                max_k = max(max_k, settings["max_k"])
                 query_params = {
                     "query_embeddings": [q_emb],
-                    "n_results": 5,
+                    "n_results": settings["max_k"],
                     "include": ["documents", "metadatas", "distances"]
                 }
                 if file_name:
                     query_params["where"] = {"source": file_name}
 
-                results = collection.query(**query_params)
+                with timer.stage("vector_query"):
+                    results = store.query(**query_params)
                 docs = results.get("documents", [[]])[0]
                 metas = results.get("metadatas", [[]])[0]
                 distances = results.get("distances", [[]])[0]
 
-                for doc, meta, dist in zip(docs, metas, distances):
-                    score = 1.0 / (1.0 + dist) if dist is not None else 0.0
-                    meta["collection"] = f"{db_dir}/{coll_name}"
-                    hits.append({"document": doc, "metadata": meta, "score": score})
+                for index in select_chunks(distances, settings):
+                    metas[index]["collection"] = f"{db_dir}/{coll_name}"
+                    hits.append({"document": docs[index], "metadata": metas[index], "score": distance_score(distances[index])})
 
-            hits = sorted(hits, key=lambda x: x["score"], reverse=True)[:5]
-            context = "\n\n".join([hit["document"] for hit in hits]) if hits else "No relevant documents found."
+            with timer.stage("context_build"):
+                hits = sorted(hits, key=lambda x: x["score"], reverse=True)[:max_k]
+                refused = not hits
+                context = "\n\n".join([hit["document"] for hit in hits]) if hits else "No relevant documents found."
+                prompt = prompt_template.format(query=query, context=context)
+                config = MODEL_CONFIGS.get(model_id, get_active_model_config()) if model_id else get_active_model_config()
+                max_new_tokens = token_budget(query, config['max_new_tokens'])
+            RETRIEVED_CHUNKS.observe(len(hits), endpoint="search")
             
-            llm = load_llm(model_id=model_id) if model_id else load_llm()
-            llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-            try:
-                answer = llm_chain.invoke({"query": query, "context": context})["text"]
-            except Exception as e:
-                answer = f"Error generating answer: {str(e)}"
-
-            return jsonify({
+            if refused:
+                # Nothing relevant was retrieved: answer as the prompt would, without the LLM
+                FAST_REFUSALS.inc(endpoint="search")
+                answer = REFUSAL_ANSWER
+                prompt_tokens = completion_tokens = 0
+            else:
+                llm = load_llm(model_id=model_id) if model_id else load_llm()
+                try:
+                    answer = finish_answer(scheduler.generate(llm, prompt, timer=timer, **generation_kwargs(max_new_tokens)))
+                    prompt_tokens, completion_tokens = count_tokens(llm, prompt), count_tokens(llm, answer)
+                    observe_generation("search", prompt_tokens, completion_tokens, timer.timings["generate"])
+                except Exception as e:
+                    answer = f"Error generating answer: {str(e)}"
+                    prompt_tokens = completion_tokens = None
+
+            response = {
                 "message": f"Found {len(hits)} results across selected databases/files",
                 "results": hits,
                 "query": query,
                 "answer": answer,
                 "collections": get_all_collections_and_files(),
                 "model_id": model_id
-            })
+            }
+            if trace:
+                response["timings"] = dict(
+                    timer.as_dict(),
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    query_class=classify_query(query),
+                    max_new_tokens=max_new_tokens,
+                    refused=refused
+                )
+            return jsonify(response)
+        except Exception as e:
+            embedding.cancel()
+            return jsonify({"error": f"Search error: {str(e)}"}), 500
+
+    @app.route("/api/search/batch", methods=["POST"])
+    def search_batch():
+        """Retrieval only, for many queries at once (FAQ regeneration, evaluation).
+
+        Body: user_id, queries (strings or {"query", "id", "db_names"} objects),
+        db_names used by queries that do not give their own, and n_results.
+        All queries are embedded in one encode call and each collection is
+        queried once with every embedding aimed at it. Chunks are selected as
+        in /api/search; n_results can only lower each collection's max_k.
+        """
+        data = request.get_json(force=True)
+        queries = data.get("queries") or []
+        default_db_names = data.get("db_names", [])
+        trace = bool(data.get("trace")) or TRACE_ALL
+        user = get_request_identity(data.get("user_id"))
+
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        if not isinstance(queries, list) or not queries:
+            return jsonify({"error": "queries must be a non-empty list"}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+        try:
+            n_results = int(data.get("n_results", ENDPOINT_MAX_K["search"]))
+        except (TypeError, ValueError):
+            return jsonify({"error": "n_results must be an integer"}), 400
+        if n_results < 1:
+            return jsonify({"error": "n_results must be at least 1"}), 400
+
+        items = []
+        for i, entry in enumerate(queries):
+            if isinstance(entry, str):
+                entry = {"query": entry}
+            if not isinstance(entry, dict):
+                return jsonify({"error": f"Query {i} must be a string or an object"}), 400
+            text = (entry.get("query") or "").strip()
+            db_names = entry.get("db_names") or default_db_names
+            if not text or not db_names:
+                return jsonify({"error": f"Query {i} needs query text and at least one database name"}), 400
+            error = db_names_error(db_names)
+            if error:
+                return jsonify({"error": f"Query {i}: {error}"}), 400
+            items.append({"id": entry.get("id", i), "query": text, "db_names": db_names})
+
+        timer = StageTimer("search_batch")
+        try:
+            with timer.stage("acl"):
+                accessible_collections = get_user_access_documents(user['id'], user['department_id'], user['grade_id'])
+                accessible_collection_names = {coll['name'] for coll in accessible_collections}
+                targets = {}  # (db_dir, collection, file) -> indexes of the queries aimed at it
+                for index, item in enumerate(items):
+                    for db_name in item["db_names"]:
+                        target = split_db_name(db_name)
+                        if target[1] not in accessible_collection_names and user['role'] != 'admin':
+                            return jsonify({"error": f"Access denied to collection: {target[1]}"}), 403
+                        targets.setdefault(target, []).append(index)
+                collections_by_name = load_collections_by_name({coll_name for _, coll_name, _ in targets})
+            embed_model_path = get_active_model_config()['embed_model_path']
+
+            with timer.stage("embed_query"):
+                model = load_sentence_transformer()
+                embeddings = model.encode([item["query"] for item in items], convert_to_numpy=True)
+
+            hits = [[] for _ in items]
+            max_k = [0 for _ in items]
+            for (db_dir, coll_name, file_name), indexes in targets.items():
+                try:
+                    store = open_store(os.path.join(CHROMA_BASE_DIR, db_dir), coll_name)
+                except Exception:
+                    return jsonify({"error": f"Database or collection not found: {db_dir}/{coll_name}"}), 404
+                settings = retrieval_settings(embed_model_path, collections_by_name.get(coll_name), "search")
+                settings["max_k"] = min(settings["max_k"], n_results)
+                for index in indexes:
+                    max_k[index] = max(max_k[index], settings["max_k"])
+                query_params = {
+                    "query_embeddings": [embeddings[i].tolist() for i in indexes],
+                    "n_results": settings["max_k"],
+                    "include": ["documents", "metadatas", "distances"]
+                }
+                if file_name:
+                    query_params["where"] = {"source": file_name}
+                with timer.stage("vector_query"):
+                    results = store.query(**query_params)
+                for index, docs, metas, distances in zip(
+                    indexes, results.get("documents", []), results.get("metadatas", []), results.get("distances", [])
+                ):
+                    for selected in select_chunks(distances, settings):
+                        metas[selected]["collection"] = f"{db_dir}/{coll_name}"
+                        hits[index].append({"document": docs[selected], "metadata": metas[selected], "score": distance_score(distances[selected])})
+
+            response = {
+                "results": [
+                    {
+                        "id": item["id"],
+                        "query": item["query"],
+                        "results": sorted(item_hits, key=lambda x: x["score"], reverse=True)[:item_max_k]
+                    }
+                    for item, item_hits, item_max_k in zip(items, hits, max_k)
+                ]
+            }
+            if trace:
+                response["timings"] = timer.as_dict()
+            return jsonify(response)
         except Exception as e:
             return jsonify({"error": f"Search error: {str(e)}"}), 500
 
@@ -168,95 +372,108 @@ def register_chatbot_routes(app, load_llm, load_sentence_transformer, get_active
     def chat():
         data = request.get_json(force=True)
         query = data.get("query", "").strip()
-        user_id = data.get("user_id", type=int)
-        collection_id = data.get("collection_id", type=int)
+        collection_id = data.get("collection_id")
         file_name = data.get("file_name", "")
         model_id = data.get("model_id")  # Optional model_id
-        
-        if not query or not user_id:
+        trace = bool(data.get("trace")) or TRACE_ALL
+        if not query:
             return jsonify({"error": "Query and user ID required"}), 400
+        try:
+            collection_id = int(collection_id) if collection_id else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "collection_id must be an integer"}), 400
+
+        user = get_request_identity(data.get("user_id"))
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+        user_id = user['id']
         if model_id and model_id not in MODEL_CONFIGS:
             return jsonify({"error": "Invalid model ID"}), 400
-        
+
+        # Stage 1, in the background: the embedding depends only on the query,
+        # so it runs while the ACL lookup below hits SQLite
+        timer = StageTimer("chat")
+        embedding = embed_query_async(load_sentence_transformer, query, timer)
         try:
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT u.*, d.name as department_name, g.name as grade_name FROM users u "
-                    "LEFT JOIN departments d ON u.department_id = d.id "
-                    "LEFT JOIN grades g ON u.grade_id = g.id "
-                    "WHERE u.id = ?", (user_id,)
-                )
-                user_row = cursor.fetchone()
-                if not user_row:
-                    return jsonify({"error": "User not found"}), 404
-                user = dict(zip([col[0] for col in cursor.description], user_row))
-                
-                accessible_collections = get_user_access_documents(user_id, user['department_id'], user['grade_id'])
-                if not accessible_collections:
-                    return jsonify({"error": "No accessible documents found"}), 403
-                
-                target_collection = None
-                if collection_id:
-                    cursor.execute("SELECT * FROM document_collections WHERE id = ?", (collection_id,))
-                    coll_row = cursor.fetchone()
-                    if not coll_row:
-                        return jsonify({"error": "Collection not found"}), 404
-                    coll = dict(zip([col[0] for col in cursor.description], coll_row))
-                    for c in accessible_collections:
-                        if c['id'] == collection_id:
-                            target_collection = c
-                            break
-                    if not target_collection:
-                        return jsonify({"error": "Access denied to requested collection"}), 403
-                else:
-                    target_collection = accessible_collections[0]
-            
-            embedder = HuggingFaceEmbeddings(model_name=EMBED_MODEL)
-            collection_db = Chroma(persist_directory=target_collection['chroma_db_path'], embedding_function=embedder)
-            llm = load_llm(model_id=model_id) if model_id else load_llm()
+            # Stage 2: which collection this user may ask
+            with timer.stage("acl"):
+                target_collection, error = resolve_chat_target(user, collection_id)
+            if error:
+                embedding.cancel()
+                return error
+
+            # Stage 3: open the index and model while the embedding finishes
+            with timer.stage("open_store"):
+                store = open_store(target_collection['chroma_db_path'], target_collection['name'])
+                llm = load_llm(model_id=model_id) if model_id else load_llm()
+            with timer.stage("embed_wait"):
+                q_emb = embedding.result()
             
+            # Stage 4: retrieval, then prompt and generation
+            settings = retrieval_settings(get_active_model_config()['embed_model_path'], target_collection, "chat")
+            query_params = {
+                "query_embeddings": [q_emb],
+                "n_results": settings["max_k"],
+                "include": ["documents", "metadatas", "distances"]
+            }
             if file_name:
-                docs = collection_db.similarity_search(query, k=3, filter={"source": file_name})
-            else:
-                docs = collection_db.similarity_search(query, k=3)
+                query_params["where"] = {"source": file_name}
+            with timer.stage("vector_query"):
+                results = store.query(**query_params)
+            selected = select_chunks(results.get("distances", [[]])[0], settings)
+            retrieved_chunk_ids = pick(results.get("ids", [[]])[0], selected)
                 
-            context_parts = []
-            source_documents = []
-            
-            for doc in docs:
-                context_parts.append(doc.page_content)
-                source_documents.append({
-                    "content": doc.page_content[:200] + "..." if len(doc.page_content) > 200 else doc.page_content,
-                    "metadata": doc.metadata
-                })
-            
-            context = "\n\n".join(context_parts)
-            config = MODEL_CONFIGS.get(model_id, get_active_model_config()) if model_id else get_active_model_config()
-            max_ctx = config['context_size'] if model_id else config['max_context_tokens']
-            max_new_tokens = config['max_new_tokens']
-            context = truncate_context(context, max_tokens=max_ctx // 2)
-            
-            prompt = prompt_template.format(query=query, context=context)
-            prompt = truncate_context(prompt, max_tokens=max_ctx - 100)
+            with timer.stage("context_build"):
+                config = MODEL_CONFIGS.get(model_id, get_active_model_config()) if model_id else get_active_model_config()
+                max_ctx = config['context_size'] if model_id else config['max_context_tokens']
+                max_new_tokens = token_budget(query, config['max_new_tokens'])
+                refused = not selected
+                prompt, source_documents = build_chat_prompt(
+                    query, pick(results.get("documents", [[]])[0], selected), pick(results.get("metadatas", [[]])[0], selected), max_ctx
+                )
+            RETRIEVED_CHUNKS.observe(len(source_documents), endpoint="chat")
             
-            llm_chain = LLMChain(llm=llm, prompt=prompt_template)
-            answer = llm_chain.invoke({"query": query, "context": context})["text"].strip()
+            if refused:
+                # Nothing relevant was retrieved: answer as the prompt would, without the LLM
+                FAST_REFUSALS.inc(endpoint="chat")
+                answer, source_documents = REFUSAL_ANSWER, []
+                prompt_tokens = completion_tokens = 0
+            else:
+                answer = finish_answer(scheduler.generate(llm, prompt, timer=timer, **generation_kwargs(max_new_tokens)))
+                prompt_tokens, completion_tokens = count_tokens(llm, prompt), count_tokens(llm, answer)
+                observe_generation("chat", prompt_tokens, completion_tokens, timer.timings["generate"])
             
-            with get_history_db_connection() as conn:
+            columns = ["user_id", "user_message", "ai_response", "document_collection_id", "document_collection_name", "source_documents", "model_id"]
+            values = [user_id, query, answer, target_collection['id'], target_collection['name'], json.dumps(source_documents), model_id]
+            if trace:
+                columns += ["timings", "prompt_tokens", "completion_tokens", "retrieved_chunk_ids"]
+                values += [json.dumps(timer.as_dict()), prompt_tokens, completion_tokens, json.dumps(retrieved_chunk_ids)]
+            with timer.stage("persist"), get_history_db_connection() as conn:
                 cursor = conn.cursor()
                 cursor.execute(
-                    "INSERT INTO chat_history (user_id, user_message, ai_response, document_collection_id, document_collection_name, source_documents, model_id) VALUES (?, ?, ?, ?, ?, ?, ?)",
-                    (user_id, query, answer, target_collection['id'], target_collection['name'], json.dumps(source_documents), model_id)
+                    f"INSERT INTO chat_history ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    values
                 )
                 conn.commit()
             
-            return jsonify({
+            response = {
                 "answer": answer,
                 "source_collection": target_collection['name'],
                 "source_file": file_name if file_name else None,
                 "source_documents": source_documents,
                 "model_id": model_id
-            })
+            }
+            if trace:
+                response["timings"] = dict(
+                    timer.as_dict(),
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens,
+                    retrieved_chunk_ids=retrieved_chunk_ids,
+                    query_class=classify_query(query),
+                    max_new_tokens=max_new_tokens,
+                    refused=refused
+                )
+            return jsonify(response)
         except Exception as e:
+            embedding.cancel()
             return jsonify({"error": f"Chat error: {str(e)}"}), 500
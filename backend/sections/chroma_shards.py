@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import uuid
+import zlib
+import shutil
+import argparse
+import logging
+from sections.model_config import CHROMA_BASE_DIR, get_chroma_client, forget_chroma_client
+
+logger = logging.getLogger(__name__)
+
+# New collections are placed, by a stable hash of their name, in one of
+# CHROMA_SHARDS persist directories under CHROMA_BASE_DIR and live there as
+# ordinary Chroma collections. That bounds open SQLite files, HNSW indexes and
+# cached clients to the shard count instead of one per collection. The shard
+# count can grow later: existing rows keep their recorded chroma_db_path.
+# CHROMA_SHARDS=0 restores the old one-directory-per-collection layout.
+CHROMA_SHARDS = int(os.getenv("CHROMA_SHARDS", "8"))
+SHARD_PREFIX = "shard_"
+
+def shard_index(collection_name, shards=CHROMA_SHARDS):
+    return zlib.crc32(collection_name.encode("utf-8")) % shards
+
+def shard_path(collection_name, base_dir=CHROMA_BASE_DIR, shards=CHROMA_SHARDS):
+    return os.path.join(base_dir, f"{SHARD_PREFIX}{shard_index(collection_name, shards):02d}")
+
+def is_shard_path(path, base_dir=CHROMA_BASE_DIR):
+    return os.path.dirname(os.path.normpath(path)) == os.path.normpath(base_dir) and \
+        os.path.basename(os.path.normpath(path)).startswith(SHARD_PREFIX)
+
+def new_collection_path(collection_name, base_dir=CHROMA_BASE_DIR):
+    """Persist directory for a collection being created"""
+    if CHROMA_SHARDS > 0:
+        path = shard_path(collection_name, base_dir)
+    else:
+        path = os.path.join(base_dir, f"db_{int(time.time())}_{uuid.uuid4().hex[:8]}")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def migrate_collections(base_dir=CHROMA_BASE_DIR, apply=False, remove_old=False, only=None):
+    """Move collections from per-collection directories into their shard.
+
+    Dry run by default. Each collection is copied, its row count verified, and
+    only then is document_collections.chroma_db_path switched, so an interrupted
+    run leaves every collection readable from one place or the other. Run it
+    with the API stopped.
+    """
+    from database.db_init import get_db_connection, log_admin_action
+    from sections.vector_store import open_store, create_store, copy_rows
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, chroma_db_path FROM document_collections ORDER BY id")
+        rows = [dict(zip([col[0] for col in cursor.description], row)) for row in cursor.fetchall()]
+
+    report = {"dry_run": not apply, "shards": CHROMA_SHARDS, "collections": []}
+    for row in rows:
+        name, old_path = row['name'], row['chroma_db_path']
+        if (only and name not in only) or is_shard_path(old_path, base_dir):
+            continue
+        entry = {"name": name, "from": old_path, "to": shard_path(name, base_dir)}
+        report["collections"].append(entry)
+        try:
+            source = open_store(old_path, name)
+            entry["rows"] = source.count()
+            entry["backend"] = source.backend
+        except Exception as e:
+            entry["error"] = f"Cannot open source collection: {e}"
+            continue
+        if not apply:
+            continue
+
+        new_path = new_collection_path(name, base_dir)
+        # A previous interrupted run may have left a partial copy behind
+        try:
+            open_store(new_path, name).drop()
+        except ValueError:
+            pass
+        target = create_store(new_path, name, source.backend)
+        copied = copy_rows(source, target)
+        if target.count() != entry["rows"]:
+            entry["error"] = f"Copied {copied} rows but target has {target.count()}; row not switched"
+            continue
+
+        with get_db_connection() as conn:
+            conn.execute("UPDATE document_collections SET chroma_db_path = ? WHERE id = ?", (new_path, row['id']))
+            conn.commit()
+        entry["migrated"] = True
+        log_admin_action(None, "migrate_collection", {"collection_name": name, "from": old_path, "to": new_path})
+
+        if remove_old:
+            source.drop()
+            if not get_chroma_client(old_path).list_collections() and not os.path.isdir(os.path.join(old_path, "numpy")):
+                forget_chroma_client(old_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+                entry["removed_old"] = True
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move per-collection Chroma directories into shards")
+    parser.add_argument("--apply", action="store_true", help="Perform the migration (default is a dry run)")
+    parser.add_argument("--remove-old", action="store_true", help="Delete the old per-collection directories afterwards")
+    parser.add_argument("--collection", action="append", help="Only this collection (repeatable)")
+    args = parser.parse_args()
+    if CHROMA_SHARDS <= 0:
+        parser.error("CHROMA_SHARDS is 0; set it to the number of shards to migrate into")
+    print(json.dumps(migrate_collections(apply=args.apply, remove_old=args.remove_old, only=args.collection), indent=2))
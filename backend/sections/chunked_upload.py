@@ -0,0 +1,300 @@
+import os
+import re
+import json
+import mmap
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+from flask import jsonify, request
+from werkzeug.utils import secure_filename
+from database.db_init import log_admin_action
+from sections.auth import get_request_identity
+from sections.documents import allowed_file, ingest_files
+from sections.metrics import StageTimer, INGEST_STAGE_SECONDS
+from sections.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Resumable upload: POST a session, PUT each part (any order, retry freely), then
+# POST complete. Parts are written straight into a preallocated file at their
+# offset, so neither the worker nor a retry ever holds more than one copy buffer.
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", str(8 * 1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(2 * 1024 * 1024 * 1024)))
+UPLOAD_SESSION_TTL_HOURS = int(os.getenv("UPLOAD_SESSION_TTL_HOURS", "24"))
+# Expiry leaves directories this young alone: create_session makes the directory
+# before it writes the manifest, possibly on another worker
+UPLOAD_SESSION_GRACE_SECONDS = 300
+COPY_BUFFER_SIZE = 1024 * 1024
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+# complete renames manifest.json to this first: the rename succeeds for exactly
+# one request, and the session then stops accepting parts
+CLAIMED_MANIFEST = "manifest.claimed"
+# Part PUTs hold this shared and complete holds it exclusively while claiming,
+# so no part can still be landing once the file is hashed
+SESSION_LOCK = "LOCK"
+
+def sessions_dir(app):
+    path = os.path.join(app.config["UPLOAD_FOLDER"], ".partial")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def _session_path(app, upload_id):
+    # upload_id comes from the URL; only accept what create_session generates
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+        return None
+    return os.path.join(sessions_dir(app), upload_id)
+
+def read_manifest(path):
+    try:
+        with open(os.path.join(path, "manifest.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def write_manifest(path, manifest):
+    tmp = os.path.join(path, "manifest.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(path, "manifest.json"))
+
+def part_length(manifest, part):
+    start = part * manifest["part_size"]
+    return max(0, min(manifest["part_size"], manifest["size"] - start))
+
+def received_parts(path):
+    # One marker file per part instead of a shared list, so parts arriving at
+    # different gunicorn workers at once cannot lose each other's updates
+    return sorted(int(name[5:]) for name in os.listdir(path) if name.startswith("part-"))
+
+def missing_parts(path, manifest):
+    received = set(received_parts(path))
+    return [p for p in range(manifest["parts"]) if p not in received]
+
+def last_activity(path):
+    return max([os.path.getmtime(path)] + [os.path.getmtime(os.path.join(path, name)) for name in os.listdir(path)])
+
+def session_status(upload_id, path, manifest):
+    return {
+        "upload_id": upload_id,
+        "filename": manifest["filename"],
+        "db_name": manifest["db_name"],
+        "size": manifest["size"],
+        "part_size": manifest["part_size"],
+        "parts": manifest["parts"],
+        "received": received_parts(path),
+        "missing": missing_parts(path, manifest),
+    }
+
+def file_sha256(path):
+    """Hash through a read-only memory map so the kernel pages the file in
+    instead of copying it through Python buffers"""
+    digest = hashlib.sha256()
+    if os.path.getsize(path) == 0:
+        return digest.hexdigest()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        view = memoryview(mapped)
+        try:
+            for offset in range(0, len(view), COPY_BUFFER_SIZE):
+                digest.update(view[offset:offset + COPY_BUFFER_SIZE])
+        finally:
+            view.release()
+    return digest.hexdigest()
+
+def expire_sessions(app, now=None):
+    """Drop sessions that have not seen a part for UPLOAD_SESSION_TTL_HOURS"""
+    now = now or time.time()
+    root = sessions_dir(app)
+    for upload_id in os.listdir(root):
+        path = os.path.join(root, upload_id)
+        try:
+            if now - os.path.getmtime(path) < UPLOAD_SESSION_GRACE_SECONDS:
+                continue
+            being_completed = os.path.exists(os.path.join(path, CLAIMED_MANIFEST))
+            if (read_manifest(path) is None and not being_completed) \
+                    or now - last_activity(path) > UPLOAD_SESSION_TTL_HOURS * 3600:
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Expired upload session {upload_id}")
+        except OSError:
+            # Completed or aborted by another request while this one looked at it
+            continue
+
+def register_chunked_upload_routes(app, load_sentence_transformer):
+    def load_session(upload_id, user):
+        """(path, manifest, error response) for a session owned by user"""
+        path = _session_path(app, upload_id)
+        manifest = read_manifest(path) if path else None
+        if manifest is None:
+            if path and os.path.exists(os.path.join(path, CLAIMED_MANIFEST)):
+                return None, None, (jsonify({"error": "Upload is already being completed"}), 409)
+            return None, None, (jsonify({"error": "Upload session not found"}), 404)
+        if manifest["created_by"] != user['id']:
+            return None, None, (jsonify({"error": "Upload session belongs to another user"}), 403)
+        return path, manifest, None
+
+    def require_admin(user):
+        if not user:
+            return jsonify({"error": "User ID required"}), 400
+        if user['role'] != 'admin':
+            return jsonify({"error": "Only admins can upload documents"}), 403
+        return None
+
+    @app.route("/api/upload/sessions", methods=["POST"])
+    def create_upload_session():
+        """Start a resumable upload. Body: user_id, db_name, filename, size, sha256."""
+        data = request.get_json(silent=True) or {}
+        user = get_request_identity(data.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+
+        db_name = (data.get("db_name") or "").strip()
+        filename = secure_filename(data.get("filename") or "")
+        sha256 = (data.get("sha256") or "").lower()
+        try:
+            size = int(data.get("size"))
+        except (TypeError, ValueError):
+            return jsonify({"error": "size must be an integer byte count"}), 400
+        if not db_name:
+            return jsonify({"error": "db_name is required"}), 400
+        if not filename or not allowed_file(filename):
+            return jsonify({"error": "Unsupported file type"}), 400
+        if not SHA256_PATTERN.match(sha256):
+            return jsonify({"error": "sha256 must be a hex SHA-256 digest of the whole file"}), 400
+        if size <= 0 or size > MAX_UPLOAD_SIZE:
+            return jsonify({"error": f"size must be between 1 and {MAX_UPLOAD_SIZE} bytes"}), 400
+
+        expire_sessions(app)
+        upload_id = uuid.uuid4().hex
+        path = _session_path(app, upload_id)
+        os.makedirs(path)
+        # Preallocate so parts can land at their offset in any order
+        with open(os.path.join(path, "data"), "wb") as f:
+            f.truncate(size)
+        manifest = {
+            "filename": filename,
+            "db_name": db_name,
+            "size": size,
+            "sha256": sha256,
+            "part_size": UPLOAD_PART_SIZE,
+            "parts": (size + UPLOAD_PART_SIZE - 1) // UPLOAD_PART_SIZE,
+            "created_by": user['id'],
+        }
+        write_manifest(path, manifest)
+        return jsonify(session_status(upload_id, path, manifest)), 201
+
+    @app.route("/api/upload/sessions/<upload_id>", methods=["GET"])
+    def get_upload_session(upload_id):
+        """Which parts are still missing, for resuming after a dropped connection"""
+        user = get_request_identity(request.args.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        path, manifest, error = load_session(upload_id, user)
+        if error:
+            return error
+        return jsonify(session_status(upload_id, path, manifest))
+
+    @app.route("/api/upload/sessions/<upload_id>/parts/<int:part>", methods=["PUT"])
+    def put_upload_part(upload_id, part):
+        """Raw part bytes as the request body. Re-sending a part overwrites it."""
+        user = get_request_identity(request.args.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        path, manifest, error = load_session(upload_id, user)
+        if error:
+            return error
+        if part < 0 or part >= manifest["parts"]:
+            return jsonify({"error": f"part must be between 0 and {manifest['parts'] - 1}"}), 400
+        expected = part_length(manifest, part)
+        if request.content_length is not None and request.content_length != expected:
+            return jsonify({"error": f"Part {part} must be exactly {expected} bytes"}), 400
+
+        with file_lock(os.path.join(path, SESSION_LOCK), shared=True):
+            # complete may have claimed the session while this request waited
+            path, manifest, error = load_session(upload_id, user)
+            if error:
+                return error
+            marker = os.path.join(path, f"part-{part}")
+            if os.path.exists(marker):
+                os.remove(marker)
+            written = 0
+            with open(os.path.join(path, "data"), "r+b") as f:
+                f.seek(part * manifest["part_size"])
+                while written < expected:
+                    block = request.stream.read(min(COPY_BUFFER_SIZE, expected - written))
+                    if not block:
+                        break
+                    f.write(block)
+                    written += len(block)
+            if written != expected:
+                return jsonify({"error": f"Part {part} was truncated ({written} of {expected} bytes); resend it"}), 400
+
+            with open(marker, "w"):
+                pass
+        return jsonify(session_status(upload_id, path, manifest))
+
+    @app.route("/api/upload/sessions/<upload_id>/complete", methods=["POST"])
+    def complete_upload_session(upload_id):
+        """Verify the assembled file against the declared SHA-256 and ingest it"""
+        data = request.get_json(silent=True) or {}
+        user = get_request_identity(data.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        path, manifest, error = load_session(upload_id, user)
+        if error:
+            return error
+        claimed = os.path.join(path, CLAIMED_MANIFEST)
+        with file_lock(os.path.join(path, SESSION_LOCK)):
+            missing = missing_parts(path, manifest)
+            if missing:
+                return jsonify({"error": "Upload is incomplete", "missing": missing}), 409
+            try:
+                os.rename(os.path.join(path, "manifest.json"), claimed)
+            except FileNotFoundError:
+                return jsonify({"error": "Upload is already being completed"}), 409
+        os.utime(claimed)  # counts as activity, so expiry leaves it alone while hashing
+
+        data_path = os.path.join(path, "data")
+        timer = StageTimer("upload", INGEST_STAGE_SECONDS)
+        with timer.stage("verify"):
+            actual = file_sha256(data_path)
+        if actual != manifest["sha256"]:
+            # Cannot tell which part is bad, so the client has to start over
+            shutil.rmtree(path, ignore_errors=True)
+            return jsonify({"error": "Checksum mismatch; upload discarded", "sha256": actual}), 422
+
+        filename = manifest["filename"]
+        save_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{uuid.uuid4().hex}_{filename}")
+        os.replace(data_path, save_path)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            collection_name, chunk_count = ingest_files(
+                load_sentence_transformer(), manifest["db_name"], user['id'], [(filename, save_path)], timer
+            )
+        except Exception as e:
+            logger.error(f"Upload error: {str(e)}")
+            return jsonify({"error": f"Upload error: {str(e)}"}), 500
+        if not chunk_count:
+            return jsonify({"error": "No textual content found in uploaded files"}), 400
+
+        log_admin_action(user['id'], "upload_document", {"collection_name": manifest["db_name"], "files": [filename]})
+        return jsonify({
+            "message": f"Uploaded and added {chunk_count} chunks to Chroma DB: {collection_name}",
+            "collection_name": manifest["db_name"]
+        })
+
+    @app.route("/api/upload/sessions/<upload_id>", methods=["DELETE"])
+    def abort_upload_session(upload_id):
+        user = get_request_identity(request.args.get("user_id"))
+        error = require_admin(user)
+        if error:
+            return error
+        path, manifest, error = load_session(upload_id, user)
+        if error:
+            return error
+        shutil.rmtree(path, ignore_errors=True)
+        return jsonify({"message": f"Upload session {upload_id} aborted"})
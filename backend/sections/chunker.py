@@ -0,0 +1,127 @@
+import re
+import bisect
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Tried in order: a chunk ends at the last paragraph break that fits, else the last
+# line break, sentence end or space, else it is cut hard at the size limit.
+DEFAULT_SEPARATORS = ("\n\n", "\n", ". ", " ")
+PAGE_JOINER = "\n\n"
+
+class Chunker:
+    """Splits plain strings into overlapping chunks without copying them into
+    intermediate documents.
+
+    Separator and word positions are found once per text (regex scans in C) and
+    every chunk boundary is then a bisect over those offsets, so one instance can
+    be reused for any number of texts. Sizes are in characters, or in embedder
+    tokens when a tokenizer with offset mappings (a Hugging Face fast tokenizer)
+    is given. A chunk is never shorter than min_fill * chunk_size unless it is
+    the last one.
+    """
+
+    def __init__(self, chunk_size=1000, overlap=200, separators=DEFAULT_SEPARATORS, tokenizer=None, min_fill=0.5):
+        if overlap >= chunk_size:
+            raise ValueError("overlap must be smaller than chunk_size")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.separators = tuple(separators)
+        self.tokenizer = tokenizer
+        self.min_fill = min_fill
+        self._patterns = [re.compile(re.escape(sep)) for sep in self.separators]
+
+    def _token_starts(self, text):
+        encoded = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return [start for start, _ in encoded["offset_mapping"]]
+
+    def spans(self, text):
+        """(start, end) character offsets of each chunk, whitespace-trimmed"""
+        n = len(text)
+        if not n:
+            return []
+        breaks = [[m.end() for m in pattern.finditer(text)] for pattern in self._patterns]
+        word_starts = [m.start() for m in re.finditer(r"\S+", text)]
+        units = self._token_starts(text) if self.tokenizer is not None else None
+
+        def forward(pos, count):
+            if units is None:
+                return min(n, pos + count)
+            i = bisect.bisect_left(units, pos) + count
+            return units[i] if i < len(units) else n
+
+        def backward(pos, count):
+            if units is None:
+                return max(0, pos - count)
+            i = bisect.bisect_left(units, pos) - count
+            return units[max(0, i)] if units else 0
+
+        def next_word(pos):
+            i = bisect.bisect_left(word_starts, pos)
+            return word_starts[i] if i < len(word_starts) else n
+
+        result = []
+        start = next_word(0)
+        while start < n:
+            limit = max(forward(start, self.chunk_size), start + 1)
+            end = limit
+            if limit < n:
+                floor = forward(start, int(self.chunk_size * self.min_fill))
+                for positions in breaks:
+                    i = bisect.bisect_right(positions, limit) - 1
+                    if i >= 0 and positions[i] > floor:
+                        end = positions[i]
+                        break
+            trimmed_end = end
+            while trimmed_end > start and text[trimmed_end - 1].isspace():
+                trimmed_end -= 1
+            if trimmed_end > start:
+                result.append((start, trimmed_end))
+            if end >= n:
+                break
+            if not text[end - 1].isspace() and not text[end].isspace():
+                # Hard cut inside a word (or an unbroken run such as CJK text):
+                # skipping to the next word start would drop the rest of it, so
+                # the overlap starts mid-word instead
+                next_start = backward(end, self.overlap)
+                if text[next_start].isspace():
+                    next_start = next_word(next_start)
+                start = next_start if start < next_start < end else end
+                continue
+            # Overlap starts on a word boundary; fall back to no overlap if that
+            # would not move forward
+            next_start = next_word(backward(end, self.overlap))
+            start = next_start if start < next_start < end else next_word(end)
+        return result
+
+    def split(self, text):
+        return [text[start:end] for start, end in self.spans(text)]
+
+    def split_pages(self, pages):
+        """Chunk a document's pages as one text so chunks may cross page breaks.
+
+        Returns dicts with the chunk text and the 1-based first and last page it
+        covers. Blank pages still count towards numbering.
+        """
+        page_offsets = []
+        offset = 0
+        for page in pages:
+            page_offsets.append(offset)
+            offset += len(page) + len(PAGE_JOINER)
+        text = PAGE_JOINER.join(pages)
+        return [
+            {
+                "text": text[start:end],
+                "page_start": bisect.bisect_right(page_offsets, start),
+                "page_end": bisect.bisect_right(page_offsets, end - 1),
+            }
+            for start, end in self.spans(text)
+        ]
+
+def embedder_tokenizer(model):
+    """The model's fast tokenizer if it can report offsets, else None"""
+    tokenizer = getattr(model, "tokenizer", None)
+    if tokenizer is None or not getattr(tokenizer, "is_fast", False):
+        logger.warning("Embedder has no fast tokenizer; falling back to character-sized chunks")
+        return None
+    return tokenizer
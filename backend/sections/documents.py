@@ -3,15 +3,19 @@ import sys
 import uuid
 import time
 import json
+import numpy as np
+from functools import lru_cache
 from flask import jsonify, request
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from database.db_init import get_db_connection, log_admin_action
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import Docx2txtLoader
-from pypdf import PdfReader
-import chromadb
+from sections.auth import get_request_identity
+from sections.model_config import get_chroma_client, forget_chroma_client
+from sections.chunker import Chunker, embedder_tokenizer
+from sections.vector_store import open_store
+from sections.chroma_shards import new_collection_path
+from sections.metrics import StageTimer, INGEST_STAGE_SECONDS, INGEST_FILES, INGEST_BYTES, INGEST_CHUNKS
+from sections.admission import yield_to_interactive
 import logging
 
 # Set up logging
@@ -24,6 +28,11 @@ CHROMA_BASE_DIR = os.path.join(BASE_DIR, "database", "chroma_db")
 ALLOWED_EXTENSIONS = {"pdf", "txt", "docx"}
 CHUNK_SIZE = 1000
 CHUNK_OVERLAP = 200
+# Set CHUNK_SIZE_TOKENS to size chunks in embedder tokens instead of characters
+CHUNK_SIZE_TOKENS = int(os.getenv("CHUNK_SIZE_TOKENS", "0"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))
+# Upload embedding runs in batches this size, pausing for queued chats in between
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "256"))
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(CHROMA_BASE_DIR, exist_ok=True)
@@ -33,6 +42,7 @@ def allowed_file(filename):
 
 def read_pdf_text(path):
     try:
+        from pypdf import PdfReader
         text_pages = []
         reader = PdfReader(path)
         for page in reader.pages:
@@ -53,29 +63,41 @@ def read_txt(path):
 
 def read_docx(path):
     try:
+        from langchain_community.document_loaders import Docx2txtLoader
         loader = Docx2txtLoader(path)
         return [doc.page_content for doc in loader.load()]
     except Exception as e:
         logger.error(f"Error reading DOCX {path}: {str(e)}")
         return []
 
+@lru_cache(maxsize=8)
+def get_chunker(chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    return Chunker(chunk_size, overlap)
+
+def get_ingest_chunker(model):
+    """The chunker uploads use: token-sized against the embedder when
+    CHUNK_SIZE_TOKENS is set and the embedder has a fast tokenizer"""
+    if CHUNK_SIZE_TOKENS:
+        tokenizer = embedder_tokenizer(model)
+        if tokenizer is not None:
+            return Chunker(CHUNK_SIZE_TOKENS, CHUNK_OVERLAP_TOKENS, tokenizer=tokenizer)
+    return get_chunker()
+
 def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
-    splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=overlap)
-    return [chunk.page_content for chunk in splitter.create_documents([text])]
+    return get_chunker(chunk_size, overlap).split(text)
 
 def get_chroma_collection(db_name=None):
     if db_name:
         db_name = secure_filename(db_name)
-    # Use the main ChromaDB directory, not create subdirectories
-    client = chromadb.PersistentClient(path=CHROMA_BASE_DIR)
     collection_name = db_name or f"collection_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+    client = get_chroma_client(new_collection_path(collection_name, CHROMA_BASE_DIR))
     return client, client.get_or_create_collection(name=collection_name)
 
 def get_all_collections_and_files():
     collections = []
     try:
         # Connect to the main ChromaDB directory
-        client = chromadb.PersistentClient(path=CHROMA_BASE_DIR)
+        client = get_chroma_client(CHROMA_BASE_DIR)
         
         # Get all collections from the main client
         for coll in client.list_collections():
@@ -93,61 +115,127 @@ def get_all_collections_and_files():
     except Exception as e:
         logger.error(f"Error accessing ChromaDB at {CHROMA_BASE_DIR}: {e}")
     
-    # Also check for collections in individual database directories
+    # Collections registered in document_collections, whichever vector store holds them
     try:
         with get_db_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT chroma_db_path FROM document_collections")
-            db_paths = [row['chroma_db_path'] for row in cursor.fetchall()]
-            
-            for db_path in db_paths:
-                if os.path.exists(db_path):
-                    try:
-                        client = chromadb.PersistentClient(path=db_path)
-                        for coll in client.list_collections():
-                            try:
-                                results = coll.get(include=["metadatas"])
-                                files = set(meta.get("source") for meta in results.get("metadatas", []) if meta.get("source"))
-                                collections.append({
-                                    "db_dir": db_path,
-                                    "name": coll.name,
-                                    "count": coll.count(),
-                                    "files": sorted(list(files))
-                                })
-                            except Exception as e:
-                                logger.error(f"Error accessing collection {coll.name} in {db_path}: {e}")
-                    except Exception as e:
-                        logger.error(f"Error accessing ChromaDB at {db_path}: {e}")
+            cursor.execute("SELECT name, chroma_db_path FROM document_collections")
+            rows = [(row['name'], row['chroma_db_path']) for row in cursor.fetchall()]
+
+        for name, db_path in rows:
+            if os.path.exists(db_path):
+                try:
+                    store = open_store(db_path, name)
+                    collections.append({
+                        "db_dir": db_path,
+                        "name": name,
+                        "count": store.count(),
+                        "files": store.sources()
+                    })
+                except Exception as e:
+                    logger.error(f"Error accessing collection {name} in {db_path}: {e}")
     except Exception as e:
         logger.error(f"Error reading database paths: {e}")
     
     return collections
 
+READERS = {"pdf": read_pdf_text, "txt": read_txt, "docx": read_docx}
+
+def chunk_metadatas(filename, chunks, collection_name):
+    return [
+        {
+            "source": filename,
+            "page": chunk["page_start"],
+            "page_start": chunk["page_start"],
+            "page_end": chunk["page_end"],
+            "chunk_index": ci,
+            "collection": collection_name
+        }
+        for ci, chunk in enumerate(chunks)
+    ]
+
+def resolve_collection_path(db_name, user_id):
+    """chroma_db_path of the named collection, creating the collection if needed"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT chroma_db_path FROM document_collections WHERE name = ?", (db_name,))
+        collection_row = cursor.fetchone()
+        if collection_row:
+            return collection_row['chroma_db_path']
+
+        logger.info(f"Collection '{db_name}' not found, creating new collection")
+        chroma_dir = new_collection_path(db_name, CHROMA_BASE_DIR)
+        cursor.execute(
+            "INSERT INTO document_collections (name, chroma_db_path, created_by) VALUES (?, ?, ?)",
+            (db_name, chroma_dir, user_id)
+        )
+        conn.commit()
+        collection_id = cursor.lastrowid
+    log_admin_action(user_id, "create_collection", {"name": db_name, "collection_id": collection_id})
+    logger.info(f"Created new collection '{db_name}' with path: {chroma_dir}")
+    return chroma_dir
+
+def ingest_files(model, db_name, user_id, saved_files, timer):
+    """Extract, chunk, embed and store files already on disk.
+
+    saved_files is a list of (display filename, path). Shared by the multipart
+    upload and the resumable chunked upload. Returns (collection name, chunks added).
+    """
+    chroma_db_path = resolve_collection_path(db_name, user_id)
+    os.makedirs(chroma_db_path, exist_ok=True)
+    store = open_store(chroma_db_path, db_name, create=True)
+    chunker = get_ingest_chunker(model)
+
+    all_texts = []
+    all_metadatas = []
+    for filename, save_path in saved_files:
+        ext = filename.rsplit(".", 1)[1].lower()
+        if ext not in READERS:
+            continue
+        with timer.stage("extract"):
+            pages = READERS[ext](save_path)
+        INGEST_FILES.inc(file_type=ext)
+        INGEST_BYTES.inc(os.path.getsize(save_path), file_type=ext)
+
+        with timer.stage("chunk"):
+            chunks = chunker.split_pages(pages)
+        all_texts.extend(chunk["text"] for chunk in chunks)
+        all_metadatas.extend(chunk_metadatas(filename, chunks, store.name))
+
+    if not all_texts:
+        return store.name, 0
+
+    batches = []
+    for start in range(0, len(all_texts), INGEST_EMBED_BATCH):
+        # Uploads are bulk work: let queued chats run between batches
+        with timer.stage("yield"):
+            yield_to_interactive()
+        with timer.stage("embed"):
+            batches.append(model.encode(all_texts[start:start + INGEST_EMBED_BATCH], convert_to_numpy=True))
+    embeddings = np.vstack(batches)
+    ids = [str(uuid.uuid4()) for _ in all_texts]
+    with timer.stage("store"):
+        store.add(ids, embeddings, all_texts, all_metadatas)
+        store.commit()
+    INGEST_CHUNKS.inc(len(all_texts))
+    return store.name, len(all_texts)
+
 def register_document_routes(app, load_sentence_transformer):
     # CORS is already configured in the main app.py file
 
     @app.route("/api/documents/collections", methods=["GET"])
     def get_document_collections():
-        user_id = request.args.get("user_id", type=int)
+        user = get_request_identity(request.args.get("user_id"))
         try:
             with get_db_connection() as conn:
                 cursor = conn.cursor()
-                if user_id:
-                    cursor.execute("SELECT department_id, grade_id, role FROM users WHERE id = ?", (user_id,))
-                    user_row = cursor.fetchone()
-                    if user_row:
-                        user = dict(zip([col[0] for col in cursor.description], user_row))
-                        if user['role'] == 'admin':
-                            cursor.execute("SELECT * FROM document_collections")
-                        else:
-                            cursor.execute(
-                                "SELECT DISTINCT dc.* FROM document_collections dc "
-                                "LEFT JOIN document_access da ON dc.id = da.document_collection_id "
-                                "WHERE da.department_id = ? OR da.grade_id = ? OR da.user_id = ?",
-                                (user['department_id'], user['grade_id'], user_id)
-                            )
-                    else:
-                        cursor.execute("SELECT * FROM document_collections")
+                if user and user['role'] != 'admin':
+                    cursor.execute(
+                        "SELECT DISTINCT dc.* FROM document_collections dc "
+                        "LEFT JOIN document_access da ON dc.id = da.document_collection_id "
+                        "WHERE da.department_id = ? OR da.grade_id = ? OR da.user_id = ?",
+                        (user['department_id'], user['grade_id'], user['id'])
+                    )
                 else:
                     cursor.execute("SELECT * FROM document_collections")
                 
@@ -172,25 +260,18 @@ def register_document_routes(app, load_sentence_transformer):
 
     @app.route("/api/documents/collections", methods=["POST"])
     def create_document_collection():
+        data = request.get_json(force=True)
+        user = get_request_identity(data.get("user_id"))
         try:
-            data = request.get_json(force=True)
             name = data.get("name", "").strip()
-            user_id = data.get("user_id")
-            if user_id is not None:
-                user_id = int(user_id)
             
-            if not name or not user_id:
+            if not name or not user:
                 return jsonify({"error": "Collection name and user ID required"}), 400
+            if user['role'] != 'admin':
+                return jsonify({"error": "Only admins can create collections"}), 403
+            user_id = user['id']
             
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-                user_row = cursor.fetchone()
-                if not user_row or user_row['role'] != 'admin':
-                    return jsonify({"error": "Only admins can create collections"}), 403
-            
-            chroma_dir = os.path.join(CHROMA_BASE_DIR, f"db_{int(time.time())}_{uuid.uuid4().hex[:8]}")
-            os.makedirs(chroma_dir, exist_ok=True)
+            chroma_dir = new_collection_path(name, CHROMA_BASE_DIR)
             
             with get_db_connection() as conn:
                 cursor = conn.cursor()
@@ -207,22 +288,19 @@ def register_document_routes(app, load_sentence_transformer):
             return jsonify({"error": f"Failed to create collection: {str(e)}"}), 400
     @app.route("/api/documents/files", methods=["DELETE"])
     def delete_file():
+        data = request.get_json(force=True)
+        user = get_request_identity(data.get("user_id"))
         try:
-            data = request.get_json(force=True)
             db_name = data.get("db_name")
             filename = data.get("filename")
-            user_id = data.get("user_id", type=int)
 
-            if not db_name or not filename or not user_id:
+            if not db_name or not filename or not user:
                 return jsonify({"error": "Collection name, filename, and user ID required"}), 400
 
             # Check if user is admin
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-                user_row = cursor.fetchone()
-                if not user_row or user_row['role'] != 'admin':
-                    return jsonify({"error": "Only admins can delete files"}), 403
+            if user['role'] != 'admin':
+                return jsonify({"error": "Only admins can delete files"}), 403
+            user_id = user['id']
 
             # Get ChromaDB collection
             with get_db_connection() as conn:
@@ -233,14 +311,14 @@ def register_document_routes(app, load_sentence_transformer):
                     return jsonify({"error": f"Collection '{db_name}' not found"}), 404
                 chroma_db_path = collection_row['chroma_db_path']
 
-            client = chromadb.PersistentClient(path=chroma_db_path)
-            collection = client.get_collection(name=db_name)
+            store = open_store(chroma_db_path, db_name)
 
             # Delete documents associated with the file
-            results = collection.get(where={"source": filename}, include=["metadatas", "ids"])
+            results = store.get(where={"source": filename}, include=["metadatas"])
             ids_to_delete = results.get("ids", [])
             if ids_to_delete:
-                collection.delete(ids=ids_to_delete)
+                store.delete(ids_to_delete)
+                store.commit()
                 logger.info(f"Deleted {len(ids_to_delete)} chunks for file '{filename}' in collection '{db_name}'")
 
             # Delete the physical file if it exists
@@ -258,21 +336,18 @@ def register_document_routes(app, load_sentence_transformer):
 
     @app.route("/api/documents/collections", methods=["DELETE"])
     def delete_collection():
+        data = request.get_json(force=True)
+        user = get_request_identity(data.get("user_id"))
         try:
-            data = request.get_json(force=True)
             db_name = data.get("db_name")
-            user_id = data.get("user_id", type=int)
 
-            if not db_name or not user_id:
+            if not db_name or not user:
                 return jsonify({"error": "Collection name and user ID required"}), 400
 
             # Check if user is admin
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-                user_row = cursor.fetchone()
-                if not user_row or user_row['role'] != 'admin':
-                    return jsonify({"error": "Only admins can delete collections"}), 403
+            if user['role'] != 'admin':
+                return jsonify({"error": "Only admins can delete collections"}), 403
+            user_id = user['id']
 
             # Get ChromaDB collection path and files before deletion
             collection_files = []
@@ -287,17 +362,13 @@ def register_document_routes(app, load_sentence_transformer):
 
                 # Get collection files before deleting the collection
                 try:
-                    client_temp = chromadb.PersistentClient(path=chroma_db_path)
-                    coll = client_temp.get_collection(name=db_name)
-                    results = coll.get(include=["metadatas"])
-                    collection_files = set(meta.get("source") for meta in results.get("metadatas", []) if meta.get("source"))
+                    collection_files = set(open_store(chroma_db_path, db_name).sources())
                 except Exception as e:
                     logger.warning(f"Could not get files from collection before deletion: {str(e)}")
 
-            # Delete the collection from ChromaDB
-            client = chromadb.PersistentClient(path=chroma_db_path)
-            client.delete_collection(name=db_name)
-            logger.info(f"Deleted collection '{db_name}' from ChromaDB")
+            # Delete the collection's vectors
+            open_store(chroma_db_path, db_name).drop()
+            logger.info(f"Deleted collection '{db_name}' from its vector store")
 
             # Delete physical files associated with the collection
             for filename in collection_files:
@@ -314,6 +385,7 @@ def register_document_routes(app, load_sentence_transformer):
 
             # Optionally, delete the ChromaDB directory if empty
             if os.path.exists(chroma_db_path) and not os.listdir(chroma_db_path):
+                forget_chroma_client(chroma_db_path)
                 os.rmdir(chroma_db_path)
                 logger.info(f"Deleted empty ChromaDB directory '{chroma_db_path}'")
 
@@ -325,20 +397,16 @@ def register_document_routes(app, load_sentence_transformer):
 
     @app.route("/api/upload", methods=["POST"])
     def upload():
+        user = get_request_identity(request.form.get("user_id"))
         try:
             data = request.form
             db_name = data.get("db_name", "").strip()
-            user_id = data.get("user_id", type=int)
             
-            if not user_id:
+            if not user:
                 return jsonify({"error": "User ID required"}), 400
-            
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
-                user_row = cursor.fetchone()
-                if not user_row or user_row['role'] != 'admin':
-                    return jsonify({"error": "Only admins can upload documents"}), 403
+            if user['role'] != 'admin':
+                return jsonify({"error": "Only admins can upload documents"}), 403
+            user_id = user['id']
             
             if "files" not in request.files:
                 return jsonify({"error": "No files provided"}), 400
@@ -347,88 +415,23 @@ def register_document_routes(app, load_sentence_transformer):
             if not files or all(not file.filename for file in files):
                 return jsonify({"error": "No valid files provided"}), 400
 
-            # Check if collection exists, if not create it
-            with get_db_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT chroma_db_path FROM document_collections WHERE name = ?", (db_name,))
-                collection_row = cursor.fetchone()
-                
-                if not collection_row:
-                    # Collection doesn't exist, create it
-                    logger.info(f"Collection '{db_name}' not found, creating new collection")
-                    chroma_dir = os.path.join(CHROMA_BASE_DIR, f"db_{int(time.time())}_{uuid.uuid4().hex[:8]}")
-                    os.makedirs(chroma_dir, exist_ok=True)
-                    
-                    cursor.execute(
-                        "INSERT INTO document_collections (name, chroma_db_path, created_by) VALUES (?, ?, ?)",
-                        (db_name, chroma_dir, user_id)
-                    )
-                    conn.commit()
-                    collection_id = cursor.lastrowid
-                    log_admin_action(user_id, "create_collection", {"name": db_name, "collection_id": collection_id})
-                    
-                    chroma_db_path = chroma_dir
-                    logger.info(f"Created new collection '{db_name}' with path: {chroma_db_path}")
-                else:
-                    chroma_db_path = collection_row['chroma_db_path']
-            
-            # Ensure the ChromaDB directory exists
-            os.makedirs(chroma_db_path, exist_ok=True)
-            
-            # Connect to the ChromaDB collection (create if doesn't exist)
-            client = chromadb.PersistentClient(path=chroma_db_path)
-            collection = client.get_or_create_collection(name=db_name)
-            
-            all_texts = []
-            all_metadatas = []
-            
-            model = load_sentence_transformer()
-            
+            timer = StageTimer("upload", INGEST_STAGE_SECONDS)
+            saved_files = []
             for file in files:
                 if file and allowed_file(file.filename):
                     filename = secure_filename(file.filename)
-                    unique_name = f"{uuid.uuid4().hex}_{filename}"
-                    save_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
-                    file.save(save_path)
-                    
-                    ext = filename.rsplit(".", 1)[1].lower()
-                    if ext == "pdf":
-                        pages = read_pdf_text(save_path)
-                    elif ext == "txt":
-                        pages = read_txt(save_path)
-                    elif ext == "docx":
-                        pages = read_docx(save_path)
-                    else:
-                        continue
-
-                    for page_i, page_text in enumerate(pages, start=1):
-                        if not page_text.strip():
-                            continue
-                        chunks = chunk_text(page_text)
-                        for ci, chunk in enumerate(chunks):
-                            all_texts.append(chunk)
-                            all_metadatas.append({
-                                "source": filename,
-                                "page": page_i,
-                                "chunk_index": ci,
-                                "collection": collection.name
-                            })
-
-            if not all_texts:
-                return jsonify({"error": "No textual content found in uploaded files"}), 400
+                    save_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{uuid.uuid4().hex}_{filename}")
+                    with timer.stage("save"):
+                        file.save(save_path)
+                    saved_files.append((filename, save_path))
 
-            embeddings = model.encode(all_texts, show_progress_bar=True, convert_to_numpy=True)
-            ids = [str(uuid.uuid4()) for _ in all_texts]
-            collection.add(
-                documents=all_texts,
-                metadatas=all_metadatas,
-                ids=ids,
-                embeddings=embeddings.tolist()
-            )
+            collection_name, chunk_count = ingest_files(load_sentence_transformer(), db_name, user_id, saved_files, timer)
+            if not chunk_count:
+                return jsonify({"error": "No textual content found in uploaded files"}), 400
 
             log_admin_action(user_id, "upload_document", {"collection_name": db_name, "files": [f.filename for f in files]})
             return jsonify({
-                "message": f"Uploaded and added {len(all_texts)} chunks to Chroma DB: {collection.name}",
+                "message": f"Uploaded and added {chunk_count} chunks to Chroma DB: {collection_name}",
                 "collection_name": db_name
             })
         except Exception as e:
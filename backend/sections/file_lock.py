@@ -0,0 +1,73 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process desktop builds, thread locks suffice
+    fcntl = None
+
+# Locks that hold across gunicorn workers and pools: an flock on a lock file next
+# to the data it protects. flock is per open file description, so a process-local
+# lock per path is taken first to serialise threads of the same process too.
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+def _thread_lock(path):
+    with _thread_locks_guard:
+        return _thread_locks.setdefault(path, threading.Lock())
+
+@contextmanager
+def file_lock(path, blocking=True, shared=False):
+    """Hold an exclusive lock on path (created if missing); yields False instead
+    of waiting when blocking is False and another holder has it. Shared holders
+    only exclude exclusive ones."""
+    # Each holder opens its own file description, so with flock shared holders
+    # need no thread lock; without it they fall back to exclusive
+    lock = _thread_lock(os.path.abspath(path)) if not (shared and fcntl) else None
+    if lock is not None and not lock.acquire(blocking):
+        yield False
+        return
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "a") as f:
+            if fcntl is not None:
+                mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+                try:
+                    fcntl.flock(f, mode if blocking else mode | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    yield False
+                    return
+            try:
+                yield True
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        if lock is not None:
+            lock.release()
+
+def pid_alive(pid):
+    """Whether a process that published state (lock holders, counters) still runs"""
+    if pid == os.getpid():
+        return True
+    if os.name == "nt":
+        # os.kill would terminate the process; desktop builds are single-process
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def process_start(pid):
+    """When pid started, in clock ticks since boot, to tell a reused pid from the
+    process that published state under it; None where /proc is unavailable"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # starttime is field 22; the command name before it may contain spaces
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
@@ -0,0 +1,53 @@
+import os
+import re
+import json
+
+# How much to generate for a question, when to stop, and when not to generate
+# at all. Budgets cap the model's configured max_new_tokens per query class, so
+# a short factual question cannot ramble to the limit; stop sequences end the
+# answer where the model starts inventing the next "Query:" turn; and when
+# retrieval selected no chunk (sections.retrieval) the canned refusal the prompt
+# asks for is returned without running the LLM.
+REFUSAL_ANSWER = "This policy is not available in the documents."
+
+DEFAULT_STOP_SEQUENCES = ["\nQuery:", "\nContext:", "\nUser:", "\nQuestion:", "</s>"]
+DEFAULT_TOKEN_BUDGETS = {"factual": 96, "list": 192, "explain": 320, "default": 256}
+
+def _json_env(name, default):
+    value = os.getenv(name)
+    return json.loads(value) if value else default
+
+STOP_SEQUENCES = _json_env("GENERATION_STOP_SEQUENCES", DEFAULT_STOP_SEQUENCES)
+TOKEN_BUDGETS = dict(DEFAULT_TOKEN_BUDGETS, **_json_env("GENERATION_TOKEN_BUDGETS", {}))
+
+# Checked in order; the first class whose pattern matches the start of the query wins
+QUERY_CLASSES = [
+    ("list", re.compile(r"^\s*(list|which|what are|what documents|enumerate|name (the|all))\b", re.I)),
+    ("explain", re.compile(r"^\s*(how|why|explain|describe|walk me through|what is the (process|procedure))\b", re.I)),
+    ("factual", re.compile(r"^\s*(what|when|who|where|is|are|can|does|do|how (many|much|long))\b", re.I)),
+]
+# "how many" and friends are factual even though "how" alone asks for an explanation
+FACTUAL_OVERRIDE = re.compile(r"^\s*how (many|much|long|often)\b", re.I)
+
+def classify_query(query):
+    if FACTUAL_OVERRIDE.match(query):
+        return "factual"
+    for name, pattern in QUERY_CLASSES:
+        if pattern.match(query):
+            return name
+    return "default"
+
+def token_budget(query, max_new_tokens):
+    """max_new_tokens for this query: its class budget, never above the model's limit"""
+    return min(max_new_tokens, TOKEN_BUDGETS.get(classify_query(query), TOKEN_BUDGETS["default"]))
+
+def generation_kwargs(max_new_tokens):
+    return {"max_new_tokens": max_new_tokens, "stop": STOP_SEQUENCES}
+
+def finish_answer(text):
+    """Cut at the first stop sequence (for backends that ignore stop) and strip"""
+    for stop in STOP_SEQUENCES:
+        index = text.find(stop)
+        if index != -1:
+            text = text[:index]
+    return text.strip()
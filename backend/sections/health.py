@@ -0,0 +1,64 @@
+import time
+from flask import jsonify
+from database.db_init import get_db_connection, get_history_db_connection
+from sections.model_config import get_residency
+from sections.warmup import is_ready, retry_warm_up, startup_report, PROCESS_STARTED, WARMUP_ERRORS, WARMUP_WARNINGS
+from sections.auth import bcrypt_queue_depth
+from sections.llm_scheduler import llm_queue_depth
+from sections.admission import bulk_in_flight, interactive_in_flight
+
+# name -> zero-argument callable returning the current depth of a work queue
+QUEUE_PROBES = {}
+
+def register_queue_probe(name, probe):
+    QUEUE_PROBES[name] = probe
+
+def queue_depths():
+    depths = {}
+    for name, probe in QUEUE_PROBES.items():
+        try:
+            depths[name] = probe()
+        except Exception as e:
+            depths[name] = f"error: {str(e)}"
+    return depths
+
+def check_database(connection_factory):
+    started = time.perf_counter()
+    try:
+        with connection_factory() as conn:
+            conn.execute("SELECT 1").fetchone()
+        return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+def register_health_routes(app):
+    register_queue_probe("bcrypt", bcrypt_queue_depth)
+    register_queue_probe("llm", llm_queue_depth)
+    register_queue_probe("bulk_in_flight", bulk_in_flight)
+    register_queue_probe("interactive_in_flight", interactive_in_flight)
+
+    @app.route("/api/health/live", methods=["GET"])
+    def liveness():
+        """The process is serving requests; no I/O so it cannot hang on a model load"""
+        return jsonify({"status": "alive", "uptime_seconds": round(time.time() - PROCESS_STARTED, 1)})
+
+    @app.route("/api/health/ready", methods=["GET"])
+    def readiness():
+        """Warm-up has finished and the databases answer; reports residency without loading anything"""
+        retry_warm_up()
+        databases = {
+            "main": check_database(get_db_connection),
+            "history": check_database(get_history_db_connection),
+        }
+        ready = is_ready() and all(db["ok"] for db in databases.values())
+        body = {
+            "ready": ready,
+            "warmed_up": is_ready(),
+            "warmup_errors": WARMUP_ERRORS,
+            "warmup_warnings": WARMUP_WARNINGS,
+            "residency": get_residency(),
+            "databases": databases,
+            "queues": queue_depths(),
+            "startup_seconds": startup_report()["total_seconds"],
+        }
+        return jsonify(body), 200 if ready else 503
@@ -1,51 +1,374 @@
 from flask import jsonify, request
 from datetime import datetime
+import base64
+import html
 import json
+import re
+import sqlite3
 from database.db_init import get_history_db_connection, log_admin_action
+from sections.auth import get_request_identity
+
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_ADMIN_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Columns a client may request through ?fields=; "username" is only available to admins
+HISTORY_FIELDS = [
+    "id", "user_id", "user_message", "ai_response", "document_collection_id",
+    "document_collection_name", "source_documents", "model_id", "timestamp",
+    "is_deleted_by_user", "deleted_at", "timings", "prompt_tokens", "completion_tokens",
+    "retrieved_chunk_ids"
+]
+# Stored as JSON text and only decoded when projected
+JSON_FIELDS = ("source_documents", "timings", "retrieved_chunk_ids")
+
+# Columns newer than the original chat_history schema, added to existing
+# databases on startup: model_id (written by /api/chat) and the trace columns
+ADDED_COLUMNS = {
+    "model_id": "TEXT",
+    "timings": "TEXT",
+    "prompt_tokens": "INTEGER",
+    "completion_tokens": "INTEGER",
+    "retrieved_chunk_ids": "TEXT",
+}
+# Always selected so the next cursor can be built from the last row
+CURSOR_FIELDS = ["timestamp", "id"]
+
+HISTORY_INDEXES = {
+    "idx_chat_history_ts": ("timestamp", "id"),
+    "idx_chat_history_user_ts": ("user_id", "timestamp", "id"),
+    "idx_chat_history_collection_ts": ("document_collection_id", "timestamp", "id"),
+    "idx_chat_history_model_ts": ("model_id", "timestamp", "id"),
+}
+
+def history_table_exists(cursor):
+    """chat_history is created by init_databases(), which the entry points run
+    after registering routes; on a fresh install it does not exist yet"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_history'")
+    return cursor.fetchone() is not None
+
+def ensure_history_columns():
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        if not history_table_exists(cursor):
+            return
+        cursor.execute("PRAGMA table_info(chat_history)")
+        columns = {row[1] for row in cursor.fetchall()}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE chat_history ADD COLUMN {column} {column_type}")
+        conn.commit()
+
+def ensure_history_indexes():
+    """Create the indexes backing keyset pagination and the history filters"""
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        if not history_table_exists(cursor):
+            return
+        cursor.execute("PRAGMA table_info(chat_history)")
+        columns = {row[1] for row in cursor.fetchall()}
+        for index_name, index_columns in HISTORY_INDEXES.items():
+            # Older databases may predate some columns (e.g. model_id)
+            if not set(index_columns) <= columns:
+                continue
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS {index_name} ON chat_history({', '.join(index_columns)})"
+            )
+        conn.commit()
+
+SEARCH_SNIPPET_TOKENS = 16
+SEARCH_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+# snippet() marks matches with private-use characters; the text around them is
+# HTML-escaped before they become <mark> tags, so snippets are safe to render
+SNIPPET_OPEN, SNIPPET_CLOSE = "\ue000", "\ue001"
+SNIPPET_FIELDS = ("user_message_snippet", "ai_response_snippet")
+_fts_available = False
+
+# External-content FTS5 index kept in sync with chat_history by triggers, so the
+# message text is stored once and searching never falls back to LIKE scans.
+HISTORY_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+    user_message, ai_response,
+    content='chat_history', content_rowid='id',
+    tokenize='porter unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS chat_history_fts_ai AFTER INSERT ON chat_history BEGIN
+    INSERT INTO chat_history_fts(rowid, user_message, ai_response)
+    VALUES (new.id, new.user_message, new.ai_response);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_history_fts_ad AFTER DELETE ON chat_history BEGIN
+    INSERT INTO chat_history_fts(chat_history_fts, rowid, user_message, ai_response)
+    VALUES ('delete', old.id, old.user_message, old.ai_response);
+END;
+CREATE TRIGGER IF NOT EXISTS chat_history_fts_au AFTER UPDATE OF user_message, ai_response ON chat_history BEGIN
+    INSERT INTO chat_history_fts(chat_history_fts, rowid, user_message, ai_response)
+    VALUES ('delete', old.id, old.user_message, old.ai_response);
+    INSERT INTO chat_history_fts(rowid, user_message, ai_response)
+    VALUES (new.id, new.user_message, new.ai_response);
+END;
+"""
+
+def ensure_history_search_index():
+    """Create the FTS5 index and its triggers, backfilling existing rows on first run.
+
+    Both are created in one transaction once chat_history exists, and the
+    backfill is decided by the triggers: rows are only indexed automatically
+    once they exist, so an index without them is rebuilt.
+    """
+    global _fts_available
+    try:
+        with get_history_db_connection() as conn:
+            cursor = conn.cursor()
+            if not history_table_exists(cursor):
+                _fts_available = False
+                return
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = 'chat_history_fts_ai'")
+            if cursor.fetchone() is None:
+                try:
+                    cursor.executescript(
+                        "BEGIN;" + HISTORY_FTS_SCHEMA +
+                        "INSERT INTO chat_history_fts(chat_history_fts) VALUES ('rebuild');"
+                        "COMMIT;"
+                    )
+                except sqlite3.Error:
+                    if conn.in_transaction:
+                        conn.rollback()
+                    raise
+        _fts_available = True
+    except sqlite3.OperationalError as e:
+        # SQLite builds without FTS5 keep the rest of the history API working
+        print(f"Chat history search disabled: {str(e)}")
+        _fts_available = False
+
+def build_match_query(text):
+    """Turn free text into an FTS5 MATCH expression, quoting terms so user input
+    cannot inject FTS syntax. The last term is prefix-matched."""
+    terms = SEARCH_TERM_PATTERN.findall(text)
+    if not terms:
+        return None
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+def encode_cursor(timestamp, row_id):
+    raw = json.dumps([timestamp, row_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor_value):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor_value.encode("ascii")))
+        return str(timestamp), int(row_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+def parse_timestamp_arg(value, name):
+    """Normalize an ISO date/datetime query arg to SQLite's CURRENT_TIMESTAMP format"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        raise ValueError(f"Invalid {name} timestamp: {value}")
+
+def parse_fields_arg(value, is_admin):
+    if not value:
+        fields = list(HISTORY_FIELDS)
+        if is_admin:
+            fields.append("username")
+        return fields
+    allowed = set(HISTORY_FIELDS) | ({"username"} if is_admin else set())
+    fields = [f.strip() for f in value.split(",") if f.strip()]
+    unknown = [f for f in fields if f not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def parse_limit_arg(is_admin):
+    default = DEFAULT_ADMIN_PAGE_SIZE if is_admin else DEFAULT_PAGE_SIZE
+    limit = request.args.get("limit", default, type=int)
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def build_history_filters(user_id, is_admin, since, until):
+    """WHERE conditions shared by listing and search: admins see everything (optionally
+    narrowed by filter_user_id), users only their own non-deleted rows."""
+    conditions = []
+    params = []
+    if is_admin:
+        filter_user_id = request.args.get("filter_user_id", type=int)
+        if filter_user_id:
+            conditions.append("ch.user_id = ?")
+            params.append(filter_user_id)
+    else:
+        conditions.append("ch.user_id = ?")
+        params.append(user_id)
+        conditions.append("ch.is_deleted_by_user = FALSE")
+
+    collection_id = request.args.get("collection_id", type=int)
+    model_id = request.args.get("model_id")
+    if collection_id:
+        conditions.append("ch.document_collection_id = ?")
+        params.append(collection_id)
+    if model_id:
+        conditions.append("ch.model_id = ?")
+        params.append(model_id)
+    if since:
+        conditions.append("ch.timestamp >= ?")
+        params.append(since)
+    if until:
+        conditions.append("ch.timestamp < ?")
+        params.append(until)
+    return conditions, params
+
+def resolve_history_caller():
+    """Return (user_id, is_admin) from the session token, or from the legacy
+    user_id/is_admin query args for clients that do not send one yet"""
+    if request.headers.get("Authorization", "").startswith("Bearer "):
+        identity = get_request_identity()
+        return identity["id"], identity["role"] == "admin"
+    return request.args.get("user_id", type=int), request.args.get("is_admin", "false").lower() == "true"
+
+def render_snippet(snippet):
+    """HTML for an FTS snippet: escaped text with matches wrapped in <mark>"""
+    if snippet is None:
+        return None
+    return html.escape(snippet).replace(SNIPPET_OPEN, "<mark>").replace(SNIPPET_CLOSE, "</mark>")
+
+def ensure_history_schema():
+    """Bring an existing chat_history up to date; a no-op until the table exists,
+    so the entry points run it again after init_databases()"""
+    ensure_history_columns()
+    ensure_history_indexes()
+    ensure_history_search_index()
 
 def register_history_routes(app):
+    ensure_history_schema()
+
     @app.route("/api/history", methods=["GET"])
     def get_history():
-        user_id = request.args.get("user_id", type=int)
-        is_admin = request.args.get("is_admin", "false").lower() == "true"
-        
+        """Page through chat history newest-first using an opaque (timestamp, id) cursor.
+
+        Query args: limit, cursor, fields (comma separated projection), collection_id,
+        model_id, since, until and, for admins, filter_user_id.
+        """
+        user_id, is_admin = resolve_history_caller()
+        limit = parse_limit_arg(is_admin)
+
+        try:
+            fields = parse_fields_arg(request.args.get("fields"), is_admin)
+            since = parse_timestamp_arg(request.args.get("since"), "since")
+            until = parse_timestamp_arg(request.args.get("until"), "until")
+            cursor_value = request.args.get("cursor")
+            after = decode_cursor(cursor_value) if cursor_value else None
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        select_fields = fields + [f for f in CURSOR_FIELDS if f not in fields]
+        columns = [("u.username" if f == "username" else f"ch.{f}") for f in select_fields]
+        if not is_admin and not user_id:
+            return jsonify({"error": "User ID required"}), 400
+        conditions, params = build_history_filters(user_id, is_admin, since, until)
+        if after:
+            conditions.append("(ch.timestamp, ch.id) < (?, ?)")
+            params.extend(after)
+
+        query = f"SELECT {', '.join(columns)} FROM chat_history ch "
+        if "username" in select_fields:
+            query += "LEFT JOIN users u ON ch.user_id = u.id "
+        if conditions:
+            query += "WHERE " + " AND ".join(conditions) + " "
+        # Fetch one extra row to know whether another page exists
+        query += "ORDER BY ch.timestamp DESC, ch.id DESC LIMIT ?"
+        params.append(limit + 1)
+
         try:
             with get_history_db_connection() as conn:
                 cursor = conn.cursor()
-                if is_admin:
-                    cursor.execute(
-                        "SELECT ch.*, u.username FROM chat_history ch "
-                        "LEFT JOIN users u ON ch.user_id = u.id "
-                        "ORDER BY ch.timestamp DESC LIMIT 100"
-                    )
-                else:
-                    cursor.execute(
-                        "SELECT * FROM chat_history WHERE user_id = ? AND is_deleted_by_user = FALSE ORDER BY timestamp DESC LIMIT 50",
-                        (user_id,)
-                    )
-                
-                history = cursor.fetchall()
-                result = []
-                for row in history:
-                    history_dict = dict(zip([col[0] for col in cursor.description], row))
-                    if history_dict.get('timestamp'):
-                        if isinstance(history_dict['timestamp'], str):
-                            history_dict['timestamp'] = datetime.fromisoformat(history_dict['timestamp']).strftime('%Y-%m-%d %H:%M:%S')
-                        else:
-                            history_dict['timestamp'] = history_dict['timestamp'].strftime('%Y-%m-%d %H:%M:%S')
-                    if history_dict.get('source_documents'):
-                        history_dict['source_documents'] = json.loads(history_dict['source_documents'])
-                    result.append(history_dict)
-                
-                return jsonify({"history": result})
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+
+            has_more = len(rows) > limit
+            rows = rows[:limit]
+            result = []
+            for row in rows:
+                history_dict = dict(zip(select_fields, row))
+                for field in JSON_FIELDS:
+                    if history_dict.get(field):
+                        history_dict[field] = json.loads(history_dict[field])
+                result.append({f: history_dict[f] for f in fields})
+
+            next_cursor = None
+            if has_more and rows:
+                last = dict(zip(select_fields, rows[-1]))
+                next_cursor = encode_cursor(last['timestamp'], last['id'])
+
+            return jsonify({"history": result, "next_cursor": next_cursor, "has_more": has_more})
         except Exception as e:
             return jsonify({"error": f"Database error: {str(e)}"}), 500
 
+    @app.route("/api/history/search", methods=["GET"])
+    def search_history():
+        """Full-text search over chat history ranked by bm25, with highlighted snippets.
+
+        Query args: q, limit, cursor, collection_id, model_id, since, until and, for
+        admins, filter_user_id.
+        """
+        if not _fts_available:
+            return jsonify({"error": "History search is not available on this database"}), 501
+
+        user_id, is_admin = resolve_history_caller()
+        limit = parse_limit_arg(is_admin)
+        match_query = build_match_query(request.args.get("q", ""))
+        if not match_query:
+            return jsonify({"error": "Search query required"}), 400
+
+        try:
+            since = parse_timestamp_arg(request.args.get("since"), "since")
+            until = parse_timestamp_arg(request.args.get("until"), "until")
+            cursor_value = request.args.get("cursor")
+            # Ranked results have no stable keyset, so the cursor carries an offset
+            offset = decode_cursor(cursor_value)[1] if cursor_value else 0
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if not is_admin and not user_id:
+            return jsonify({"error": "User ID required"}), 400
+        conditions, params = build_history_filters(user_id, is_admin, since, until)
+        conditions.insert(0, "chat_history_fts MATCH ?")
+        params.insert(0, match_query)
+
+        # Matches in the question weigh more than matches in the generated answer
+        query = (
+            "SELECT ch.id, ch.user_id, ch.document_collection_id, ch.document_collection_name, "
+            "ch.timestamp, bm25(chat_history_fts, 2.0, 1.0) AS rank, "
+            f"snippet(chat_history_fts, 0, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '...', {SEARCH_SNIPPET_TOKENS}) AS user_message_snippet, "
+            f"snippet(chat_history_fts, 1, '{SNIPPET_OPEN}', '{SNIPPET_CLOSE}', '...', {SEARCH_SNIPPET_TOKENS}) AS ai_response_snippet "
+            "FROM chat_history_fts JOIN chat_history ch ON ch.id = chat_history_fts.rowid "
+            "WHERE " + " AND ".join(conditions) + " "
+            "ORDER BY rank, ch.id DESC LIMIT ? OFFSET ?"
+        )
+        params.extend([limit + 1, offset])
+
+        try:
+            with get_history_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                columns = [col[0] for col in cursor.description]
+
+            has_more = len(rows) > limit
+            results = [dict(zip(columns, row)) for row in rows[:limit]]
+            for result in results:
+                for field in SNIPPET_FIELDS:
+                    result[field] = render_snippet(result[field])
+            next_cursor = encode_cursor(None, offset + limit) if has_more else None
+            return jsonify({"results": results, "next_cursor": next_cursor, "has_more": has_more})
+        except Exception as e:
+            return jsonify({"error": f"Search error: {str(e)}"}), 500
+
     @app.route("/api/history/<int:history_id>", methods=["DELETE"])
     def delete_history(history_id):
-        user_id = request.args.get("user_id", type=int)
-        is_admin = request.args.get("is_admin", "false").lower() == "true"
-        
+        user_id, is_admin = resolve_history_caller()
+
         try:
             with get_history_db_connection() as conn:
                 cursor = conn.cursor()
@@ -60,4 +383,4 @@ def register_history_routes(app):
                 log_admin_action(user_id if is_admin else None, "delete_history", {"history_id": history_id})
                 return jsonify({"message": "History deleted successfully"})
         except Exception as e:
-            return jsonify({"error": f"Failed to delete history: {str(e)}"}), 400
\ No newline at end of file
+            return jsonify({"error": f"Failed to delete history: {str(e)}"}), 400
@@ -0,0 +1,123 @@
+import os
+import time
+import heapq
+import itertools
+import threading
+import logging
+from concurrent.futures import Future
+from sections.metrics import LLM_QUEUE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# One thread per process owns generation; every caller enqueues its prompt and
+# waits. The model is never run concurrently (ctransformers is not thread-safe
+# and parallel generations only split the same cores), and interactive prompts
+# always run before queued batch work. Generation is not preempted, so batch
+# work additionally waits until no interactive prompt has been seen for
+# LLM_BATCH_IDLE_MS, which keeps it out of the gaps inside a burst of chats.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BATCH: "batch"}
+LLM_BATCH_IDLE_MS = int(os.getenv("LLM_BATCH_IDLE_MS", "250"))
+RUN_SECONDS_SMOOTHING = 0.2
+
+class LLMScheduler:
+    def __init__(self, batch_idle_seconds=LLM_BATCH_IDLE_MS / 1000):
+        self.batch_idle_seconds = batch_idle_seconds
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._last_interactive = 0.0
+        self._running = None
+        # Moving average of generation time, for Retry-After estimates
+        self.average_run_seconds = None
+
+    def _ensure_thread(self):
+        # Started lazily, and again after a fork: threads do not survive into
+        # gunicorn workers forked from a preloaded master
+        if self._pid != os.getpid():
+            self._pid, self._heap, self._thread = os.getpid(), [], None
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="llm-scheduler", daemon=True)
+            self._thread.start()
+
+    def submit(self, llm, prompt, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Queue llm(prompt, **kwargs); returns a Future with wait_seconds and
+        run_seconds attributes set once it has run"""
+        future = Future()
+        with self._condition:
+            self._ensure_thread()
+            if priority == PRIORITY_INTERACTIVE:
+                self._last_interactive = time.monotonic()
+            heapq.heappush(self._heap, (priority, next(self._sequence), time.monotonic(), llm, prompt, kwargs, future))
+            self._condition.notify()
+        return future
+
+    def generate(self, llm, prompt, priority=PRIORITY_INTERACTIVE, timer=None, **kwargs):
+        """Blocking submit(); records "llm_queue" and "generate" stages on timer"""
+        future = self.submit(llm, prompt, priority, **kwargs)
+        try:
+            return future.result()
+        finally:
+            if timer is not None and hasattr(future, "wait_seconds"):
+                timer.record("llm_queue", future.wait_seconds)
+                timer.record("generate", getattr(future, "run_seconds", 0.0))
+
+    def depth(self, priority=None):
+        """Queued prompts (not counting the one running), optionally of one class"""
+        with self._condition:
+            return sum(1 for entry in self._heap if priority is None or entry[0] == priority)
+
+    def running(self):
+        """Priority class of the prompt being generated, or None when idle"""
+        return PRIORITY_NAMES.get(self._running, self._running)
+
+    def _next(self):
+        with self._condition:
+            while True:
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+                if self._heap[0][0] > PRIORITY_INTERACTIVE:
+                    idle = time.monotonic() - self._last_interactive
+                    if idle < self.batch_idle_seconds:
+                        self._condition.wait(self.batch_idle_seconds - idle)
+                        continue
+                entry = heapq.heappop(self._heap)
+                self._running = entry[0]
+                return entry
+
+    def _run(self):
+        while True:
+            priority, _, queued, llm, prompt, kwargs, future = self._next()
+            try:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                future.wait_seconds = time.monotonic() - queued
+                LLM_QUEUE_SECONDS.observe(future.wait_seconds, priority=PRIORITY_NAMES.get(priority, priority))
+                started = time.monotonic()
+                try:
+                    result = llm(prompt, **kwargs)
+                except BaseException as e:
+                    future.run_seconds = time.monotonic() - started
+                    future.set_exception(e)
+                else:
+                    future.run_seconds = time.monotonic() - started
+                    future.set_result(result)
+                average = self.average_run_seconds
+                self.average_run_seconds = future.run_seconds if average is None else \
+                    average + RUN_SECONDS_SMOOTHING * (future.run_seconds - average)
+            except Exception:
+                logger.exception("LLM scheduler failed to run a generation")
+            finally:
+                with self._condition:
+                    self._running = None
+                    if priority == PRIORITY_INTERACTIVE:
+                        self._last_interactive = time.monotonic()
+
+scheduler = LLMScheduler()
+
+def llm_queue_depth():
+    return scheduler.depth()
@@ -0,0 +1,304 @@
+import os
+import json
+import glob
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from flask import Response, request
+from sections.file_lock import file_lock
+
+# Minimal Prometheus text-format registry. Values are kept per process. Gunicorn
+# workers share one listening socket, so a scrape reaches an arbitrary worker:
+# with METRICS_MULTIPROC_DIR set (serve.py sets one per pool) every process
+# writes a snapshot of its series there every METRICS_FLUSH_SECONDS, and
+# /metrics serves the sum over all of them. Counters and histograms of exited
+# workers are folded into an archive file so totals never go backwards; gauges
+# are reported per live process with a pid label.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+TOKEN_BUCKETS = (8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+RATE_BUCKETS = (0.5, 1, 2, 4, 8, 16, 32, 64, 128)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=None):
+    pairs = list(key) + (list(extra.items()) if extra else [])
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), json.loads(json.dumps(value))] for key, value in self._values.items()]
+
+    def merge(self, values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values=None):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items(), key=lambda item: str(item[0])):
+            lines.extend(self._render_series(key, value))
+        return lines
+
+    def _render_series(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {value}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def merge(self, values, key, value):
+        values[key] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def merge(self, values, key, value):
+        series = values.get(key)
+        if series is None:
+            values[key] = {"counts": list(value["counts"]), "sum": value["sum"], "count": value["count"]}
+            return
+        series["counts"] = [a + b for a, b in zip(series["counts"], value["counts"])]
+        series["sum"] += value["sum"]
+        series["count"] += value["count"]
+
+    def _render_series(self, key, series):
+        lines = []
+        for bound, count in zip(self.buckets, series["counts"]):
+            lines.append(f"{self.name}_bucket{_format_labels(key, {'le': bound})} {count}")
+        lines.append(f"{self.name}_bucket{_format_labels(key, {'le': '+Inf'})} {series['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {series['sum']}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+REQUESTS = Counter("rag_requests_total", "RAG requests by endpoint and HTTP status")
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Duration of each RAG pipeline stage")
+PROMPT_TOKENS = Histogram("rag_prompt_tokens", "Prompt size in tokens", TOKEN_BUCKETS)
+GENERATED_TOKENS = Histogram("rag_generated_tokens", "Generated tokens per answer", TOKEN_BUCKETS)
+TOKENS_PER_SECOND = Histogram("rag_generation_tokens_per_second", "Generation throughput", RATE_BUCKETS)
+RETRIEVED_CHUNKS = Histogram("rag_retrieved_chunks", "Chunks placed in the prompt", (0, 1, 2, 3, 5, 8, 13, 21))
+FAST_REFUSALS = Counter("rag_fast_refusals_total", "Answers refused without calling the LLM because retrieval scored too low")
+
+INGEST_STAGE_SECONDS = Histogram("ingest_stage_seconds", "Duration of each ingestion stage")
+INGEST_FILES = Counter("ingest_files_total", "Files ingested by type")
+INGEST_BYTES = Counter("ingest_bytes_total", "Bytes of source files ingested")
+INGEST_CHUNKS = Counter("ingest_chunks_total", "Chunks embedded and stored")
+
+LLM_QUEUE_SECONDS = Histogram("llm_queue_wait_seconds", "Time a generation waited for the LLM, by priority class")
+
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by cache name and result (hit/miss)")
+
+def record_cache(cache, hit):
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
+
+class StageTimer:
+    """Times named pipeline stages, feeding a histogram and keeping the durations
+    so the caller can return or persist them."""
+
+    def __init__(self, endpoint, histogram=STAGE_SECONDS):
+        self.endpoint = endpoint
+        self.histogram = histogram
+        self.timings = {}
+        self.background = set()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name, seconds, background=False):
+        """background stages ran concurrently with others and are left out of total_ms"""
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        if background:
+            self.background.add(name)
+        self.histogram.observe(seconds, endpoint=self.endpoint, stage=name)
+
+    def as_dict(self):
+        stages_ms = {name: round(seconds * 1000, 2) for name, seconds in self.timings.items()}
+        total_ms = sum(ms for name, ms in stages_ms.items() if name not in self.background)
+        return {"stages_ms": stages_ms, "total_ms": round(total_ms, 2)}
+
+def observe_generation(endpoint, prompt_tokens, generated_tokens, seconds):
+    PROMPT_TOKENS.observe(prompt_tokens, endpoint=endpoint)
+    GENERATED_TOKENS.observe(generated_tokens, endpoint=endpoint)
+    if seconds > 0 and generated_tokens:
+        TOKENS_PER_SECOND.observe(generated_tokens / seconds, endpoint=endpoint)
+
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+ARCHIVE_FILE = "archive.json"
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+def multiproc_dir():
+    return os.getenv("METRICS_MULTIPROC_DIR")
+
+def _registered():
+    with _registry_lock:
+        return list(_registry)
+
+def _read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_snapshot(path, snapshot):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(snapshot, f)
+    os.replace(tmp, path)
+
+def write_snapshot():
+    """Publish this process's series to the shared directory"""
+    directory = multiproc_dir()
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    _write_snapshot(os.path.join(directory, f"{os.getpid()}.json"), {m.name: m.snapshot() for m in _registered()})
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            write_snapshot()
+        except OSError:
+            pass
+
+def ensure_flusher():
+    """Start the snapshot thread in this process (again after a fork)"""
+    global _flusher_pid
+    if not multiproc_dir() or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_loop, name="metrics-flush", daemon=True).start()
+            atexit.register(write_snapshot)
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _collect(directory):
+    """{metric name: merged values} over the archive and every process snapshot;
+    snapshots of exited processes are folded into the archive first"""
+    metrics = {m.name: m for m in _registered()}
+    archive_path = os.path.join(directory, ARCHIVE_FILE)
+    with file_lock(os.path.join(directory, "LOCK")):
+        archive = None
+        for path in glob.glob(os.path.join(directory, "[0-9]*.json")):
+            pid = int(os.path.basename(path).split(".")[0])
+            if _pid_alive(pid):
+                continue
+            if archive is None:
+                archive = _read_snapshot(archive_path)
+            for name, series in _read_snapshot(path).items():
+                metric = metrics.get(name)
+                if metric is None or metric.kind == "gauge":
+                    continue
+                values = {tuple(map(tuple, key)): value for key, value in archive.get(name, [])}
+                for key, value in series:
+                    metric.merge(values, tuple(map(tuple, key)), value)
+                archive[name] = [[list(key), value] for key, value in values.items()]
+            os.remove(path)
+        if archive is not None:
+            _write_snapshot(archive_path, archive)
+
+    merged = {name: {} for name in metrics}
+    for path in [archive_path] + glob.glob(os.path.join(directory, "[0-9]*.json")):
+        pid = os.path.basename(path).split(".")[0]
+        for name, series in _read_snapshot(path).items():
+            metric = metrics.get(name)
+            if metric is None:
+                continue
+            for key, value in series:
+                key = tuple(map(tuple, key))
+                if metric.kind == "gauge":
+                    key = tuple(sorted(key + (("pid", pid),)))
+                metric.merge(merged[name], key, value)
+    return merged
+
+def render_metrics():
+    metrics = _registered()
+    directory = multiproc_dir()
+    merged = None
+    if directory:
+        write_snapshot()
+        merged = _collect(directory)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render(merged[metric.name] if merged is not None else None))
+    return "\n".join(lines) + "\n"
+
+RAG_PATHS = ("/api/chat", "/api/search")
+
+def register_metrics_routes(app):
+    @app.after_request
+    def count_rag_request(response):
+        ensure_flusher()
+        if request.path.startswith(RAG_PATHS):
+            # The route pattern, not the path: ids and junk paths must not mint series
+            endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
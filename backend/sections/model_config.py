@@ -1,12 +1,16 @@
 import os
 import sys
 import json
+import time
+import tempfile
+import threading
 from flask import jsonify  # Added import for jsonify
-from ctransformers import AutoModelForCausalLM
-from langchain_chroma import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from sentence_transformers import SentenceTransformer
 from database.db_init import get_db_connection
+from sections.metrics import record_cache
+from sections.file_lock import pid_alive
+
+# The ML stack (ctransformers, sentence_transformers, langchain, chromadb) is imported
+# inside the loaders below so CRUD-only workers never pay for torch at startup.
 
 BASE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
 MODEL_PATH = os.path.join(BASE_DIR, "models", "LLM-7B.gguf")
@@ -14,6 +18,12 @@ EMBED_MODEL = os.path.join(BASE_DIR, "models", "all-MiniLM-L6-v2")
 CHROMA_BASE_DIR = os.path.join(BASE_DIR, "database", "chroma_db")
 LLM_THREADS = int(os.getenv("LLM_THREADS", "8"))
 LLM_CTX = int(os.getenv("LLM_CTX", "8192"))
+# "torch" (sentence-transformers) or "onnx" (sections.onnx_embedder, no torch import)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+
+# Pools that load models publish what they have loaded here, so /api/status in
+# the admin pool (which never loads models) can report the inference side
+RESIDENCY_STATE_DIR = os.getenv("RESIDENCY_STATE_DIR", os.path.join(tempfile.gettempdir(), "pricol-residency"))
 
 # Default prompt template
 DEFAULT_PROMPT_TEMPLATE = """
@@ -33,6 +43,9 @@ _llm = None
 _embedder = None
 _active_model_config = None
 _sentence_transformer = None
+_chroma_clients = {}
+_chroma_clients_lock = threading.Lock()
+_load_lock = threading.Lock()
 
 def get_active_model_config():
     global _active_model_config
@@ -65,9 +78,38 @@ def get_active_model_config():
             }
     return _active_model_config
 
+def get_chroma_client(path):
+    """Return one shared PersistentClient per directory instead of reopening it per request"""
+    client = _chroma_clients.get(path)
+    record_cache("chroma_client", client is not None)
+    if client is None:
+        with _chroma_clients_lock:
+            client = _chroma_clients.get(path)
+            if client is None:
+                import chromadb
+                client = chromadb.PersistentClient(path=path)
+                _chroma_clients[path] = client
+    return client
+
+def forget_chroma_client(path):
+    with _chroma_clients_lock:
+        _chroma_clients.pop(path, None)
+
+def reset_chroma_clients():
+    """Drop every cached client, e.g. the ones a forked worker inherited from the
+    gunicorn master; chromadb keeps its own per-path cache of systems as well"""
+    with _chroma_clients_lock:
+        _chroma_clients.clear()
+    client_module = sys.modules.get("chromadb.api.client")
+    shared = getattr(client_module, "SharedSystemClient", None)
+    if shared is not None and hasattr(shared, "clear_system_cache"):
+        shared.clear_system_cache()
+
 def load_db(collection_path=None):
     global _db, _embedder
     if _db is None or collection_path:
+        from langchain_chroma import Chroma
+        from langchain_huggingface import HuggingFaceEmbeddings
         config = get_active_model_config()
         chroma_dir = collection_path or config['chroma_db_base_path']
         embed_model = config['embed_model_path']
@@ -79,63 +121,119 @@ def load_db(collection_path=None):
 
 def load_llm():
     global _llm
+    record_cache("llm", _llm is not None)
     if _llm is None:
-        config = get_active_model_config()
-        model_path = config['model_path']
-        max_context = config['max_context_tokens']
-        max_new_tokens = config['max_new_tokens']
-        llm_type = config.get('llm_type', 'ctransformers')
-
-        if not os.path.isfile(model_path):
-            raise RuntimeError(f"LLM model file not found: {model_path}")
-
-        if llm_type == 'ctransformers':
-            _llm = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                model_type="llama",
-                gpu_layers=0,
-                threads=LLM_THREADS,
-                context_length=max_context,
-                max_new_tokens=max_new_tokens,
-                temperature=0.7
-            )
-        else:
-            _llm = AutoModelForCausalLM.from_pretrained(
-                model_path,
-                model_type="llama",
-                gpu_layers=0,
-                threads=LLM_THREADS,
-                context_length=max_context
-            )
+        # Gunicorn gthread workers can race here; only one thread should pay for the load
+        with _load_lock:
+            if _llm is None:
+                _llm = _create_llm()
     return _llm
 
+def _create_llm():
+    config = get_active_model_config()
+    model_path = config['model_path']
+    max_context = config['max_context_tokens']
+    max_new_tokens = config['max_new_tokens']
+    llm_type = config.get('llm_type', 'ctransformers')
+
+    if not os.path.isfile(model_path):
+        raise RuntimeError(f"LLM model file not found: {model_path}")
+    from ctransformers import AutoModelForCausalLM
+
+    if llm_type == 'ctransformers':
+        return AutoModelForCausalLM.from_pretrained(
+            model_path,
+            model_type="llama",
+            gpu_layers=0,
+            threads=LLM_THREADS,
+            context_length=max_context,
+            max_new_tokens=max_new_tokens,
+            temperature=0.7
+        )
+    return AutoModelForCausalLM.from_pretrained(
+        model_path,
+        model_type="llama",
+        gpu_layers=0,
+        threads=LLM_THREADS,
+        context_length=max_context
+    )
+
+def count_tokens(llm, text):
+    """Token count from the model's own tokenizer, estimated at ~4 chars/token if unavailable"""
+    try:
+        return len(llm.tokenize(text))
+    except Exception:
+        return len(text) // 4
+
 def load_sentence_transformer():
     global _sentence_transformer
+    record_cache("embedder", _sentence_transformer is not None)
     if _sentence_transformer is None:
-        config = get_active_model_config()
-        embed_model = config['embed_model_path']
-        _sentence_transformer = SentenceTransformer(embed_model)
+        with _load_lock:
+            if _sentence_transformer is None:
+                config = get_active_model_config()
+                embed_model = config['embed_model_path']
+                if EMBED_BACKEND == "onnx":
+                    from sections.onnx_embedder import OnnxEmbedder, MicroBatcher
+                    _sentence_transformer = MicroBatcher(OnnxEmbedder(embed_model))
+                else:
+                    from sentence_transformers import SentenceTransformer
+                    _sentence_transformer = SentenceTransformer(embed_model)
     return _sentence_transformer
 
+def get_residency():
+    """What is already loaded in this process; never triggers a load"""
+    return {
+        "llm_loaded": _llm is not None,
+        "embedder_loaded": _sentence_transformer is not None,
+        "embed_backend": EMBED_BACKEND,
+        "chroma_stores_open": sorted(_chroma_clients),
+    }
+
+def publish_residency(ready):
+    """Record this pool's residency after warm-up; the gunicorn master writes it
+    before forking, so its pid stands for the whole pool"""
+    pool = os.getenv("PRICOL_POOL", "all")
+    state = dict(get_residency(), ready=ready, pid=os.getpid(), updated_at=time.time())
+    try:
+        os.makedirs(RESIDENCY_STATE_DIR, exist_ok=True)
+        path = os.path.join(RESIDENCY_STATE_DIR, f"{pool}.json")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not publish residency: {str(e)}")
+
+def published_residency():
+    """{pool: residency} for the pools on this host whose master is still running"""
+    pools = {}
+    try:
+        names = os.listdir(RESIDENCY_STATE_DIR)
+    except OSError:
+        return pools
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(RESIDENCY_STATE_DIR, name)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if pid_alive(state.get("pid", 0)):
+            pools[name[:-len(".json")]] = state
+    return pools
+
 def register_model_config_routes(app):
     @app.route("/api/status", methods=["GET"])
     def status():
-        model_loaded = False
-        db_ready = False
-        ready = False
-        
-        try:
-            load_db()
-            db_ready = True
-        except Exception as e:
-            print(f"DB load error: {str(e)}")
-        
-        try:
-            load_llm()
-            model_loaded = True
-        except Exception as e:
-            print(f"LLM load error: {str(e)}")
-        
+        # Reports cached state only; models are loaded by warm-up or the first chat.
+        # A process without models (the admin pool) reports the pools that have them.
+        residency = get_residency()
+        pools = published_residency()
+        model_loaded = residency["llm_loaded"] or any(p.get("llm_loaded") for p in pools.values())
+        embedder_loaded = residency["embedder_loaded"] or any(p.get("embedder_loaded") for p in pools.values())
+        db_ready = embedder_loaded and os.path.isdir(CHROMA_BASE_DIR)
         ready = model_loaded and db_ready
         config = get_active_model_config()
         
@@ -143,6 +241,8 @@ def register_model_config_routes(app):
             "model_loaded": model_loaded,
             "db_ready": db_ready,
             "ready": ready,
+            "pool": os.getenv("PRICOL_POOL", "all"),
+            "pools": pools,
             "active_config": dict(config) if isinstance(config, dict) else str(config),
             "config": {
                 "chroma_dir": CHROMA_BASE_DIR,
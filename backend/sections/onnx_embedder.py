@@ -0,0 +1,172 @@
+import os
+import json
+import threading
+import logging
+from concurrent.futures import Future
+import numpy as np
+from sections.metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+# EMBED_BACKEND=onnx serves the embedder from an ONNX export run by onnxruntime
+# instead of sentence-transformers on torch, so inference workers never import
+# torch. export_onnx_embedder.py writes <embed model dir>/onnx/model_qint8.onnx
+# (int8 dynamic quantization); the tokenizer, pooling and normalisation are read
+# from the same sentence-transformers directory, so vectors match the torch
+# backend closely enough to share existing collections.
+#
+# Query embeddings are small and arrive concurrently from request threads. The
+# MicroBatcher queues them for one encoding thread: a query that finds it idle
+# is encoded at once, and queries that arrive while a batch is encoding are
+# encoded together as the next batch (up to EMBED_MAX_BATCH texts), so nothing
+# ever waits for a timer. Calls with EMBED_MAX_BATCH texts or more (ingestion)
+# are already batches and run directly, as do calls with encode() options the
+# shared batch cannot honour (normalize_embeddings, convert_to_tensor, ...).
+EMBED_ONNX_FILE = os.getenv("EMBED_ONNX_FILE", os.path.join("onnx", "model_qint8.onnx"))
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0"))
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "64"))
+DEFAULT_MAX_SEQ_LENGTH = 256
+
+EMBED_BATCH_TEXTS = Histogram("embed_batch_texts", "Texts per coalesced query-embedding batch", (1, 2, 4, 8, 16, 32, 64))
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+class OnnxEmbedder:
+    """SentenceTransformer-compatible encode() over an ONNX transformer export"""
+
+    def __init__(self, model_dir, onnx_file=EMBED_ONNX_FILE, threads=EMBED_ONNX_THREADS):
+        import onnxruntime
+        from transformers import AutoTokenizer
+        onnx_path = onnx_file if os.path.isabs(onnx_file) else os.path.join(model_dir, onnx_file)
+        if not os.path.isfile(onnx_path):
+            raise RuntimeError(f"ONNX embedder not found: {onnx_path} (run export_onnx_embedder.py)")
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        modules = _read_json(os.path.join(model_dir, "modules.json"), [])
+        self.normalize = any(m.get("type", "").endswith("Normalize") for m in modules)
+        pooling_dir = next((m["path"] for m in modules if m.get("type", "").endswith("Pooling")), "1_Pooling")
+        pooling = _read_json(os.path.join(model_dir, pooling_dir, "config.json"), {})
+        self.cls_pooling = bool(pooling.get("pooling_mode_cls_token"))
+        self.max_seq_length = _read_json(
+            os.path.join(model_dir, "sentence_bert_config.json"), {}
+        ).get("max_seq_length", DEFAULT_MAX_SEQ_LENGTH)
+
+    def get_sentence_embedding_dimension(self):
+        return self.session.get_outputs()[0].shape[-1]
+
+    def _encode_batch(self, texts):
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+        )
+        feeds = {name: encoded[name].astype(np.int64) for name in self.input_names if name in encoded}
+        token_embeddings = self.session.run(None, feeds)[0]
+        if self.cls_pooling:
+            embeddings = token_embeddings[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            embeddings = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings.astype(np.float32)
+
+    def encode(self, sentences, batch_size=32, convert_to_numpy=True, show_progress_bar=False, **kwargs):
+        """Same call shape as SentenceTransformer.encode; always returns numpy"""
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Length-sorted batches keep padding (and wasted compute) down
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            batch = self._encode_batch([texts[i] for i in rows])
+            if embeddings.shape[1] == 0:
+                embeddings = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            embeddings[rows] = batch
+        return embeddings[0] if single else embeddings
+
+def _batchable(kwargs):
+    """Whether the coalesced call, which returns numpy without a progress bar,
+    gives what these encode() options ask for"""
+    return all(
+        key in ("show_progress_bar", "batch_size") or (key == "convert_to_numpy" and value)
+        for key, value in kwargs.items()
+    )
+
+class MicroBatcher:
+    """Coalesces concurrent small encode() calls into one embedder call"""
+
+    def __init__(self, embedder, max_batch=EMBED_MAX_BATCH):
+        self.embedder = embedder
+        self.max_batch = max_batch
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+        self._pid = None
+
+    def __getattr__(self, name):
+        # tokenizer, get_sentence_embedding_dimension, ... come from the embedder
+        return getattr(self.embedder, name)
+
+    def _ensure_thread(self):
+        # Started lazily, and again after a fork (see LLMScheduler)
+        if self._pid != os.getpid():
+            self._pid, self._pending, self._thread = os.getpid(), [], None
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._thread.start()
+
+    def encode(self, sentences, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if len(texts) >= self.max_batch or not texts or not _batchable(kwargs):
+            return self.embedder.encode(sentences, **kwargs)
+        future = Future()
+        with self._condition:
+            self._ensure_thread()
+            self._pending.append((texts, future))
+            self._condition.notify()
+        embeddings = future.result()
+        return embeddings[0] if single else embeddings
+
+    def _take(self):
+        """Everything queued while the previous batch was encoding, up to max_batch
+        texts; no waiting beyond the first request"""
+        with self._condition:
+            while not self._pending:
+                self._condition.wait()
+            count, texts = 1, len(self._pending[0][0])
+            while count < len(self._pending) and texts + len(self._pending[count][0]) <= self.max_batch:
+                texts += len(self._pending[count][0])
+                count += 1
+            taken, self._pending = self._pending[:count], self._pending[count:]
+            return taken
+
+    def _run(self):
+        while True:
+            taken = self._take()
+            texts = [text for batch, _ in taken for text in batch]
+            EMBED_BATCH_TEXTS.observe(len(texts))
+            try:
+                embeddings = self.embedder.encode(texts, convert_to_numpy=True, show_progress_bar=False)
+            except BaseException as e:
+                logger.exception("Embedding batch failed")
+                for _, future in taken:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for batch, future in taken:
+                future.set_result(embeddings[start:start + len(batch)])
+                start += len(batch)
@@ -0,0 +1,299 @@
+import os
+import json
+import argparse
+import time
+import shutil
+import logging
+import threading
+import numpy as np
+from sections.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Optional compact, read-side copy of each collection's vectors. Chroma stays the
+# source of truth (documents, metadata, deletes); when VECTOR_QUANTIZATION is
+# int8 or float16 a sidecar under <chroma_db_path>/quantized/<collection> holds
+# the quantized vectors in RAM and the float32 originals in a memory-mapped file.
+# Queries score every row on the compact codes, then rescore the best
+# RESCORE_CANDIDATES exactly against the float32 rows (only those pages are read),
+# and return Chroma-shaped results with squared-L2 distances so callers and
+# scoring are unchanged. Resident vector memory drops 4x (int8) or 2x (float16).
+# A commit applies that handle's adds and deletes to the current version instead
+# of re-reading every embedding from Chroma; a full rebuild only happens when
+# there is no usable sidecar or its row count has drifted from the collection's.
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "").lower()
+RESCORE_CANDIDATES = int(os.getenv("RESCORE_CANDIDATES", "50"))
+SCORE_BLOCK_ROWS = 16384
+QUANTIZED_DTYPES = {"int8": np.int8, "float16": np.float16}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def sidecar_dir(chroma_db_path, collection_name):
+    return os.path.join(chroma_db_path, "quantized", collection_name)
+
+def quantize(vectors, mode):
+    """(codes, per-row scales); scales are all ones for float16"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if mode == "float16":
+        return vectors.astype(np.float16), np.ones(len(vectors), dtype=np.float32)
+    # Symmetric per-row int8: keeps each row's full dynamic range
+    scales = np.abs(vectors).max(axis=1, initial=0.0) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+def group_rows(codes, groups):
+    """(order, offsets) with the rows of group g at order[offsets[g]:offsets[g + 1]],
+    ascending within each group so memory-map reads stay sequential"""
+    codes = np.asarray(codes, dtype=np.int64)
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(groups + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=groups))
+    return order, offsets
+
+class QuantizedStore:
+    """One collection's quantized vectors, loaded from a sidecar version"""
+
+    def __init__(self, directory, version):
+        with open(os.path.join(directory, f"meta-{version}.json")) as f:
+            meta = json.load(f)
+        self.version = version
+        self.mode = meta["mode"]
+        self.ids = meta["ids"]
+        self.sources = meta["sources"]
+        self.source_codes = np.load(os.path.join(directory, f"source_codes-{version}.npy"))
+        self.codes = np.load(os.path.join(directory, f"codes-{version}.npy"))
+        self.scales = np.load(os.path.join(directory, f"scales-{version}.npy"))
+        self.norms = np.load(os.path.join(directory, f"norms-{version}.npy"))
+        self.full = np.load(os.path.join(directory, f"full-{version}.npy"), mmap_mode="r")
+        self.source_order, self.source_offsets = group_rows(self.source_codes, len(self.sources))
+        self._source_code = {source: i for i, source in enumerate(self.sources)}
+
+    def source_rows(self, source):
+        code = self._source_code.get(source)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.source_order[self.source_offsets[code]:self.source_offsets[code + 1]]
+
+    def resident_bytes(self):
+        return self.codes.nbytes + self.scales.nbytes + self.norms.nbytes + self.source_codes.nbytes
+
+    def approximate_distances(self, query):
+        """Squared L2 from the compact codes, scored in blocks so the float
+        upcast never materialises the whole matrix"""
+        dots = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), SCORE_BLOCK_ROWS):
+            block = self.codes[start:start + SCORE_BLOCK_ROWS].astype(np.float32)
+            dots[start:start + SCORE_BLOCK_ROWS] = block @ query
+        dots *= self.scales
+        return self.norms + float(query @ query) - 2.0 * dots
+
+    def search(self, query, n_results, source=None):
+        """(ids, exact squared-L2 distances) of the n_results nearest rows"""
+        query = np.asarray(query, dtype=np.float32)
+        if source is not None:
+            # A single file is small: score just its rows exactly instead of
+            # masking a full-collection scan, so k hits come back whenever the
+            # file has k chunks
+            rows = self.source_rows(source)
+            if len(rows) == 0:
+                return [], []
+            exact = ((np.asarray(self.full[rows]) - query) ** 2).sum(axis=1)
+            order = np.argsort(exact)[:n_results]
+            return [self.ids[i] for i in rows[order]], exact[order].tolist()
+        distances = self.approximate_distances(query)
+        candidates = min(len(distances), max(n_results, RESCORE_CANDIDATES))
+        if candidates == 0:
+            return [], []
+        top = np.argpartition(distances, candidates - 1)[:candidates]
+        top.sort()  # sequential reads from the memory map
+        exact = ((np.asarray(self.full[top]) - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:n_results]
+        return [self.ids[i] for i in top[order]], exact[order].tolist()
+
+def current_version(directory):
+    try:
+        with open(os.path.join(directory, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+def get_quantized_store(chroma_db_path, collection_name):
+    """Cached store for the collection, reloaded when another process rebuilt it;
+    None when quantization is off or the sidecar has not been built"""
+    if VECTOR_QUANTIZATION not in QUANTIZED_DTYPES:
+        return None
+    directory = sidecar_dir(chroma_db_path, collection_name)
+    version = current_version(directory)
+    if version is None:
+        return None
+    key = (chroma_db_path, collection_name)
+    store = _stores.get(key)
+    if store is None or store.version != version:
+        with _stores_lock:
+            store = _stores.get(key)
+            if store is None or store.version != version:
+                try:
+                    store = _stores[key] = QuantizedStore(directory, version)
+                except FileNotFoundError:
+                    # Superseded by a rebuild while loading; the next query picks it up
+                    logger.warning(f"Vector sidecar version {version} of '{collection_name}' vanished while loading")
+    return store
+
+def _source_codes(labels):
+    sources, codes = np.unique(np.asarray(labels, dtype=object).astype(str), return_inverse=True)
+    return sources.tolist(), codes.astype(np.int32)
+
+def _rows_from_collection(collection, mode):
+    """Every row of the Chroma collection, quantized"""
+    results = collection.get(include=["embeddings", "metadatas"])
+    ids = results.get("ids", [])
+    embeddings = results.get("embeddings")
+    vectors = np.asarray(embeddings if embeddings is not None else [], dtype=np.float32)
+    if vectors.ndim != 2:
+        vectors = vectors.reshape(0, 0)
+    sources, source_codes = _source_codes([(meta or {}).get("source", "") for meta in results.get("metadatas", [])])
+    codes, scales = quantize(vectors, mode)
+    return ids, sources, source_codes, vectors, codes, scales
+
+def _rows_with_delta(store, added, deleted):
+    """The current version's rows minus deleted ids plus added rows; ids already
+    in it are skipped, as a full rebuild may have picked them up from Chroma.
+    None when the added vectors do not fit the version's dimension."""
+    deleted = set(deleted)
+    keep = np.array([i not in deleted for i in store.ids], dtype=bool)
+    kept_ids = [i for i, kept in zip(store.ids, keep) if kept]
+    present = set(kept_ids)
+    new = [n for n, i in enumerate(added["ids"]) if i not in present]
+    vectors = np.asarray([added["embeddings"][n] for n in new], dtype=np.float32)
+    dimension = store.full.shape[1] if store.full.ndim == 2 and len(store.ids) else None
+    if not new:
+        if dimension is None:
+            return None
+        vectors = vectors.reshape(0, dimension)
+    elif vectors.ndim != 2 or vectors.shape[1] != (dimension or vectors.shape[1]):
+        return None
+    dimension = vectors.shape[1]
+    labels = [store.sources[c] for c in store.source_codes[keep]] + [added["sources"][n] for n in new]
+    sources, source_codes = _source_codes(labels)
+    new_codes, new_scales = quantize(vectors, store.mode)
+    full = np.asarray(store.full[keep], dtype=np.float32).reshape(-1, dimension)
+    return (
+        kept_ids + [added["ids"][n] for n in new], sources, source_codes,
+        np.concatenate([full, vectors]),
+        np.concatenate([store.codes[keep].reshape(-1, dimension), new_codes]),
+        np.concatenate([store.scales[keep], new_scales]),
+    )
+
+def build_quantized_store(chroma_db_path, collection, mode=None, added=None, deleted=None):
+    """Write a new sidecar version for the Chroma collection.
+
+    added ({"ids", "embeddings", "sources"}) and deleted (ids) are one handle's
+    writes since its last commit; with them the current version is updated
+    instead of rebuilt from everything in Chroma. Builds are serialised by a
+    lock file, CURRENT is swapped atomically, and only the version this build
+    replaced is deleted: readers in other workers keep their memory maps (POSIX
+    keeps unlinked inodes alive) until they notice the change.
+    """
+    mode = mode or VECTOR_QUANTIZATION
+    if mode not in QUANTIZED_DTYPES:
+        return None
+    directory = sidecar_dir(chroma_db_path, collection.name)
+    os.makedirs(directory, exist_ok=True)
+    with file_lock(os.path.join(directory, "LOCK")):
+        previous = current_version(directory)
+        rows = None
+        if previous is not None and (added is not None or deleted is not None):
+            try:
+                store = QuantizedStore(directory, previous)
+            except (OSError, ValueError):
+                store = None
+            if store is not None and store.mode == mode:
+                rows = _rows_with_delta(store, added or {"ids": [], "embeddings": [], "sources": []}, deleted or [])
+            if rows is not None and len(rows[0]) != collection.count():
+                # A writer died between its Chroma write and its commit
+                rows = None
+        if rows is None:
+            rows = _rows_from_collection(collection, mode)
+        ids, sources, source_codes, vectors, codes, scales = rows
+
+        version = f"{int(time.time() * 1000)}-{os.getpid()}"
+        np.save(os.path.join(directory, f"codes-{version}.npy"), codes)
+        np.save(os.path.join(directory, f"scales-{version}.npy"), scales)
+        np.save(os.path.join(directory, f"norms-{version}.npy"), (vectors ** 2).sum(axis=1).astype(np.float32))
+        np.save(os.path.join(directory, f"full-{version}.npy"), vectors)
+        np.save(os.path.join(directory, f"source_codes-{version}.npy"), source_codes)
+        with open(os.path.join(directory, f"meta-{version}.json"), "w") as f:
+            json.dump({"mode": mode, "ids": ids, "sources": sources}, f)
+        tmp = os.path.join(directory, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(version)
+        os.replace(tmp, os.path.join(directory, "CURRENT"))
+
+        if previous is not None and previous != version:
+            for name in os.listdir(directory):
+                if name.endswith((f"-{previous}.npy", f"-{previous}.json")):
+                    os.remove(os.path.join(directory, name))
+    logger.info(f"Built {mode} vector sidecar for '{collection.name}': {len(ids)} rows")
+    return version
+
+def drop_quantized_store(chroma_db_path, collection_name):
+    with _stores_lock:
+        _stores.pop((chroma_db_path, collection_name), None)
+    shutil.rmtree(sidecar_dir(chroma_db_path, collection_name), ignore_errors=True)
+    quantized_root = os.path.join(chroma_db_path, "quantized")
+    if os.path.isdir(quantized_root) and not os.listdir(quantized_root):
+        os.rmdir(quantized_root)
+
+def query_collection(chroma_db_path, collection, query_embeddings, n_results, include, where=None):
+    """collection.query() replacement that serves from the quantized sidecar when
+    there is one and the filter is one it supports (none or a single source)"""
+    store = get_quantized_store(chroma_db_path, collection.name)
+    source_filter = where is None or (len(where) == 1 and isinstance(where.get("source"), str))
+    if store is None or not source_filter:
+        params = {"query_embeddings": query_embeddings, "n_results": n_results, "include": include}
+        if where:
+            params["where"] = where
+        return collection.query(**params)
+
+    searches = [store.search(query, n_results, (where or {}).get("source")) for query in query_embeddings]
+    wanted = sorted({i for ids, _ in searches for i in ids})
+    fetched = collection.get(ids=wanted, include=["documents", "metadatas"]) if wanted else {"ids": []}
+    by_id = {
+        i: (doc, meta)
+        for i, doc, meta in zip(fetched.get("ids", []), fetched.get("documents") or [], fetched.get("metadatas") or [])
+    }
+    results = {key: [] for key in ["ids"] + [k for k in ("documents", "metadatas", "distances") if k in include]}
+    for ids, distances in searches:
+        # A row deleted from Chroma after the last rebuild is simply skipped
+        kept = [(i, d) for i, d in zip(ids, distances) if i in by_id]
+        results["ids"].append([i for i, _ in kept])
+        if "documents" in include:
+            results["documents"].append([by_id[i][0] for i, _ in kept])
+        if "metadatas" in include:
+            results["metadatas"].append([by_id[i][1] for i, _ in kept])
+        if "distances" in include:
+            results["distances"].append([d for _, d in kept])
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build quantized vector sidecars for existing collections")
+    parser.add_argument("--mode", choices=sorted(QUANTIZED_DTYPES), default=VECTOR_QUANTIZATION or "int8")
+    parser.add_argument("--collection", action="append", help="Only this collection (repeatable)")
+    args = parser.parse_args()
+
+    from database.db_init import get_db_connection
+    from sections.model_config import get_chroma_client
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, chroma_db_path FROM document_collections ORDER BY id")
+        rows = [(row[0], row[1]) for row in cursor.fetchall()]
+    for name, chroma_db_path in rows:
+        if args.collection and name not in args.collection:
+            continue
+        collection = get_chroma_client(chroma_db_path).get_collection(name=name)
+        build_quantized_store(chroma_db_path, collection, args.mode)
+        store = QuantizedStore(sidecar_dir(chroma_db_path, name), current_version(sidecar_dir(chroma_db_path, name)))
+        print(f"{name}: {len(store.ids)} vectors, {store.resident_bytes() / 1e6:.1f} MB resident "
+              f"(float32 would be {store.full.nbytes / 1e6:.1f} MB)")
@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import gzip
+import time
+import logging
+import threading
+import argparse
+from datetime import datetime, timedelta, timezone
+from flask import jsonify, request
+from database.db_init import get_db_connection, get_history_db_connection, log_admin_action
+from sections.file_lock import file_lock
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+ARCHIVE_DIR = os.getenv("HISTORY_ARCHIVE_DIR", os.path.join(BASE_DIR, "database", "archive"))
+CHAT_RETENTION_DAYS = int(os.getenv("CHAT_HISTORY_RETENTION_DAYS", "365"))
+ADMIN_RETENTION_DAYS = int(os.getenv("ADMIN_HISTORY_RETENTION_DAYS", "730"))
+SOFT_DELETE_GRACE_DAYS = int(os.getenv("SOFT_DELETE_GRACE_DAYS", "30"))
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+RETENTION_ENABLED = os.getenv("HISTORY_RETENTION_ENABLED", "false").lower() == "true"
+ARCHIVE_BATCH_SIZE = 1000
+VACUUM_PAGES_PER_RUN = int(os.getenv("VACUUM_PAGES_PER_RUN", "0"))  # 0 = reclaim all free pages
+
+# table -> (retention days, extra condition); soft-deleted chat rows are purged
+# separately so they are not archived after the user asked for them to go away
+RETENTION_POLICY = {
+    "chat_history": (CHAT_RETENTION_DAYS, "is_deleted_by_user = FALSE"),
+    "admin_history": (ADMIN_RETENTION_DAYS, None),
+}
+
+# Every admin worker runs the scheduler thread; the lock file keeps runs from
+# overlapping across processes and the last-run file (the latest report) lets
+# the other workers skip until the interval has passed again
+RETENTION_LOCK_FILE = os.path.join(ARCHIVE_DIR, ".retention.lock")
+LAST_RUN_FILE = os.path.join(ARCHIVE_DIR, ".retention-last-run.json")
+
+_scheduler_thread = None
+
+def _cutoff(days, now):
+    return (now - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+def _archive_path(table, month):
+    return os.path.join(ARCHIVE_DIR, table, f"{month}.jsonl.gz")
+
+def _expired_months(cursor, table, cutoff, extra_condition):
+    condition = "timestamp < ?" + (f" AND {extra_condition}" if extra_condition else "")
+    cursor.execute(
+        f"SELECT substr(timestamp, 1, 7) AS month, COUNT(*) FROM {table} "
+        f"WHERE {condition} GROUP BY month ORDER BY month",
+        (cutoff,)
+    )
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+def _archive_month(conn, table, month, cutoff, extra_condition):
+    """Append one month of expired rows to its gzip partition, then delete them.
+
+    Rows are moved in id-ordered batches; each batch is flushed to disk before the
+    matching DELETE commits, so a crash can at worst duplicate rows in the archive.
+    """
+    cursor = conn.cursor()
+    condition = "timestamp < ? AND substr(timestamp, 1, 7) = ?" + (f" AND {extra_condition}" if extra_condition else "")
+    path = _archive_path(table, month)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    archived = 0
+    last_id = 0
+    while True:
+        cursor.execute(
+            f"SELECT * FROM {table} WHERE {condition} AND id > ? ORDER BY id LIMIT ?",
+            (cutoff, month, last_id, ARCHIVE_BATCH_SIZE)
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        columns = [col[0] for col in cursor.description]
+        # Appending creates a new gzip member; gzip readers treat members as one stream
+        with gzip.open(path, "at", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps(dict(zip(columns, row))) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        ids = [row[0] for row in rows]
+        cursor.execute(
+            f"DELETE FROM {table} WHERE id IN ({', '.join('?' * len(ids))})", ids
+        )
+        conn.commit()
+        archived += len(ids)
+        last_id = ids[-1]
+    return archived
+
+def _vacuum_report(cursor):
+    cursor.execute("PRAGMA page_size")
+    page_size = cursor.fetchone()[0]
+    cursor.execute("PRAGMA page_count")
+    page_count = cursor.fetchone()[0]
+    cursor.execute("PRAGMA freelist_count")
+    freelist = cursor.fetchone()[0]
+    cursor.execute("PRAGMA auto_vacuum")
+    auto_vacuum = cursor.fetchone()[0]
+    return {
+        "page_size": page_size,
+        "page_count": page_count,
+        "freelist_pages": freelist,
+        "file_bytes": page_size * page_count,
+        "reclaimable_bytes": page_size * freelist,
+        "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(auto_vacuum, auto_vacuum),
+    }
+
+def _incremental_vacuum(conn):
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA auto_vacuum")
+    converted = False
+    if cursor.fetchone()[0] != 2:
+        # auto_vacuum only takes effect after a full VACUUM; this is a one-off cost
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        converted = True
+    conn.commit()
+    # execute() steps the pragma once, freeing a single page; executescript runs it to completion
+    conn.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_RUN});" if VACUUM_PAGES_PER_RUN else "PRAGMA incremental_vacuum;")
+    return converted
+
+def last_report():
+    try:
+        with open(LAST_RUN_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _save_report(report):
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    tmp = f"{LAST_RUN_FILE}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(report, f)
+    os.replace(tmp, LAST_RUN_FILE)
+
+def run_retention(dry_run=True, now=None, min_interval_seconds=None):
+    """Archive expired history, purge expired soft-deletes and compact the history DB.
+
+    With dry_run the report lists what would be archived or purged without writing.
+    With min_interval_seconds the run is skipped (report["skipped"]) when any
+    process completed one more recently than that.
+    """
+    now = now or datetime.now(timezone.utc)
+    report = {
+        "dry_run": dry_run,
+        "started_at": now.strftime('%Y-%m-%d %H:%M:%S'),
+        "archive_dir": ARCHIVE_DIR,
+        "tables": {},
+    }
+    with file_lock(RETENTION_LOCK_FILE, blocking=False) as acquired:
+        if not acquired:
+            report["error"] = "Retention job already running"
+            return report
+        if min_interval_seconds is not None and os.path.exists(LAST_RUN_FILE) \
+                and time.time() - os.path.getmtime(LAST_RUN_FILE) < min_interval_seconds:
+            report["skipped"] = "Ran recently in another process"
+            return report
+        _run_retention(report, dry_run, now)
+        if not dry_run:
+            _save_report(report)
+    return report
+
+def _run_retention(report, dry_run, now):
+    started = time.time()
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        report["before"] = _vacuum_report(cursor)
+
+        for table, (days, extra_condition) in RETENTION_POLICY.items():
+            cutoff = _cutoff(days, now)
+            months = _expired_months(cursor, table, cutoff, extra_condition)
+            table_report = {
+                "retention_days": days,
+                "cutoff": cutoff,
+                "partitions": [
+                    {"month": month, "rows": count, "file": _archive_path(table, month)}
+                    for month, count in months
+                ],
+            }
+            if not dry_run:
+                table_report["archived_rows"] = sum(
+                    _archive_month(conn, table, month, cutoff, extra_condition)
+                    for month, _ in months
+                )
+            report["tables"][table] = table_report
+
+        grace_cutoff = _cutoff(SOFT_DELETE_GRACE_DAYS, now)
+        soft_delete_condition = "is_deleted_by_user = TRUE AND COALESCE(deleted_at, timestamp) < ?"
+        cursor.execute(
+            f"SELECT COUNT(*), COALESCE(SUM(LENGTH(source_documents)), 0) FROM chat_history WHERE {soft_delete_condition}",
+            (grace_cutoff,)
+        )
+        count, source_bytes = cursor.fetchone()
+        report["soft_deleted"] = {
+            "grace_days": SOFT_DELETE_GRACE_DAYS,
+            "cutoff": grace_cutoff,
+            "rows": count,
+            "source_documents_bytes": source_bytes,
+        }
+        if not dry_run and count:
+            cursor.execute(f"DELETE FROM chat_history WHERE {soft_delete_condition}", (grace_cutoff,))
+            conn.commit()
+            report["soft_deleted"]["purged_rows"] = cursor.rowcount
+
+        if not dry_run:
+            report["converted_to_incremental_vacuum"] = _incremental_vacuum(conn)
+            report["after"] = _vacuum_report(conn.cursor())
+
+    report["duration_seconds"] = round(time.time() - started, 3)
+
+def _scheduler_loop(interval_seconds):
+    while True:
+        time.sleep(interval_seconds)
+        try:
+            # Slightly under the interval, so a worker is never skipped for a whole period
+            report = run_retention(dry_run=False, min_interval_seconds=interval_seconds * 0.9)
+            if "skipped" not in report and "error" not in report:
+                logger.info(f"History retention completed: {json.dumps(report)}")
+        except Exception:
+            logger.exception("History retention failed")
+
+def start_retention_scheduler(interval_hours=RETENTION_INTERVAL_HOURS):
+    """Start the background retention thread once per process"""
+    global _scheduler_thread
+    if _scheduler_thread is None:
+        _scheduler_thread = threading.Thread(
+            target=_scheduler_loop, args=(interval_hours * 3600,), name="history-retention", daemon=True
+        )
+        _scheduler_thread.start()
+    return _scheduler_thread
+
+def register_retention_routes(app):
+    if RETENTION_ENABLED:
+        start_retention_scheduler()
+
+    @app.route("/api/history/retention", methods=["POST"])
+    def history_retention():
+        """Run the retention job on demand; defaults to a dry-run report"""
+        data = request.get_json(force=True)
+        user_id = data.get("user_id")
+        dry_run = bool(data.get("dry_run", True))
+
+        try:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT role FROM users WHERE id = ?", (user_id,))
+                user_row = cursor.fetchone()
+                if not user_row or user_row['role'] != 'admin':
+                    return jsonify({"error": "Only admins can run history retention"}), 403
+
+            report = run_retention(dry_run=dry_run)
+            if "error" in report:
+                return jsonify(report), 409
+            if not dry_run:
+                log_admin_action(user_id, "history_retention", {
+                    table: info.get("archived_rows", 0) for table, info in report["tables"].items()
+                })
+            return jsonify({"report": report, "last_run": last_report()})
+        except Exception as e:
+            return jsonify({"error": f"Retention error: {str(e)}"}), 500
+
+# Imports resolve against backend/, so run it from there as a module:
+#   cd backend && python -m sections.retention [--apply]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        prog="python -m sections.retention", description="Archive and compact the chat history database (run from backend/)"
+    )
+    parser.add_argument("--apply", action="store_true", help="Perform the archival (default is a dry run)")
+    args = parser.parse_args()
+    print(json.dumps(run_retention(dry_run=not args.apply), indent=2))
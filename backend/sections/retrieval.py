@@ -0,0 +1,163 @@
+import os
+import json
+from flask import jsonify, request
+from database.db_init import get_db_connection, log_admin_action
+from sections.auth import get_request_identity
+
+# How many retrieved chunks go into a prompt. Chroma returns squared L2 distances
+# between normalised embeddings, so score = 1/(1+d) with d = 2 - 2*cosine; what
+# counts as relevant differs per embedding model, since some (bge, e5) put even
+# unrelated text at cosine 0.6-0.7. Per model, min_score is the score below which
+# a chunk is never used (no chunk left means the refusal fast path) and
+# relative_floor stops adding chunks once they score below that fraction of the
+# best one. Chunks are added best first up to max_k. A collection can override
+# any of the three in its retrieval_config; RETRIEVAL_CALIBRATION (JSON, keyed by
+# model directory name) overrides the built-in table.
+RETRIEVAL_KEYS = ("min_score", "relative_floor", "max_k")
+MAX_K_LIMIT = 20
+ENDPOINT_MAX_K = {
+    "chat": int(os.getenv("CHAT_MAX_K", "3")),
+    "search": int(os.getenv("SEARCH_MAX_K", "5")),
+}
+
+# min_score ~ cosine 0.25 for the sentence-transformers models, 0.6 for bge, 0.75 for e5
+DEFAULT_CALIBRATION = {"min_score": 0.40, "relative_floor": 0.85}
+EMBED_CALIBRATION = {
+    "all-MiniLM-L6-v2": {"min_score": 0.40, "relative_floor": 0.85},
+    "all-MiniLM-L12-v2": {"min_score": 0.40, "relative_floor": 0.85},
+    "multi-qa-MiniLM-L6-cos-v1": {"min_score": 0.40, "relative_floor": 0.85},
+    "all-mpnet-base-v2": {"min_score": 0.42, "relative_floor": 0.85},
+    "bge-small-en-v1.5": {"min_score": 0.55, "relative_floor": 0.90},
+    "bge-base-en-v1.5": {"min_score": 0.55, "relative_floor": 0.90},
+    "e5-small-v2": {"min_score": 0.66, "relative_floor": 0.93},
+    "e5-base-v2": {"min_score": 0.66, "relative_floor": 0.93},
+}
+EMBED_CALIBRATION.update(json.loads(os.getenv("RETRIEVAL_CALIBRATION") or "{}"))
+
+def distance_score(distance):
+    return 1.0 / (1.0 + distance) if distance is not None else 0.0
+
+def embed_model_name(embed_model_path):
+    return os.path.basename(os.path.normpath(embed_model_path or ""))
+
+def collection_retrieval_config(collection):
+    """The overrides stored on a document_collections row, {} when none or unreadable"""
+    raw = (collection or {}).get("retrieval_config")
+    try:
+        config = json.loads(raw) if raw else {}
+    except ValueError:
+        return {}
+    return {key: config[key] for key in RETRIEVAL_KEYS if config.get(key) is not None}
+
+def retrieval_settings(embed_model_path, collection=None, endpoint="chat"):
+    settings = {"max_k": ENDPOINT_MAX_K[endpoint]}
+    settings.update(DEFAULT_CALIBRATION)
+    settings.update(EMBED_CALIBRATION.get(embed_model_name(embed_model_path), {}))
+    settings.update(collection_retrieval_config(collection))
+    return settings
+
+def select_chunks(distances, settings):
+    """Indexes of the chunks to use from best-first distances: stop at max_k, at
+    the first chunk below min_score, or when scores drop below relative_floor
+    times the best score"""
+    selected = []
+    for index, distance in enumerate(distances[:settings["max_k"]]):
+        score = distance_score(distance)
+        if score < settings["min_score"]:
+            break
+        if selected and score < distance_score(distances[selected[0]]) * settings["relative_floor"]:
+            break
+        selected.append(index)
+    return selected
+
+def pick(values, selected):
+    return [values[index] for index in selected]
+
+def validate_retrieval_config(data):
+    """(config, None) with only the keys that were set, or (None, error message)"""
+    config = {}
+    for key in RETRIEVAL_KEYS:
+        value = data.get(key)
+        if value is None:
+            continue
+        if key == "max_k":
+            if not isinstance(value, int) or isinstance(value, bool) or not 1 <= value <= MAX_K_LIMIT:
+                return None, f"max_k must be an integer between 1 and {MAX_K_LIMIT}"
+        elif not isinstance(value, (int, float)) or isinstance(value, bool) or not 0 <= value <= 1:
+            return None, f"{key} must be a number between 0 and 1"
+        config[key] = value
+    return config, None
+
+def ensure_retrieval_config_column():
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA table_info(document_collections)")
+        if "retrieval_config" not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute("ALTER TABLE document_collections ADD COLUMN retrieval_config TEXT")
+        conn.commit()
+
+def load_collections_by_name(names):
+    if not names:
+        return {}
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT * FROM document_collections WHERE name IN ({', '.join('?' * len(names))})", list(names))
+        columns = [col[0] for col in cursor.description]
+        return {row["name"]: row for row in (dict(zip(columns, values)) for values in cursor.fetchall())}
+
+def register_retrieval_routes(app, get_active_model_config):
+    ensure_retrieval_config_column()
+
+    def load_collection(collection_id):
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM document_collections WHERE id = ?", (collection_id,))
+            row = cursor.fetchone()
+            return dict(zip([col[0] for col in cursor.description], row)) if row else None
+
+    def describe(collection):
+        embed_model_path = get_active_model_config()['embed_model_path']
+        return {
+            "collection_id": collection['id'],
+            "name": collection['name'],
+            "embed_model": embed_model_name(embed_model_path),
+            "config": collection_retrieval_config(collection),
+            "effective": {endpoint: retrieval_settings(embed_model_path, collection, endpoint) for endpoint in ENDPOINT_MAX_K},
+        }
+
+    @app.route("/api/documents/collections/<int:collection_id>/retrieval", methods=["GET"])
+    def get_retrieval_config(collection_id):
+        user = get_request_identity(request.args.get("user_id"))
+        if not user:
+            return jsonify({"error": "User ID required"}), 400
+        if user['role'] != 'admin':
+            return jsonify({"error": "Only admins can view retrieval settings"}), 403
+        collection = load_collection(collection_id)
+        if not collection:
+            return jsonify({"error": "Collection not found"}), 404
+        return jsonify(describe(collection))
+
+    @app.route("/api/documents/collections/<int:collection_id>/retrieval", methods=["PUT"])
+    def set_retrieval_config(collection_id):
+        """Replace a collection's overrides. Body: user_id and any of min_score,
+        relative_floor, max_k; omitted keys fall back to the model calibration."""
+        data = request.get_json(silent=True) or {}
+        user = get_request_identity(data.get("user_id"))
+        if not user:
+            return jsonify({"error": "User ID required"}), 400
+        if user['role'] != 'admin':
+            return jsonify({"error": "Only admins can change retrieval settings"}), 403
+        config, error = validate_retrieval_config(data)
+        if error:
+            return jsonify({"error": error}), 400
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE document_collections SET retrieval_config = ? WHERE id = ?",
+                (json.dumps(config) if config else None, collection_id)
+            )
+            conn.commit()
+            if not cursor.rowcount:
+                return jsonify({"error": "Collection not found"}), 404
+        log_admin_action(user['id'], "set_retrieval_config", {"collection_id": collection_id, "config": config})
+        return jsonify(describe(load_collection(collection_id)))
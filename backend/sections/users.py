@@ -1,5 +1,6 @@
 from flask import jsonify, request
 from database.db_init import get_db_connection, verify_password, hash_password, log_admin_action
+from sections.auth import check_password, issue_session_token, SESSION_TTL_SECONDS
 
 def register_user_routes(app):
     @app.route("/api/login", methods=["POST"])
@@ -33,11 +34,19 @@ def register_user_routes(app):
                 if role and user['role'] != role:
                     return jsonify({"error": "Invalid role for this user"}), 401
                 
-                if not verify_password(password, user['password_hash']):
+                password_ok = check_password(password, user['password_hash'])
+                if password_ok is None:
+                    return jsonify({"error": "Too many concurrent logins, please retry"}), 503, {"Retry-After": "1"}
+                if not password_ok:
                     return jsonify({"error": "Invalid credentials"}), 401
                 
                 user.pop('password_hash', None)
-                return jsonify({"message": "Login successful", "user": user})
+                return jsonify({
+                    "message": "Login successful",
+                    "user": user,
+                    "token": issue_session_token(user),
+                    "expires_in": SESSION_TTL_SECONDS
+                })
         except Exception as e:
             return jsonify({"error": f"Database error: {str(e)}"}), 500
 
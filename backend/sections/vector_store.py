@@ -0,0 +1,606 @@
+import os
+import json
+import time
+import copy
+import shutil
+import argparse
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from sections.model_config import get_chroma_client
+from sections.metrics import record_cache
+from sections.file_lock import file_lock
+from sections.quantized_store import (
+    VECTOR_QUANTIZATION, QUANTIZED_DTYPES, current_version, group_rows, get_quantized_store, query_collection,
+    build_quantized_store, drop_quantized_store
+)
+
+logger = logging.getLogger(__name__)
+
+# Backend for newly created collections. Existing collections keep whichever
+# backend already holds them, so switching this never strands data.
+#   chroma  chromadb persistent collection (plus the optional quantized sidecar)
+#   numpy   in-process engine: memory-mapped float32 matrix, metadata columns,
+#           exact brute-force search, IVF once a collection passes IVF_MIN_ROWS
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+IVF_MIN_ROWS = int(os.getenv("IVF_MIN_ROWS", "50000"))
+IVF_NPROBE = int(os.getenv("IVF_NPROBE", "8"))
+IVF_TRAIN_SAMPLE = 20000
+IVF_ITERATIONS = 10
+SCORE_BLOCK_ROWS = 16384
+# Filters matching at most this many rows skip IVF and are scored exactly
+EXACT_FILTER_ROWS = SCORE_BLOCK_ROWS
+LOAD_ATTEMPTS = 5
+
+# File-scoped Chroma queries (where={"source": ...}) without a quantized sidecar
+# are served from per-source sub-indexes: that file's ids and vectors, fetched
+# once and scored exactly. Chroma would otherwise filter the HNSW result and can
+# return fewer than k hits. Entries are keyed on the collection's commit
+# generation, so writes from any worker invalidate them, and the cache holds at
+# most SOURCE_INDEX_CACHE_ROWS vectors in total (least recently used go first).
+SOURCE_INDEX_CACHE_ROWS = int(os.getenv("SOURCE_INDEX_CACHE_ROWS", "100000"))
+
+_numpy_stores = {}
+_numpy_lock = threading.Lock()
+_source_indexes = OrderedDict()
+_source_indexes_lock = threading.Lock()
+
+def _shape_results(ids, distances, fetch, include):
+    """Chroma query() shaped dict for a single query embedding"""
+    documents, metadatas = fetch(ids) if ids else ([], [])
+    results = {"ids": [list(ids)]}
+    if "documents" in include:
+        results["documents"] = [documents]
+    if "metadatas" in include:
+        results["metadatas"] = [metadatas]
+    if "distances" in include:
+        results["distances"] = [list(distances)]
+    return results
+
+def _merge_results(per_query, include):
+    """Stack single-query results into one Chroma-shaped multi-query result"""
+    merged = {"ids": [r["ids"][0] for r in per_query]}
+    for key in ("documents", "metadatas", "distances"):
+        if key in include:
+            merged[key] = [r[key][0] for r in per_query]
+    return merged
+
+def _top_k(rows, distances, k):
+    """(rows, distances) of the k smallest distances, nearest first"""
+    k = min(k, len(rows))
+    if k == 0:
+        return rows[:0], distances[:0]
+    top = np.argpartition(distances, k - 1)[:k]
+    top = top[np.argsort(distances[top])]
+    return rows[top], distances[top]
+
+class VectorStore:
+    """One collection's vectors, documents and metadata.
+
+    Results use Chroma's shapes and squared-L2 distances whatever the backend,
+    so route code and scoring do not change. Writes (add/delete) become visible
+    to other processes after commit().
+    """
+    backend = None
+
+    def __init__(self, chroma_db_path, name):
+        self.chroma_db_path = chroma_db_path
+        self.name = name
+
+    def add(self, ids, embeddings, documents, metadatas):
+        raise NotImplementedError
+
+    def query(self, query_embeddings, n_results, include=("documents", "metadatas", "distances"), where=None):
+        raise NotImplementedError
+
+    def get(self, where=None, include=("metadatas",), ids=None, limit=None, offset=None):
+        raise NotImplementedError
+
+    def delete(self, ids):
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def commit(self):
+        pass
+
+    def drop(self):
+        raise NotImplementedError
+
+    def sources(self):
+        results = self.get(include=["metadatas"])
+        return sorted({meta.get("source") for meta in results.get("metadatas", []) if meta and meta.get("source")})
+
+class ChromaVectorStore(VectorStore):
+    backend = "chroma"
+
+    def __init__(self, chroma_db_path, name, collection):
+        super().__init__(chroma_db_path, name)
+        self.collection = collection
+        # Writes since the last commit, applied to the quantized sidecar by commit()
+        self._added = {"ids": [], "embeddings": [], "sources": []}
+        self._deleted = []
+
+    def add(self, ids, embeddings, documents, metadatas):
+        if isinstance(embeddings, np.ndarray):
+            embeddings = embeddings.tolist()
+        self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+        if VECTOR_QUANTIZATION in QUANTIZED_DTYPES:
+            self._added["ids"].extend(ids)
+            self._added["embeddings"].extend(embeddings)
+            self._added["sources"].extend((meta or {}).get("source", "") for meta in metadatas)
+
+    def query(self, query_embeddings, n_results, include=("documents", "metadatas", "distances"), where=None):
+        single_source = where is not None and len(where) == 1 and isinstance(where.get("source"), str)
+        if single_source and get_quantized_store(self.chroma_db_path, self.name) is None:
+            return self._query_source(query_embeddings, n_results, list(include), where["source"])
+        return query_collection(self.chroma_db_path, self.collection, query_embeddings, n_results, list(include), where)
+
+    def _generation_path(self):
+        return os.path.join(self.chroma_db_path, "generations", self.name)
+
+    def generation(self):
+        """Changes on every commit() in any process; "" before the first one"""
+        try:
+            with open(self._generation_path()) as f:
+                return f.read()
+        except FileNotFoundError:
+            return ""
+
+    def source_index(self, source):
+        """(ids, float32 vectors) of one source file, cached until the next commit"""
+        key = (self.chroma_db_path, self.name, source)
+        generation = self.generation()
+        with _source_indexes_lock:
+            entry = _source_indexes.get(key)
+            if entry is not None and entry[0] == generation:
+                _source_indexes.move_to_end(key)
+                record_cache("source_index", True)
+                return entry[1], entry[2]
+        record_cache("source_index", False)
+        rows = self.collection.get(where={"source": source}, include=["embeddings"])
+        embeddings = rows.get("embeddings")
+        vectors = np.asarray(embeddings if embeddings is not None else [], dtype=np.float32)
+        if vectors.ndim != 2:
+            vectors = vectors.reshape(0, 0)
+        with _source_indexes_lock:
+            _source_indexes[key] = (generation, rows["ids"], vectors)
+            cached = sum(len(entry[1]) for entry in _source_indexes.values())
+            while cached > SOURCE_INDEX_CACHE_ROWS and len(_source_indexes) > 1:
+                cached -= len(_source_indexes.popitem(last=False)[1][1])
+        return rows["ids"], vectors
+
+    def _query_source(self, query_embeddings, n_results, include, source):
+        ids, vectors = self.source_index(source)
+        if not ids or n_results <= 0:
+            return _merge_results([_shape_results([], [], None, include) for _ in query_embeddings], include)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        distances = (vectors ** 2).sum(axis=1) + (queries ** 2).sum(axis=1)[:, None] - 2.0 * (queries @ vectors.T)
+        rows = np.arange(len(ids))
+        tops = [_top_k(rows, d, n_results) for d in distances]
+        wanted = sorted({ids[r] for top_rows, _ in tops for r in top_rows})
+        fetched = self.collection.get(ids=wanted, include=["documents", "metadatas"])
+        by_id = dict(zip(fetched["ids"], zip(fetched.get("documents") or [], fetched.get("metadatas") or [])))
+        fetch = lambda kept: ([by_id[i][0] for i in kept], [by_id[i][1] for i in kept])
+        per_query = []
+        for top_rows, top_distances in tops:
+            # A row deleted by another worker that has not committed yet is skipped
+            kept = [(ids[r], float(d)) for r, d in zip(top_rows, top_distances) if ids[r] in by_id]
+            per_query.append(_shape_results([i for i, _ in kept], [d for _, d in kept], fetch, include))
+        return _merge_results(per_query, include)
+
+    def get(self, where=None, include=("metadatas",), ids=None, limit=None, offset=None):
+        params = {"include": list(include)}
+        if where:
+            params["where"] = where
+        if ids is not None:
+            params["ids"] = ids
+        if limit is not None:
+            params["limit"] = limit
+            params["offset"] = offset or 0
+        return self.collection.get(**params)
+
+    def delete(self, ids):
+        if ids:
+            self.collection.delete(ids=ids)
+            if VECTOR_QUANTIZATION in QUANTIZED_DTYPES:
+                self._deleted.extend(ids)
+
+    def count(self):
+        return self.collection.count()
+
+    def commit(self):
+        added, self._added = self._added, {"ids": [], "embeddings": [], "sources": []}
+        deleted, self._deleted = self._deleted, []
+        build_quantized_store(self.chroma_db_path, self.collection, added=added, deleted=deleted)
+        path = self._generation_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(str(time.time_ns()))
+
+    def drop(self):
+        drop_quantized_store(self.chroma_db_path, self.name)
+        if os.path.exists(self._generation_path()):
+            os.remove(self._generation_path())
+        get_chroma_client(self.chroma_db_path).delete_collection(name=self.name)
+
+class NumpyVectorStore(VectorStore):
+    """In-process engine for small and medium collections.
+
+    Each committed version is a set of files: the float32 matrix (memory-mapped,
+    so workers share the page cache instead of private copies), squared norms,
+    documents as one UTF-8 blob plus offsets, and metadata in JSON that is turned
+    into NumPy columns on first filter. A commit writes a new version and swaps
+    CURRENT; readers elsewhere reload on their next open_store().
+
+    The loaded version is cached per process and shared, read-only, by every
+    open_store() caller; each caller gets its own handle (see handle()) so adds
+    and deletes are never mixed between requests. Commits take a lock file
+    shared by all processes and rebuild from whatever version is CURRENT at that
+    point, so concurrent writers never overwrite each other's rows.
+    """
+    backend = "numpy"
+
+    def __init__(self, chroma_db_path, name):
+        super().__init__(chroma_db_path, name)
+        self.directory = numpy_dir(chroma_db_path, name)
+        self._pending = []
+        self._deleted = set()
+        for attempt in range(LOAD_ATTEMPTS):
+            self.version = current_version(self.directory)
+            try:
+                self._load()
+                return
+            except FileNotFoundError:
+                # A commit elsewhere swapped CURRENT and removed this version
+                # while it was being read; load the new one
+                if attempt == LOAD_ATTEMPTS - 1 or current_version(self.directory) == self.version:
+                    raise
+
+    def handle(self):
+        """A view of this loaded version with its own pending adds and deletes"""
+        view = copy.copy(self)
+        view._pending, view._deleted = [], set()
+        return view
+
+    def _path(self, kind, ext):
+        return os.path.join(self.directory, f"{kind}-{self.version}.{ext}")
+
+    def _load(self):
+        if self.version is None:
+            self.ids, self.metadatas = [], []
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.norms = np.zeros(0, dtype=np.float32)
+            self.doc_offsets = np.zeros(1, dtype=np.int64)
+            self.documents_blob = b""
+            self.centroids = None
+            self._row = {}
+            self._cache = {}
+            return
+        with open(self._path("meta", "json")) as f:
+            meta = json.load(f)
+        self.ids, self.metadatas = meta["ids"], meta["metadatas"]
+        self.matrix = np.load(self._path("vectors", "npy"), mmap_mode="r")
+        self.norms = np.load(self._path("norms", "npy"))
+        self.doc_offsets = np.load(self._path("doc_offsets", "npy"))
+        blob_path = self._path("documents", "bin")
+        self.documents_blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else b""
+        self.centroids = None
+        if os.path.exists(self._path("ivf_centroids", "npy")):
+            self.centroids = np.load(self._path("ivf_centroids", "npy"))
+            self.ivf_order = np.load(self._path("ivf_order", "npy"))
+            self.ivf_offsets = np.load(self._path("ivf_offsets", "npy"))
+        self._row = {row_id: i for i, row_id in enumerate(self.ids)}
+        # Metadata columns and the source grouping, built on first use and shared
+        # by every handle on this version
+        self._cache = {}
+
+    def document(self, row):
+        return bytes(self.documents_blob[self.doc_offsets[row]:self.doc_offsets[row + 1]]).decode("utf-8")
+
+    def _fetch_rows(self, rows):
+        return [self.document(r) for r in rows], [dict(self.metadatas[r]) for r in rows]
+
+    def _column(self, key):
+        column = self._cache.get(("column", key))
+        if column is None:
+            column = self._cache[("column", key)] = np.array([meta.get(key) for meta in self.metadatas], dtype=object)
+        return column
+
+    def _source_rows(self, source):
+        """Rows of one source file, from a source -> rows grouping built on first use"""
+        groups = self._cache.get("sources")
+        if groups is None:
+            codes = {}
+            labels = [codes.setdefault(meta.get("source"), len(codes)) for meta in self.metadatas]
+            groups = self._cache["sources"] = (codes, *group_rows(labels, len(codes)))
+        codes, order, offsets = groups
+        code = codes.get(source)
+        if code is None:
+            return np.zeros(0, dtype=np.int64)
+        return order[offsets[code]:offsets[code + 1]]
+
+    def _filter_rows(self, where):
+        """Sorted row indices matching an equality filter, or None for no filter.
+        A source condition starts from that file's rows instead of a full scan."""
+        if not where:
+            return None
+        rows = self._source_rows(where["source"]) if isinstance(where.get("source"), str) else None
+        for key, value in where.items():
+            if isinstance(value, dict) or key.startswith("$"):
+                raise ValueError("numpy backend supports equality filters only")
+            if key == "source" and isinstance(value, str):
+                continue
+            column = self._column(key)
+            rows = np.flatnonzero(column == value) if rows is None else rows[column[rows] == value]
+        return rows
+
+    def _distances(self, query, rows=None):
+        return self._distances_batch(query[None, :], rows)[0]
+
+    def _distances_batch(self, queries, rows=None):
+        """Squared L2 from each query to all rows (blocked over the memory map) or
+        to the given sorted row indices; shape (queries, rows)"""
+        query_norms = (queries ** 2).sum(axis=1)[:, None]
+        if rows is not None:
+            block = np.asarray(self.matrix[rows])
+            return self.norms[rows] + query_norms - 2.0 * (queries @ block.T)
+        dots = np.empty((len(queries), len(self.ids)), dtype=np.float32)
+        for start in range(0, len(self.ids), SCORE_BLOCK_ROWS):
+            dots[:, start:start + SCORE_BLOCK_ROWS] = queries @ np.asarray(self.matrix[start:start + SCORE_BLOCK_ROWS]).T
+        return self.norms + query_norms - 2.0 * dots
+
+    def _ivf_candidates(self, query):
+        centroid_distances = ((self.centroids - query) ** 2).sum(axis=1)
+        probe = np.argsort(centroid_distances)[:IVF_NPROBE]
+        rows = np.concatenate([self.ivf_order[self.ivf_offsets[l]:self.ivf_offsets[l + 1]] for l in probe])
+        rows.sort()
+        return rows
+
+    def search(self, query, n_results, where=None):
+        """(row indices, distances) of the nearest rows, nearest first"""
+        if not self.ids or n_results <= 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        filtered = self._filter_rows(where)
+        rows = None
+        if self.centroids is not None and (filtered is None or len(filtered) > EXACT_FILTER_ROWS):
+            rows = self._ivf_candidates(query)
+            if filtered is not None:
+                rows = rows[np.isin(rows, filtered, assume_unique=True)]
+            if len(rows) < n_results:
+                # Filter too selective for the probed lists: fall back to exact
+                rows = None
+        if rows is None and filtered is None:
+            distances = self._distances(query)
+            rows = np.arange(len(self.ids))
+        else:
+            # Small filtered sets (typically one file) are scored exactly
+            rows = filtered if rows is None else rows
+            distances = self._distances(query, rows)
+        return _top_k(rows, distances, n_results)
+
+    def search_batch(self, queries, n_results, where=None):
+        """search() for several queries; exact scans share one pass over the matrix"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(len(queries), -1)
+        if len(queries) == 1 or self.centroids is not None or not self.ids or n_results <= 0:
+            return [self.search(query, n_results, where) for query in queries]
+        rows = self._filter_rows(where)
+        distances = self._distances_batch(queries, rows)
+        rows = np.arange(len(self.ids)) if rows is None else rows
+        return [_top_k(rows, d, n_results) for d in distances]
+
+    def query(self, query_embeddings, n_results, include=("documents", "metadatas", "distances"), where=None):
+        per_query = []
+        for rows, distances in self.search_batch(query_embeddings, n_results, where):
+            ids = [self.ids[r] for r in rows]
+            by_id = dict(zip(ids, rows))
+            fetch = lambda wanted, by_id=by_id: self._fetch_rows([by_id[i] for i in wanted])
+            per_query.append(_shape_results(ids, distances.tolist(), fetch, include))
+        return _merge_results(per_query, include)
+
+    def get(self, where=None, include=("metadatas",), ids=None, limit=None, offset=None):
+        if ids is not None:
+            rows = [self._row[i] for i in ids if i in self._row]
+        else:
+            filtered = self._filter_rows(where)
+            rows = list(range(len(self.ids))) if filtered is None else filtered.tolist()
+        if limit is not None:
+            rows = rows[offset or 0:(offset or 0) + limit]
+        results = {"ids": [self.ids[r] for r in rows]}
+        if "documents" in include:
+            results["documents"] = [self.document(r) for r in rows]
+        if "metadatas" in include:
+            results["metadatas"] = [dict(self.metadatas[r]) for r in rows]
+        if "embeddings" in include:
+            results["embeddings"] = np.asarray(self.matrix[rows]).tolist() if rows else []
+        return results
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self._pending.append((list(ids), np.asarray(embeddings, dtype=np.float32), list(documents), list(metadatas)))
+
+    def delete(self, ids):
+        self._deleted.update(ids)
+
+    def count(self):
+        return len(self.ids)
+
+    def commit(self):
+        """Write the CURRENT rows minus deletions plus pending adds as a new version"""
+        if not self._pending and not self._deleted:
+            return
+        with file_lock(os.path.join(self.directory, "LOCK")):
+            # Another handle or process may have committed since this one loaded
+            latest = current_version(self.directory)
+            if latest != self.version:
+                self.version = latest
+                self._load()
+            self._write_version()
+
+    def _write_version(self):
+        keep = [i for i, row_id in enumerate(self.ids) if row_id not in self._deleted]
+        ids = [self.ids[i] for i in keep]
+        metadatas = [self.metadatas[i] for i in keep]
+        documents = [self.document(i) for i in keep]
+        parts = [np.asarray(self.matrix[keep])] if keep else []
+        for p_ids, p_vectors, p_documents, p_metadatas in self._pending:
+            keep_new = [j for j, row_id in enumerate(p_ids) if row_id not in self._deleted]
+            ids += [p_ids[j] for j in keep_new]
+            documents += [p_documents[j] for j in keep_new]
+            metadatas += [p_metadatas[j] for j in keep_new]
+            parts.append(p_vectors[keep_new])
+        parts = [p for p in parts if p.size]
+        matrix = np.vstack(parts).astype(np.float32) if parts else np.zeros((0, 0), dtype=np.float32)
+
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self.version
+        self.version = f"{int(time.time() * 1000)}-{os.getpid()}"
+        encoded = [d.encode("utf-8") for d in documents]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        np.save(self._path("vectors", "npy"), matrix)
+        np.save(self._path("norms", "npy"), (matrix ** 2).sum(axis=1).astype(np.float32))
+        np.save(self._path("doc_offsets", "npy"), offsets)
+        with open(self._path("documents", "bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        with open(self._path("meta", "json"), "w") as f:
+            json.dump({"ids": ids, "metadatas": metadatas}, f)
+        if len(ids) >= IVF_MIN_ROWS:
+            self._write_ivf(matrix)
+        tmp = os.path.join(self.directory, "CURRENT.tmp")
+        with open(tmp, "w") as f:
+            f.write(self.version)
+        os.replace(tmp, os.path.join(self.directory, "CURRENT"))
+        if previous:
+            for name in os.listdir(self.directory):
+                # Exact suffix: version "...-12" must not take "...-123" with it
+                if name.endswith((f"-{previous}.npy", f"-{previous}.json", f"-{previous}.bin")):
+                    os.remove(os.path.join(self.directory, name))
+
+        self._pending, self._deleted = [], set()
+        self._load()
+        logger.info(f"Committed numpy vector store '{self.name}': {len(ids)} rows")
+
+    def _write_ivf(self, matrix):
+        """Coarse k-means (sqrt(n) lists) trained on a sample; rows are stored
+        grouped by list so a probe reads contiguous index ranges"""
+        n = len(matrix)
+        nlist = int(min(1024, max(16, np.sqrt(n))))
+        rng = np.random.default_rng(0)
+        sample = matrix[rng.choice(n, size=min(n, IVF_TRAIN_SAMPLE), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(IVF_ITERATIONS):
+            assign = _nearest_centroid(sample, centroids)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+        assign = _nearest_centroid(matrix, centroids)
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        np.save(self._path("ivf_centroids", "npy"), centroids.astype(np.float32))
+        np.save(self._path("ivf_order", "npy"), order)
+        np.save(self._path("ivf_offsets", "npy"), offsets)
+
+    def drop(self):
+        with _numpy_lock:
+            _numpy_stores.pop((self.chroma_db_path, self.name), None)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        root = os.path.dirname(self.directory)
+        if os.path.isdir(root) and not os.listdir(root):
+            os.rmdir(root)
+
+def _nearest_centroid(vectors, centroids):
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS])
+        assign[start:start + SCORE_BLOCK_ROWS] = np.argmin(centroid_norms - 2.0 * (block @ centroids.T), axis=1)
+    return assign
+
+def numpy_dir(chroma_db_path, name):
+    return os.path.join(chroma_db_path, "numpy", name)
+
+def _open_numpy(chroma_db_path, name):
+    key = (chroma_db_path, name)
+    version = current_version(numpy_dir(chroma_db_path, name))
+    store = _numpy_stores.get(key)
+    if store is None or store.version != version:
+        with _numpy_lock:
+            store = _numpy_stores.get(key)
+            if store is None or store.version != version:
+                store = _numpy_stores[key] = NumpyVectorStore(chroma_db_path, name)
+    return store.handle()
+
+def open_store(chroma_db_path, name, create=False, backend=None):
+    """The VectorStore holding a collection.
+
+    An existing collection is opened with the backend that holds it. With
+    create=True a missing one is created with backend (default VECTOR_BACKEND).
+    Raises ValueError when the collection does not exist and create is False.
+    """
+    if current_version(numpy_dir(chroma_db_path, name)) is not None:
+        return _open_numpy(chroma_db_path, name)
+    # No chroma.sqlite3 means no Chroma collections here; numpy-only installs
+    # then never open a Chroma client at all
+    if os.path.exists(os.path.join(chroma_db_path, "chroma.sqlite3")):
+        try:
+            return ChromaVectorStore(chroma_db_path, name, get_chroma_client(chroma_db_path).get_collection(name=name))
+        except ValueError:
+            pass
+    if not create:
+        raise ValueError(f"Collection {name} does not exist.")
+    if (backend or VECTOR_BACKEND) == "numpy":
+        return _open_numpy(chroma_db_path, name)
+    return ChromaVectorStore(chroma_db_path, name, get_chroma_client(chroma_db_path).get_or_create_collection(name=name))
+
+def create_store(chroma_db_path, name, backend):
+    """A new, empty collection on an explicit backend (for copies and conversions)"""
+    if backend == "numpy":
+        return _open_numpy(chroma_db_path, name)
+    return ChromaVectorStore(chroma_db_path, name, get_chroma_client(chroma_db_path).create_collection(name=name))
+
+def copy_rows(source, target, batch=1000):
+    """Copy every row from one store to another in batches and commit; returns rows copied"""
+    copied = 0
+    while True:
+        rows = source.get(include=["embeddings", "documents", "metadatas"], limit=batch, offset=copied)
+        if not rows["ids"]:
+            break
+        target.add(rows["ids"], rows["embeddings"], rows["documents"], rows["metadatas"])
+        copied += len(rows["ids"])
+    target.commit()
+    return copied
+
+def convert_store(chroma_db_path, name, backend):
+    """Copy a collection into the other backend, then drop the original"""
+    source = open_store(chroma_db_path, name)
+    if source.backend == backend:
+        return source
+    target = create_store(chroma_db_path, name, backend)
+    expected = source.count()
+    copy_rows(source, target)
+    if target.count() != expected:
+        raise RuntimeError(f"Converted {target.count()} of {expected} rows for '{name}'; original kept")
+    source.drop()
+    return target
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move collections between vector backends")
+    parser.add_argument("--to", choices=["chroma", "numpy"], required=True)
+    parser.add_argument("--collection", action="append", help="Only this collection (repeatable)")
+    args = parser.parse_args()
+
+    from database.db_init import get_db_connection
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, chroma_db_path FROM document_collections ORDER BY id")
+        rows = [(row[0], row[1]) for row in cursor.fetchall()]
+    for name, chroma_db_path in rows:
+        if args.collection and name not in args.collection:
+            continue
+        store = convert_store(chroma_db_path, name, args.to)
+        print(f"{name}: {store.count()} rows on {store.backend}")
@@ -0,0 +1,161 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from flask import jsonify
+from database.db_init import get_db_connection, get_history_db_connection
+from sections.model_config import load_llm, load_sentence_transformer, publish_residency
+from sections.vector_store import open_store
+
+WARMUP_HOT_COLLECTIONS = int(os.getenv("WARMUP_HOT_COLLECTIONS", "5"))
+WARMUP_HOT_WINDOW_DAYS = int(os.getenv("WARMUP_HOT_WINDOW_DAYS", "7"))
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "30"))
+
+PROCESS_STARTED = time.time()
+STARTUP_TIMINGS = {}
+# Model load failures keep the process unready (and are retried); per-collection
+# Chroma failures are only reported, a bad collection must not take chat down
+WARMUP_ERRORS = {}
+WARMUP_WARNINGS = {}
+_ready = threading.Event()
+_load_model = True
+_last_attempt = 0.0
+_retry_lock = threading.Lock()
+
+def record_startup_stage(name, seconds):
+    STARTUP_TIMINGS[name] = round(seconds, 4)
+
+@contextmanager
+def startup_stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_stage(name, time.perf_counter() - started)
+
+def is_ready():
+    return _ready.is_set()
+
+def mark_ready():
+    """For processes that serve no inference paths and therefore skip warm_up()"""
+    _ready.set()
+
+def hot_collections(limit=WARMUP_HOT_COLLECTIONS):
+    """Collections with the most chat traffic recently, falling back to the newest ones"""
+    with get_history_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT document_collection_id FROM chat_history "
+            "WHERE document_collection_id IS NOT NULL AND timestamp >= datetime('now', ?) "
+            "GROUP BY document_collection_id ORDER BY COUNT(*) DESC LIMIT ?",
+            (f"-{WARMUP_HOT_WINDOW_DAYS} days", limit)
+        )
+        hot_ids = [row[0] for row in cursor.fetchall()]
+
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, chroma_db_path FROM document_collections ORDER BY id DESC")
+        collections = [dict(zip([col[0] for col in cursor.description], row)) for row in cursor.fetchall()]
+    by_id = {c['id']: c for c in collections}
+    ordered = [by_id[i] for i in hot_ids if i in by_id]
+    ordered += [c for c in collections if c['id'] not in hot_ids]
+    return ordered[:limit]
+
+def _warm_models(load_model):
+    """Load the embedder and the active LLM; returns a warm-up query embedding"""
+    global _last_attempt
+    _last_attempt = time.time()
+    embedding = None
+    WARMUP_ERRORS.pop("embedder", None)
+    with startup_stage("warmup.embedder"):
+        try:
+            model = load_sentence_transformer()
+            embedding = model.encode(["warm-up"], convert_to_numpy=True)[0].tolist()
+        except Exception as e:
+            WARMUP_ERRORS["embedder"] = str(e)
+
+    if load_model:
+        WARMUP_ERRORS.pop("llm", None)
+        with startup_stage("warmup.llm"):
+            try:
+                load_llm()
+            except Exception as e:
+                WARMUP_ERRORS["llm"] = str(e)
+    return embedding
+
+def warm_chroma(embedding=None):
+    """Open the hottest collections and run one query so their indexes are resident.
+
+    Called again in every forked worker: Chroma clients hold SQLite handles and
+    threads that must not be shared with the parent process.
+    """
+    if embedding is None and "embedder" not in WARMUP_ERRORS:
+        try:
+            embedding = load_sentence_transformer().encode(["warm-up"], convert_to_numpy=True)[0].tolist()
+        except Exception as e:
+            WARMUP_ERRORS["embedder"] = str(e)
+    with startup_stage("warmup.chroma"):
+        try:
+            collections = hot_collections()
+        except Exception as e:
+            WARMUP_WARNINGS["chroma"] = str(e)
+            return
+        for coll in collections:
+            try:
+                store = open_store(coll['chroma_db_path'], coll['name'])
+                # Indexes (HNSW segment, sidecar, memory map) load on first query, not on open
+                if embedding is not None and store.count():
+                    store.query(query_embeddings=[embedding], n_results=1)
+                WARMUP_WARNINGS.pop(f"chroma:{coll['name']}", None)
+            except Exception as e:
+                WARMUP_WARNINGS[f"chroma:{coll['name']}"] = str(e)
+
+def warm_up(load_model=True):
+    """Load the embedder, the active LLM and the hottest Chroma indexes before the
+    process reports ready. Each stage is timed; failures are recorded, not raised.
+    A failed model load keeps the process unready until retry_warm_up() succeeds."""
+    global _load_model
+    _load_model = load_model
+    embedding = _warm_models(load_model)
+    warm_chroma(embedding)
+    if not WARMUP_ERRORS:
+        _ready.set()
+    publish_residency(is_ready())
+    return startup_report()
+
+def _retry():
+    try:
+        _warm_models(_load_model)
+        if not WARMUP_ERRORS:
+            _ready.set()
+            publish_residency(True)
+    finally:
+        _retry_lock.release()
+
+def retry_warm_up():
+    """Retry failed model loads in the background, at most every WARMUP_RETRY_SECONDS.
+
+    Called from the readiness probe, so a model file that appears (or a transient
+    load error that clears) after startup makes the process ready without a restart.
+    """
+    if is_ready() or not WARMUP_ERRORS or time.time() - _last_attempt < WARMUP_RETRY_SECONDS:
+        return False
+    if not _retry_lock.acquire(blocking=False):
+        return False
+    threading.Thread(target=_retry, name="warmup-retry", daemon=True).start()
+    return True
+
+def startup_report():
+    return {
+        "ready": is_ready(),
+        "uptime_seconds": round(time.time() - PROCESS_STARTED, 1),
+        "stages": STARTUP_TIMINGS,
+        "total_seconds": round(sum(STARTUP_TIMINGS.values()), 4),
+        "errors": WARMUP_ERRORS,
+        "warnings": WARMUP_WARNINGS,
+    }
+
+def register_warmup_routes(app):
+    @app.route("/api/startup", methods=["GET"])
+    def startup():
+        return jsonify(startup_report())
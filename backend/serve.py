@@ -0,0 +1,181 @@
+"""Production entry point for the Flask API.
+
+    python serve.py --pool inference   # /api/chat, /api/search, /api/upload
+    python serve.py --pool admin       # everything else (CRUD, history, status)
+    python serve.py --pool bulk        # optional: uploads and batch search/jobs, niced
+    python serve.py --pool all         # single pool for small installs
+
+The inference pool imports the app and loads the active LLM and embedder in the
+gunicorn master before forking, so every worker shares the model weights through
+copy-on-write instead of loading its own copy. The admin pool never loads models
+and uses threaded workers, so a slow generation can no longer block the admin UI.
+Put a reverse proxy in front that sends INFERENCE_PATHS to the inference bind and
+everything else to the admin bind, except that resumable-upload sessions and
+their parts (ADMIN_UPLOAD_PATHS; not .../complete) also go to the admin bind.
+Health, startup and metrics (EVERY_POOL_PATHS) are answered by every pool, so
+probe and scrape each bind directly. To keep interactive latency steady during
+ingestion and batch jobs, also run the bulk pool and send BULK_PATHS to it: its
+processes run at a lower CPU priority (BULK_NICE), so the kernel gives the cores
+to chat first. Without it the inference pool keeps serving those paths, but
+queued /api/chat/batch jobs only run in the bulk (or all) pool.
+
+Graceful reload: send SIGHUP to the master (see --pidfile); workers finish their
+in-flight request before being replaced. Requires gunicorn (Linux/macOS).
+"""
+import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+from flask import jsonify, request
+from gunicorn.app.base import BaseApplication
+
+INFERENCE_PATHS = ("/api/chat", "/api/search", "/api/upload")
+BULK_PATHS = ("/api/upload", "/api/search/batch", "/api/chat/batch")
+# Resumable-upload sessions and part PUTs are plain I/O that can take as long as
+# the client's link: the threaded admin pool serves them, so slow uploads never
+# hold a sync inference worker. Only .../complete (verify and ingest) needs models.
+ADMIN_UPLOAD_PATHS = re.compile(r"^/api/upload/sessions(/[0-9a-f]+(/parts/\d+)?)?/?$")
+# Answered by every pool: probes and scrapes must reach each process type
+EVERY_POOL_PATHS = ("/api/health/", "/api/startup", "/metrics")
+
+LLM_THREADS = int(os.getenv("LLM_THREADS", "8"))
+CPU_COUNT = multiprocessing.cpu_count()
+
+POOLS = {
+    "inference": {
+        "bind": os.getenv("INFERENCE_BIND", "0.0.0.0:8000"),
+        # Each generation already uses LLM_THREADS cores
+        "workers": int(os.getenv("INFERENCE_WORKERS", max(1, CPU_COUNT // LLM_THREADS))),
+        "worker_class": "sync",
+        "threads": 1,
+        "timeout": int(os.getenv("INFERENCE_TIMEOUT", "300")),
+        "preload_app": True,
+    },
+    "admin": {
+        "bind": os.getenv("ADMIN_BIND", "0.0.0.0:8001"),
+        "workers": int(os.getenv("ADMIN_WORKERS", "2")),
+        "worker_class": "gthread",
+        "threads": int(os.getenv("ADMIN_THREADS", "8")),
+        "timeout": int(os.getenv("ADMIN_TIMEOUT", "30")),
+        "preload_app": False,
+    },
+    "bulk": {
+        "bind": os.getenv("BULK_BIND", "0.0.0.0:8002"),
+        "workers": int(os.getenv("BULK_WORKERS", "1")),
+        "worker_class": "gthread",
+        "threads": int(os.getenv("BULK_THREADS", "2")),
+        "timeout": int(os.getenv("BULK_TIMEOUT", "3600")),
+        "preload_app": True,
+        "nice": int(os.getenv("BULK_NICE", "10")),
+    },
+    "all": {
+        "bind": os.getenv("BIND", "0.0.0.0:8000"),
+        "workers": int(os.getenv("WORKERS", max(2, CPU_COUNT // LLM_THREADS))),
+        "worker_class": "gthread",
+        "threads": int(os.getenv("THREADS", "4")),
+        "timeout": int(os.getenv("INFERENCE_TIMEOUT", "300")),
+        "preload_app": True,
+    },
+}
+
+def restrict_to_pool(app, pool):
+    """Reject requests that the reverse proxy should have sent to the other pool"""
+    if pool == "all":
+        return
+
+    @app.before_request
+    def check_pool():
+        if request.path.startswith(EVERY_POOL_PATHS):
+            return None
+        admin_upload = ADMIN_UPLOAD_PATHS.match(request.path) is not None
+        if pool == "bulk":
+            served = request.path.startswith(BULK_PATHS) and not admin_upload
+        else:
+            model_path = request.path.startswith(INFERENCE_PATHS) and not admin_upload
+            served = model_path == (pool == "inference")
+        if not served:
+            return jsonify({"error": f"{request.path} is not served by the {pool} pool"}), 421
+
+def post_fork(server, worker):
+    """Chroma clients opened by warm-up in the master hold SQLite handles and
+    threads that do not survive a fork: each worker reopens and warms its own"""
+    import threading
+    from sections.model_config import reset_chroma_clients
+    from sections.warmup import warm_chroma
+    reset_chroma_clients()
+    threading.Thread(target=warm_chroma, name="warmup-chroma", daemon=True).start()
+
+class PricolApplication(BaseApplication):
+    def __init__(self, pool, options):
+        self.pool = pool
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        from database.db_init import init_databases
+        from app import app, migrate_databases
+        from sections.warmup import startup_stage, startup_report, warm_up, mark_ready
+        with startup_stage("init_databases"):
+            init_databases()
+            migrate_databases()
+        restrict_to_pool(app, self.pool)
+        if self.options.get("nice"):
+            # Set in the master before forking, so every worker inherits it
+            os.nice(self.options["nice"])
+        if self.options.get("preload_app"):
+            # Runs in the master, so the loaded weights are inherited by every worker
+            warm_up()
+        else:
+            mark_ready()
+        print(f"Startup breakdown: {startup_report()}")
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Pricol AI API under gunicorn")
+    parser.add_argument("--pool", choices=sorted(POOLS), default="all")
+    parser.add_argument("--bind", help="Override the pool's bind address")
+    parser.add_argument("--workers", type=int, help="Override the pool's worker count")
+    parser.add_argument("--pidfile", help="Write the master PID here (for SIGHUP reloads)")
+    args = parser.parse_args()
+
+    if args.pool != "all" and not os.getenv("FLASK_SECRET_KEY"):
+        # Session tokens issued by one pool must verify in the other
+        sys.exit("FLASK_SECRET_KEY must be set when running split pools")
+
+    options = dict(POOLS[args.pool])
+    bind = args.bind or options["bind"]
+    # Workers publish their series here so any one of them can answer /metrics
+    # for the whole pool; a fresh directory per start, like process-local counters
+    metrics_dir = os.getenv("METRICS_MULTIPROC_DIR") or os.path.join(
+        tempfile.gettempdir(), f"pricol-metrics-{args.pool}-{bind.rsplit(':', 1)[-1]}"
+    )
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    os.environ["METRICS_MULTIPROC_DIR"] = metrics_dir
+    # Read by the app for pool-specific behaviour (batch_jobs.BATCH_RUNNER_POOLS)
+    os.environ["PRICOL_POOL"] = args.pool
+
+    options.update({
+        "bind": bind,
+        "workers": args.workers or options["workers"],
+        "graceful_timeout": int(os.getenv("GRACEFUL_TIMEOUT", "60")),
+        # Recycle workers periodically to bound fragmentation growth
+        "max_requests": int(os.getenv("MAX_REQUESTS", "1000")),
+        "max_requests_jitter": int(os.getenv("MAX_REQUESTS_JITTER", "100")),
+        "pidfile": args.pidfile,
+        "proc_name": f"pricol-{args.pool}",
+        "post_fork": post_fork if options.get("preload_app") else None,
+    })
+    print(f"Starting {args.pool} pool on {options['bind']} with {options['workers']} workers")
+    PricolApplication(args.pool, options).run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+# sections modules bind database.db_init at import time, so the throwaway
+# databases must be installed before any test module imports them
+from benchmarks.harness import install_bench_databases
+
+install_bench_databases(tempfile.mkdtemp(prefix="pricol-tests-"))
@@ -0,0 +1,57 @@
+import os
+import pytest
+
+pytest.importorskip("flask_cors")  # bulk_ingest reuses the upload rules in sections.documents
+from bulk_ingest import CollectionWriter, discover, source_name
+
+def touch(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write("text")
+
+def test_source_names_keep_extension_and_stay_unique():
+    taken = set()
+    names = [source_name(path, taken) for path in ("forms/leave.pdf", "forms_leave.pdf", "报告.pdf", "报告/概要.txt")]
+    assert names[0] == "forms_leave.pdf"
+    assert names[1].startswith("forms_leave_") and names[1].endswith(".pdf")
+    assert names[2].endswith(".pdf") and names[2] != "pdf"
+    assert names[3].endswith(".txt")
+    assert len(set(names)) == len(names)
+    # Stable across runs, so a restart skips what is already stored
+    assert source_name("报告.pdf", set()) == names[2]
+
+def test_discover_survives_non_ascii_collisions(tmp_path):
+    for name in ("报告.pdf", "отчёт.pdf", "forms/leave.pdf", "forms_leave.pdf"):
+        touch(str(tmp_path / "HR" / name))
+    plan = discover(str(tmp_path))
+    sources = [source for source, _ in plan["HR"]]
+    assert len(sources) == len(set(sources)) == 4
+    assert all(source.rsplit(".", 1)[1] == "pdf" for source in sources)
+
+class FakeStore:
+    def __init__(self):
+        self.rows = 0
+        self.commits = []
+
+    def add(self, ids, embeddings, documents, metadatas):
+        self.rows += len(ids)
+
+    def commit(self):
+        self.commits.append(self.rows)
+
+class FakeModel:
+    def encode(self, texts, **kwargs):
+        return [[0.0] for _ in texts]
+
+def test_writer_commits_periodically():
+    stats = {"embed_seconds": 0.0, "store_seconds": 0.0, "chunks": 0}
+    store = FakeStore()
+    writer = CollectionWriter(store, FakeModel(), batch_chunks=10, commit_chunks=25, stats=stats)
+    for _ in range(7):
+        writer.add(["chunk"] * 10, [{}] * 10)
+    assert store.commits == [30, 60]
+    writer.flush()
+    writer.commit()
+    assert store.commits == [30, 60, 70]
+    writer.commit()
+    assert store.commits == [30, 60, 70]
@@ -0,0 +1,39 @@
+import os
+import time
+import types
+import pytest
+
+pytest.importorskip("flask_cors")  # chunked_upload ingests through sections.documents
+from sections import chunked_upload
+from sections.chunked_upload import expire_sessions, sessions_dir, write_manifest
+
+def age(path, seconds):
+    stamp = time.time() - seconds
+    for name in os.listdir(path):
+        os.utime(os.path.join(path, name), (stamp, stamp))
+    os.utime(path, (stamp, stamp))
+
+def test_expiry_spares_sessions_being_created(tmp_path):
+    app = types.SimpleNamespace(config={"UPLOAD_FOLDER": str(tmp_path)})
+    root = sessions_dir(app)
+    creating, abandoned, stale, active = (os.path.join(root, name) for name in ("a" * 32, "b" * 32, "c" * 32, "d" * 32))
+    os.makedirs(creating)  # no manifest yet, as between makedirs and write_manifest
+    os.makedirs(abandoned)
+    age(abandoned, chunked_upload.UPLOAD_SESSION_GRACE_SECONDS + 1)
+    for path in (stale, active):
+        os.makedirs(path)
+        write_manifest(path, {})
+    age(stale, chunked_upload.UPLOAD_SESSION_TTL_HOURS * 3600 + 1)
+
+    expire_sessions(app)
+    assert sorted(os.listdir(root)) == sorted(os.path.basename(p) for p in (creating, active))
+
+def test_expiry_survives_sessions_vanishing(tmp_path, monkeypatch):
+    app = types.SimpleNamespace(config={"UPLOAD_FOLDER": str(tmp_path)})
+    os.makedirs(os.path.join(sessions_dir(app), "a" * 32))
+
+    def vanished(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(chunked_upload.os.path, "getmtime", vanished)
+    expire_sessions(app)
@@ -0,0 +1,45 @@
+import random
+import pytest
+from sections.chunker import Chunker
+
+def uncovered(chunker, text):
+    """Offsets of non-whitespace characters that no chunk contains"""
+    covered = bytearray(len(text))
+    for start, end in chunker.spans(text):
+        covered[start:end] = b"\x01" * (end - start)
+    return [i for i, c in enumerate(text) if not covered[i] and not c.isspace()]
+
+def test_unbroken_run_is_fully_covered():
+    spans = Chunker(1000, 200).spans("a" * 10000)
+    assert spans[0] == (0, 1000)
+    assert spans[1] == (800, 1800)
+    assert spans[-1][1] == 10000
+
+def test_cjk_text_is_fully_covered():
+    text = "漢字" * 2852
+    assert not uncovered(Chunker(1000, 200), text)
+
+def test_chunks_respect_size_and_overlap_words():
+    text = " ".join(f"word{i}" for i in range(2000))
+    chunker = Chunker(200, 50)
+    spans = chunker.spans(text)
+    assert all(end - start <= 200 for start, end in spans)
+    for (_, previous_end), (start, _) in zip(spans, spans[1:]):
+        assert start < previous_end
+        assert text[start - 1] == " "
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_texts_are_fully_covered(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        words = ["".join(rng.choice("abc") for _ in range(rng.choice([1, 3, 10, 80, 300])))
+                 for _ in range(rng.randint(1, 60))]
+        text = "".join(word + rng.choice([" ", "\n", "\n\n", ". ", ""]) for word in words)
+        chunk_size = rng.randint(5, 200)
+        chunker = Chunker(chunk_size, rng.randint(0, chunk_size - 1))
+        assert not uncovered(chunker, text)
+
+def test_split_pages_reports_page_range():
+    chunks = Chunker(30, 5).split_pages(["first page text here", "second page text"])
+    assert chunks[0]["page_start"] == 1
+    assert chunks[-1]["page_end"] == 2
@@ -0,0 +1,79 @@
+import sqlite3
+from contextlib import contextmanager
+import pytest
+from flask import Flask
+from sections import history
+
+# chat_history as created by installs that predate model_id and the trace columns
+ORIGINAL_SCHEMA = """
+CREATE TABLE chat_history (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, user_message TEXT NOT NULL,
+    ai_response TEXT NOT NULL, document_collection_id INTEGER, document_collection_name TEXT, source_documents TEXT,
+    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, is_deleted_by_user BOOLEAN DEFAULT FALSE, deleted_at DATETIME);
+"""
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "history.db")
+
+    @contextmanager
+    def connect():
+        conn = sqlite3.connect(path)
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    monkeypatch.setattr(history, "get_history_db_connection", connect)
+    return connect
+
+def columns(connect):
+    with connect() as conn:
+        return {row[1] for row in conn.execute("PRAGMA table_info(chat_history)")}
+
+def test_routes_register_against_an_empty_database(history_db):
+    history.register_history_routes(Flask(__name__))
+    assert columns(history_db) == set()
+
+    # What the entry points do once init_databases() has created the tables
+    with history_db() as conn:
+        conn.executescript(ORIGINAL_SCHEMA)
+    history.ensure_history_schema()
+    assert set(history.ADDED_COLUMNS) <= columns(history_db)
+
+def test_old_schema_gains_added_columns(history_db):
+    with history_db() as conn:
+        conn.executescript(ORIGINAL_SCHEMA)
+    history.register_history_routes(Flask(__name__))
+    assert set(history.ADDED_COLUMNS) <= columns(history_db)
+    with history_db() as conn:
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert set(history.HISTORY_INDEXES) <= indexes
+
+def test_search_index_backfills_rows_written_before_it(history_db):
+    history.register_history_routes(Flask(__name__))
+    assert not history._fts_available
+    with history_db() as conn:
+        conn.executescript(ORIGINAL_SCHEMA)
+        conn.execute("INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (1, 'casual leave', 'ten days')")
+        conn.commit()
+    history.ensure_history_schema()
+    assert history._fts_available
+    with history_db() as conn:
+        conn.execute("INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (1, 'sick leave', 'twelve days')")
+        conn.commit()
+        hits = conn.execute("SELECT rowid FROM chat_history_fts WHERE chat_history_fts MATCH 'leave' ORDER BY rowid").fetchall()
+    assert [row[0] for row in hits] == [1, 2]
+
+def test_index_without_triggers_is_rebuilt(history_db):
+    with history_db() as conn:
+        conn.executescript(ORIGINAL_SCHEMA)
+        conn.execute("INSERT INTO chat_history (user_id, user_message, ai_response) VALUES (1, 'notice period', 'thirty days')")
+        # Left behind by an earlier boot that created the table but not the triggers
+        conn.execute(
+            "CREATE VIRTUAL TABLE chat_history_fts USING fts5(user_message, ai_response, "
+            "content='chat_history', content_rowid='id', tokenize='porter unicode61')"
+        )
+        conn.commit()
+    history.ensure_history_search_index()
+    with history_db() as conn:
+        assert conn.execute("SELECT rowid FROM chat_history_fts WHERE chat_history_fts MATCH 'notice'").fetchall() == [(1,)]
@@ -0,0 +1,60 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.harness import HashEmbedder
+from sections.onnx_embedder import MicroBatcher
+
+class SlowEmbedder(HashEmbedder):
+    def __init__(self, seconds):
+        super().__init__()
+        self.seconds = seconds
+        self.batches = []
+
+    def encode(self, texts, **kwargs):
+        self.batches.append(len(texts))
+        time.sleep(self.seconds)
+        return super().encode(texts, **kwargs)
+
+def test_lone_query_is_not_delayed():
+    embedder = SlowEmbedder(0.0)
+    batcher = MicroBatcher(embedder)
+    batcher.encode(["warm-up"])
+    started = time.perf_counter()
+    batcher.encode(["a lone query"])
+    assert time.perf_counter() - started < 0.05
+    assert embedder.batches == [1, 1]
+
+def test_queries_arriving_during_a_batch_are_coalesced():
+    embedder = SlowEmbedder(0.02)
+    batcher = MicroBatcher(embedder, max_batch=8)
+    queries = [f"query {i}" for i in range(40)]
+    with ThreadPoolExecutor(16) as pool:
+        results = list(pool.map(lambda q: batcher.encode([q])[0], queries))
+    assert np.allclose(np.array(results), HashEmbedder().encode(queries, convert_to_numpy=True))
+    assert len(embedder.batches) < len(queries)
+    assert max(embedder.batches) <= 8
+
+def test_large_and_single_calls():
+    embedder = SlowEmbedder(0.0)
+    batcher = MicroBatcher(embedder, max_batch=4)
+    assert batcher.encode("one").shape == (embedder.get_sentence_embedding_dimension(),)
+    assert batcher.encode(["x"] * 10).shape[0] == 10
+    assert embedder.batches[-1] == 10  # already a batch: encoded directly
+
+def test_options_the_batch_cannot_honour_go_to_the_embedder():
+    calls = []
+
+    class RecordingEmbedder(HashEmbedder):
+        def encode(self, texts, **kwargs):
+            calls.append(kwargs)
+            return super().encode(texts, **kwargs)
+
+    batcher = MicroBatcher(RecordingEmbedder())
+    batcher.encode(["query"], convert_to_numpy=True, show_progress_bar=False)
+    batcher.encode(["query"], normalize_embeddings=True)
+    batcher.encode(["query"], convert_to_numpy=False)
+    assert calls == [
+        {"convert_to_numpy": True, "show_progress_bar": False},  # the coalesced call
+        {"normalize_embeddings": True},
+        {"convert_to_numpy": False},
+    ]
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+from sections import quantized_store
+from sections.quantized_store import QuantizedStore, build_quantized_store, current_version, sidecar_dir
+
+DIM = 16
+
+class FakeCollection:
+    """The parts of a Chroma collection the sidecar builder uses"""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = {}
+        self.full_reads = 0
+
+    def add(self, ids, embeddings, sources):
+        for i, embedding, source in zip(ids, embeddings, sources):
+            self.rows[i] = (np.asarray(embedding, dtype=np.float32), {"source": source})
+
+    def delete(self, ids):
+        for i in ids:
+            self.rows.pop(i, None)
+
+    def count(self):
+        return len(self.rows)
+
+    def get(self, include=()):
+        self.full_reads += 1
+        ids = list(self.rows)
+        return {
+            "ids": ids,
+            "embeddings": [self.rows[i][0].tolist() for i in ids],
+            "metadatas": [self.rows[i][1] for i in ids],
+        }
+
+def write(collection, start, n, source):
+    ids = [f"id{i}" for i in range(start, start + n)]
+    embeddings = np.random.default_rng(start).standard_normal((n, DIM)).astype(np.float32)
+    sources = [source] * n
+    collection.add(ids, embeddings, sources)
+    return {"ids": ids, "embeddings": embeddings.tolist(), "sources": sources}
+
+def load(path, collection):
+    directory = sidecar_dir(path, collection.name)
+    return QuantizedStore(directory, current_version(directory))
+
+def test_commits_apply_deltas_without_rereading_chroma(tmp_path):
+    path = str(tmp_path)
+    collection = FakeCollection("c")
+    build_quantized_store(path, collection, "int8", added=write(collection, 0, 50, "a.pdf"), deleted=[])
+    assert collection.full_reads == 1  # no sidecar yet
+
+    build_quantized_store(path, collection, "int8", added=write(collection, 50, 30, "b.pdf"), deleted=[])
+    deleted = [f"id{i}" for i in range(10)]
+    collection.delete(deleted)
+    build_quantized_store(path, collection, "int8", added=None, deleted=deleted)
+    assert collection.full_reads == 1
+
+    store = load(path, collection)
+    assert sorted(store.ids) == sorted(collection.rows)
+    assert len(store.source_rows("a.pdf")) == 40 and len(store.source_rows("b.pdf")) == 30
+    for row, i in enumerate(store.ids):
+        assert np.allclose(store.full[row], collection.rows[i][0])
+    query = collection.rows["id60"][0]
+    ids, distances = store.search(query, 3)
+    assert ids[0] == "id60" and distances[0] < 1e-6
+
+def test_drift_falls_back_to_full_rebuild(tmp_path):
+    path = str(tmp_path)
+    collection = FakeCollection("c")
+    build_quantized_store(path, collection, "int8", added=write(collection, 0, 20, "a.pdf"), deleted=[])
+    write(collection, 20, 5, "lost.pdf")  # a writer that never committed
+    build_quantized_store(path, collection, "int8", added=write(collection, 25, 5, "b.pdf"), deleted=[])
+    assert collection.full_reads == 2
+    assert sorted(load(path, collection).ids) == sorted(collection.rows)
+
+def test_only_the_replaced_version_is_removed(tmp_path):
+    path = str(tmp_path)
+    collection = FakeCollection("c")
+    first = build_quantized_store(path, collection, "float16", added=write(collection, 0, 10, "a.pdf"), deleted=[])
+    directory = sidecar_dir(path, "c")
+    # A version another builder is still writing must survive this build
+    other = "9999999999999-1"
+    with open(os.path.join(directory, f"meta-{other}.json"), "w") as f:
+        f.write("{}")
+    second = build_quantized_store(path, collection, "float16", added=write(collection, 10, 10, "a.pdf"), deleted=[])
+    names = os.listdir(directory)
+    assert not any(first in name for name in names)
+    assert any(second in name for name in names)
+    assert f"meta-{other}.json" in names
+    assert load(path, collection).mode == "float16"
+
+def test_query_collection_serves_from_sidecar(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    collection = FakeCollection("c")
+    build_quantized_store(path, collection, "int8", added=write(collection, 0, 40, "a.pdf"), deleted=[])
+    monkeypatch.setattr(quantized_store, "VECTOR_QUANTIZATION", "int8")
+    store = quantized_store.get_quantized_store(path, "c")
+    ids, _ = store.search(collection.rows["id7"][0], 1, source="a.pdf")
+    assert ids == ["id7"]
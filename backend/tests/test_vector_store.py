@@ -0,0 +1,119 @@
+import os
+import multiprocessing
+import numpy as np
+import pytest
+from sections import vector_store
+from sections.vector_store import open_store
+
+DIM = 16
+
+def vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+def fill(path, name, n=200, sources=4):
+    store = open_store(path, name, create=True, backend="numpy")
+    embeddings = vectors(n)
+    store.add(
+        [f"id{i}" for i in range(n)], embeddings, [f"doc {i}" for i in range(n)],
+        [{"source": f"file{i % sources}.pdf", "page": i % 7} for i in range(n)]
+    )
+    store.commit()
+    return embeddings
+
+def brute_force(embeddings, query, k, rows=None):
+    rows = np.arange(len(embeddings)) if rows is None else np.asarray(rows)
+    distances = ((embeddings[rows] - query) ** 2).sum(axis=1)
+    order = np.argsort(distances)[:k]
+    return [f"id{r}" for r in rows[order]], distances[order]
+
+def test_search_matches_brute_force(tmp_path):
+    embeddings = fill(str(tmp_path), "c")
+    query = vectors(1, seed=1)[0]
+    results = open_store(str(tmp_path), "c").query([query.tolist()], n_results=5)
+    ids, distances = brute_force(embeddings, query, 5)
+    assert results["ids"][0] == ids
+    assert np.allclose(results["distances"][0], distances, atol=1e-4)
+    assert results["documents"][0][0] == f"doc {ids[0][2:]}"
+
+def test_filters(tmp_path):
+    embeddings = fill(str(tmp_path), "c")
+    store = open_store(str(tmp_path), "c")
+    query = vectors(1, seed=2)[0]
+    rows = [i for i in range(200) if i % 4 == 1 and i % 7 == 3]
+    results = store.query([query.tolist()], n_results=3, where={"source": "file1.pdf", "page": 3})
+    assert results["ids"][0] == brute_force(embeddings, query, 3, rows)[0]
+    assert all(m["source"] == "file1.pdf" for m in results["metadatas"][0])
+    assert len(store.get(where={"source": "file2.pdf"})["ids"]) == 50
+    with pytest.raises(ValueError):
+        store.get(where={"page": {"$gt": 3}})
+
+def test_ivf_finds_exact_neighbours_of_stored_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(vector_store, "IVF_MIN_ROWS", 100)
+    monkeypatch.setattr(vector_store, "IVF_NPROBE", 4)
+    embeddings = fill(str(tmp_path), "c", n=400)
+    store = open_store(str(tmp_path), "c")
+    assert store.centroids is not None
+    results = store.query(embeddings[:10].tolist(), n_results=1)
+    assert [ids[0] for ids in results["ids"]] == [f"id{i}" for i in range(10)]
+    # A selective filter falls back to an exact scan
+    query = vectors(1, seed=3)[0]
+    rows = list(range(3, 400, 4))
+    filtered = store.query([query.tolist()], n_results=5, where={"source": "file3.pdf"})
+    assert filtered["ids"][0] == brute_force(embeddings, query, 5, rows)[0]
+
+def test_delete_and_add_in_one_commit(tmp_path):
+    fill(str(tmp_path), "c", n=10)
+    store = open_store(str(tmp_path), "c")
+    store.delete(["id0", "id1"])
+    store.add(["new"], vectors(1, seed=4), ["new doc"], [{"source": "new.pdf"}])
+    store.commit()
+    store = open_store(str(tmp_path), "c")
+    assert store.count() == 9
+    assert "id0" not in store.get()["ids"] and "new" in store.get()["ids"]
+
+def test_commit_removes_only_the_replaced_version(tmp_path):
+    fill(str(tmp_path), "c", n=10)
+    store = open_store(str(tmp_path), "c")
+    directory, previous = store.directory, store.version
+    # A version whose name extends the replaced one, e.g. pid 12 and pid 123
+    other = f"meta-{previous}3.json"
+    with open(os.path.join(directory, other), "w") as f:
+        f.write("{}")
+    store.add(["new"], vectors(1, seed=4), ["new doc"], [{"source": "new.pdf"}])
+    store.commit()
+    names = os.listdir(directory)
+    assert other in names
+    assert not any(name.endswith((f"-{previous}.npy", f"-{previous}.json", f"-{previous}.bin")) for name in names)
+
+def test_concurrent_commits_from_one_version_keep_both(tmp_path):
+    fill(str(tmp_path), "c", n=1)
+    first, second = open_store(str(tmp_path), "c"), open_store(str(tmp_path), "c")
+    first.add(["a"], vectors(1, seed=5), ["a"], [{"source": "a.pdf"}])
+    second.add(["b"], vectors(1, seed=6), ["b"], [{"source": "b.pdf"}])
+    first.commit()
+    second.commit()
+    assert sorted(open_store(str(tmp_path), "c").get()["ids"]) == ["a", "b", "id0"]
+
+def test_handles_do_not_share_pending_writes(tmp_path):
+    fill(str(tmp_path), "c", n=1)
+    writer, other = open_store(str(tmp_path), "c"), open_store(str(tmp_path), "c")
+    writer.add(["a"], vectors(1, seed=7), ["a"], [{"source": "a.pdf"}])
+    other.delete(["id0"])
+    writer.commit()
+    assert sorted(open_store(str(tmp_path), "c").get()["ids"]) == ["a", "id0"]
+
+def _add_rows(path, prefix, count):
+    for i in range(count):
+        store = open_store(path, "c")
+        store.add([f"{prefix}{i}"], vectors(1, seed=i), [prefix], [{"source": f"{prefix}.pdf"}])
+        store.commit()
+
+def test_commits_from_several_processes_keep_every_row(tmp_path):
+    fill(str(tmp_path), "c", n=1)
+    context = multiprocessing.get_context("fork")
+    workers = [context.Process(target=_add_rows, args=(str(tmp_path), prefix, 10)) for prefix in "pq"]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert open_store(str(tmp_path), "c").count() == 21